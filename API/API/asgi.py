@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+
+/api/interact-with-ai-async only pays off under an ASGI server, e.g.
+    gunicorn API.asgi:application -k uvicorn.workers.UvicornWorker
 """
 
 import os
@@ -13,4 +16,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'API.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from data.search import warm_search_indexes  # noqa: E402, needs the apps loaded above
+from data.upstream import with_lifespan  # noqa: E402
+
+# Closes the pooled OpenAI and ElevenLabs connections when the worker shuts down
+application = with_lifespan(django_application)
+
+# Part search indexes are built as the worker starts rather than on the first search
+warm_search_indexes()
@@ -46,6 +46,67 @@ AWS_S3_REGION_NAME= os.getenv('AWS_S3_REGION_NAME')
 
 DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
 
+# Optional size-bounded spool of synthesized audio, for debugging
+TTS_SPOOL_DIR = os.getenv('TTS_SPOOL_DIR')
+TTS_SPOOL_MAX_BYTES = int(os.getenv('TTS_SPOOL_MAX_BYTES', 50 * 1024 * 1024))
+
+# Cache of synthesized audio for repeated phrases
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', os.path.join(BASE_DIR, 'tts_cache'))
+TTS_CACHE_MEMORY_BYTES = int(os.getenv('TTS_CACHE_MEMORY_BYTES', 32 * 1024 * 1024))
+TTS_CACHE_DISK_BYTES = int(os.getenv('TTS_CACHE_DISK_BYTES', 512 * 1024 * 1024))
+
+# Connection pool shared by the async OpenAI and ElevenLabs calls, per worker
+UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', 60))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', 100))
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_KEEPALIVE_CONNECTIONS', 20))
+
+# Lifetime of /api/audio/<token> links. Clips live in the default cache, so
+# deployments with several workers need a shared CACHES backend.
+AUDIO_URL_TTL = int(os.getenv('AUDIO_URL_TTL', 60))
+
+# Prompt window for long sessions: older turns are folded into a summary
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 3000))
+PROMPT_RECENT_TURNS = int(os.getenv('PROMPT_RECENT_TURNS', 6))
+PROMPT_SUMMARY_TOKENS = int(os.getenv('PROMPT_SUMMARY_TOKENS', 400))
+
+# Answer graded turns from data.responder's templates instead of the model
+FAST_REPLIES_ENABLED = os.getenv('FAST_REPLIES_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Sessions, turn locks and idempotent responses live in the cache. With more
+# than one worker it has to be shared by all of them, e.g. Redis; the default
+# per-process cache only serializes turns within one worker (check data.W001).
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
+# Conversations are kept in this cache and written to the database behind
+# the turns, at most this many seconds later. 0 writes every turn through,
+# which several workers on per-process caches need (check data.W001).
+SESSION_CACHE_ALIAS = os.getenv('SESSION_CACHE_ALIAS', 'default')
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', 5))
+
+# interact-with-ai replays a response to a repeated Idempotency-Key for this
+# many seconds; turns of one session wait up to TURN_LOCK_TIMEOUT for each other
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 300))
+TURN_LOCK_TIMEOUT = float(os.getenv('TURN_LOCK_TIMEOUT', 120))
+
+# In-memory catalog indexes (challenge sampler, part search, answer grading,
+# serial lookup) are rebuilt when this many seconds old, so imports run by
+# other processes are picked up
+CATALOG_INDEX_TTL = int(os.getenv('CATALOG_INDEX_TTL', 300))
+
+# Pre-generated opening turns kept ready by run_warm_pool_worker
+WARM_POOL_SIZE = int(os.getenv('WARM_POOL_SIZE', 20))
+
+# Local directory where admin catalog uploads wait for the import worker
+IMPORT_STAGING_DIR = os.getenv('IMPORT_STAGING_DIR', os.path.join(BASE_DIR, 'import_staging'))
+# A running import job without a heartbeat for this many seconds is claimed again
+IMPORT_JOB_STALE_AFTER = int(os.getenv('IMPORT_JOB_STALE_AFTER', 300))
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -100,6 +161,11 @@ CSRF_TRUSTED_ORIGINS=os.getenv('CSRF_TRUSTED_ORIGINS')
 # Allow specific headers
 CORS_ALLOW_HEADERS = list(default_headers) + [
     'X-CSRFToken',
+    'idempotency-key',
+]
+# Lets browser clients tell a replayed interact-with-ai response from a new one
+CORS_EXPOSE_HEADERS = [
+    'Idempotent-Replayed',
 ]
 
 CSRF_COOKIE_NAME = "csrftoken"
@@ -5,7 +5,7 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from rest_framework.routers import DefaultRouter
 from data.admin import PartAdmin
-from data.views import MachineModelViewSet, PartViewSet, animation_presigned_url, avatar_presigned_url, get_csrf_token, interact_with_ai
+from data.views import MachineModelViewSet, PartViewSet, animation_presigned_url, audio_clip, avatar_assets, catalog_tree, avatar_presigned_url, get_csrf_token, interact_with_ai, interact_with_ai_async
 
 router = DefaultRouter()
 router.register(r'machine-models', MachineModelViewSet)
@@ -16,6 +16,10 @@ urlpatterns = [
     path('admin/data/part/upload-excel/', admin.site.admin_view(PartAdmin.upload_excel), name='upload_excel'),
     path('api/', include(router.urls)),  # API URLs
     path('api/interact-with-ai', interact_with_ai, name='interact_with_ai'),
+    path('api/interact-with-ai-async', interact_with_ai_async, name='interact_with_ai_async'),
+    path('api/catalog-tree', catalog_tree, name='catalog_tree'),
+    path('api/audio/<str:token>', audio_clip, name='audio_clip'),
+    path('api/avatar-assets', avatar_assets, name='avatar_assets'),
     path('api/avatar_presigned_url', avatar_presigned_url, name='avatar_presigned_url'),
     path('api/animation_presigned_url', animation_presigned_url, name='animation_presigned_url'),
     path('api/get-csrf-token/', get_csrf_token, name='get_csrf_token')
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'API.settings')
 
 application = get_wsgi_application()
+
+from data.search import warm_search_indexes  # noqa: E402, needs the apps loaded above
+
+# Part search indexes are built as the worker starts rather than on the first search
+warm_search_indexes()
@@ -1,13 +1,13 @@
 # admin.py
 from django.contrib import admin
-from django.shortcuts import render, redirect
-from django.urls import path
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import path, reverse
 from django.utils.html import format_html
-import re
-import pandas as pd
 from django.contrib import admin
-from .models import MachineModel, Part, Conversation
+from .models import MachineModel, Part, ImportedFile, ImportedSheet, ImportJob, Conversation, Message
 from .forms import ExcelUploadForm
+from .jobs import enqueue_import, job_status
 
 @admin.register(MachineModel)
 class MachineModelAdmin(admin.ModelAdmin):
@@ -24,6 +24,7 @@ class PartAdmin(admin.ModelAdmin):
         urls = super().get_urls()
         custom_urls = [
             path('upload-excel/', self.upload_excel, name='upload_excel'),
+            path('upload-excel/jobs/<int:job_id>/', self.admin_site.admin_view(self.import_job_status), name='import_job_status'),
         ]
         return custom_urls + urls
 
@@ -33,12 +34,12 @@ class PartAdmin(admin.ModelAdmin):
             if form.is_valid():
                 excel_file = request.FILES['excel_file']
                 try:
-                    xls = pd.ExcelFile(excel_file)
-                    for sheet_name in xls.sheet_names:
-                        df = pd.read_excel(xls, sheet_name=sheet_name)
-                        for _, row in df.iterrows():
-                            self._import_data(row, excel_file.name)  # Pass filename here
-                    self.message_user(request, "Excel file imported successfully")
+                    # The import worker picks the file up from the staging area
+                    job = enqueue_import(excel_file)
+                    self.message_user(request, format_html(
+                        'Excel file queued for import as job {}. <a href="{}">Track progress</a>',
+                        job.pk, reverse('admin:data_importjob_change', args=[job.pk])
+                    ))
                 except Exception as e:
                     self.message_user(request, f"Error importing data: {e}", level='error')
                 return redirect("..")
@@ -51,43 +52,9 @@ class PartAdmin(admin.ModelAdmin):
         }
         return render(request, 'admin/excel_upload.html', context)
 
-    def _extract_serial_numbers(self, filename):
-        # Updated regex pattern to match different filename formats
-        pattern = r'(.+?) \(PIN 1(?:FF|DW|BZ|T0)\d{3}[A-Z]{1,2}_ _[A-Z]([A-Z]?\d*)-([A-Z]?\d+)\).*'
-        match = re.search(pattern, filename)
-        if match:
-            model_name = match.group(1).strip()
-            serial_start = match.group(2)
-            serial_end = match.group(3)
-            return model_name, serial_start, serial_end
-        else:
-            raise ValueError(f'Invalid filename format: {filename}')
-
-    def _import_data(self, row, filename):
-        model_name, serial_start, serial_end = self._extract_serial_numbers(filename)
-
-        machine_model, created = MachineModel.objects.get_or_create(
-            model_name=model_name,
-            serial_number_start=serial_start,
-            serial_number_end=serial_end
-        )
-
-        part_number = row.get('Part Number')
-        description = row.get('Part Description')
-        quantity_required = row.get('Quantity Required')
-        canvas_image = row.get('Canvas Image')
-        breadcrumb = row.get('Breadcrumb')
-
-        Part.objects.update_or_create(
-            machine_model=machine_model,
-            part_number=part_number,
-            defaults={
-                'description': description,
-                'quantity_required': quantity_required,
-                'canvas_image': canvas_image,
-                'breadcrumb': breadcrumb
-            }
-        )
+    def import_job_status(self, request, job_id):
+        job = get_object_or_404(ImportJob, pk=job_id)
+        return JsonResponse(job_status(job))
 
     def upload_excel_link(self, obj):
         return format_html('<a href="{}">Upload Excel file</a>', 'upload-excel/')
@@ -97,9 +64,44 @@ class PartAdmin(admin.ModelAdmin):
 
     change_list_template = 'admin/part_change_list.html'
 
+class ImportedSheetInline(admin.TabularInline):
+    model = ImportedSheet
+    extra = 0
+    # The stored row hashes can run to thousands of entries, so they stay out of the form
+    fields = readonly_fields = ('sheet_name', 'content_hash', 'fingerprint')
+
+@admin.register(ImportedFile)
+class ImportedFileAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'machine_model', 'imported_at')
+    readonly_fields = ('machine_model', 'filename', 'content_hash', 'imported_at')
+    inlines = [ImportedSheetInline]
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'status', 'progress', 'rows_inserted', 'rows_updated', 'rows_deleted', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = [field.name for field in ImportJob._meta.fields]
+
+    def progress(self, obj):
+        if obj.status == ImportJob.QUEUED:
+            return '-'
+        if not obj.rows_to_write:
+            return f'{obj.rows_read} rows read'
+        return f'{obj.rows_written} / {obj.rows_to_write} rows written'
+
+    def has_add_permission(self, request):
+        return False
+
+class MessageInline(admin.TabularInline):
+    model = Message
+    extra = 0
+    readonly_fields = ('role', 'content', 'created_at')
+
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
-    list_display = ('session_id', 'last_interaction')
+    list_display = ('session_id', 'machine_model', 'expected_part_number', 'incorrect_attempts', 'last_interaction')
+    raw_id_fields = ('machine_model', 'expected_part')
+    inlines = [MessageInline]
     actions = ['delete_selected_conversations']
 
     def delete_selected_conversations(self, request, queryset):
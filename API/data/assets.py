@@ -0,0 +1,76 @@
+# assets.py
+import threading
+import time
+
+import boto3
+from django.conf import settings
+
+# Avatar files the 3D trainer loads on page load, by the name the client uses
+AVATAR_ASSETS = {
+    'avatar': 'Avatar/maleAvatar.glb',
+    'animations': 'Avatar/animations.glb',
+}
+PRESIGNED_URL_EXPIRY = 900  # Seconds a signed URL stays valid
+PRESIGNED_URL_MARGIN = 60  # Re-sign this long before expiry so clients never get a nearly dead URL
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """The process-wide S3 client, created on first use. boto3 clients are thread-safe."""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = boto3.client('s3',
+                                          aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                                          aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                                          region_name=settings.AWS_S3_REGION_NAME)
+    return _s3_client
+
+
+class PresignedUrlCache:
+    """Signed GET URLs per object key, reused until shortly before they expire."""
+
+    def __init__(self, expiry=PRESIGNED_URL_EXPIRY, margin=PRESIGNED_URL_MARGIN, clock=time.monotonic):
+        self.expiry = expiry
+        self.margin = margin
+        self.clock = clock
+        self._urls = {}
+        self._lock = threading.Lock()
+
+    def get(self, object_key):
+        """Return the URL for `object_key` and the seconds it has left."""
+        now = self.clock()
+        with self._lock:
+            cached = self._urls.get(object_key)
+        if cached is not None and cached[1] - now > self.margin:
+            return cached[0], int(cached[1] - now)
+
+        url = get_s3_client().generate_presigned_url('get_object', Params={
+            'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
+            'Key': object_key}, ExpiresIn=self.expiry)
+        with self._lock:
+            self._urls[object_key] = (url, now + self.expiry)
+        return url, self.expiry
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+
+
+presigned_urls = PresignedUrlCache()
+
+
+def asset_urls():
+    """
+    Signed URLs for every avatar asset. `expires_in` is the time left on the
+    oldest of them, after which the client should fetch a fresh set.
+    """
+    urls = {}
+    expires_in = PRESIGNED_URL_EXPIRY
+    for name, object_key in AVATAR_ASSETS.items():
+        urls[name], remaining = presigned_urls.get(object_key)
+        expires_in = min(expires_in, remaining)
+    return {'urls': urls, 'expires_in': expires_in}
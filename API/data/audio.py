@@ -0,0 +1,197 @@
+# audio.py
+import base64
+import io
+import json
+import logging
+import secrets
+import struct
+import wave
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+from .visemes import extract_visemes
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('wav', 'pcm16', 'mulaw')
+DELIVERIES = ('inline', 'url', 'multipart')
+DEFAULT_RATES = {'pcm16': 16000, 'mulaw': 8000}
+MIN_SAMPLE_RATE = 8000
+MULAW_MAX = 32635
+MULAW_BIAS = 132
+CLIP_CACHE_PREFIX = 'audio-clip:'
+
+
+@dataclass
+class AudioOptions:
+    """
+    How a client wants its audio: `wav` passes the TTS output through untouched,
+    `pcm16` and `mulaw` re-encode it as mono at `sample_rate`. Delivery is
+    inline base64, a short-lived fetch URL, or a binary multipart part.
+    """
+    format: str = 'wav'
+    sample_rate: int = None
+    delivery: str = 'inline'
+
+
+def parse_audio_options(data):
+    audio_format = data.get('audio_format', 'wav')
+    delivery = data.get('audio_delivery', 'inline')
+    sample_rate = data.get('sample_rate')
+
+    if audio_format not in FORMATS:
+        raise ValueError(f"audio_format must be one of: {', '.join(FORMATS)}.")
+    if delivery not in DELIVERIES:
+        raise ValueError(f"audio_delivery must be one of: {', '.join(DELIVERIES)}.")
+    if sample_rate is not None:
+        if audio_format == 'wav':
+            raise ValueError("sample_rate needs audio_format 'pcm16' or 'mulaw'.")
+        try:
+            sample_rate = int(sample_rate)
+        except (TypeError, ValueError):
+            raise ValueError("sample_rate must be an integer.")
+        if sample_rate < MIN_SAMPLE_RATE:
+            raise ValueError(f"sample_rate must be at least {MIN_SAMPLE_RATE}.")
+    elif audio_format != 'wav':
+        sample_rate = DEFAULT_RATES[audio_format]
+    return AudioOptions(format=audio_format, sample_rate=sample_rate, delivery=delivery)
+
+
+def decode_wav(data):
+    """Return the mono samples of a PCM WAV as float32 in [-1, 1], and its sample rate."""
+    with wave.open(io.BytesIO(data)) as wav_file:
+        channels = wav_file.getnchannels()
+        width = wav_file.getsampwidth()
+        rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype='<i4').astype(np.float32) / 2147483648
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {width * 8} bits")
+
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def lowpass(samples, cutoff):
+    """Windowed-sinc FIR low-pass; `cutoff` is a fraction of the sample rate."""
+    taps = 63
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = np.sinc(2 * cutoff * n) * np.hamming(taps)
+    kernel /= kernel.sum()
+    return np.convolve(samples, kernel, mode='same').astype(np.float32)
+
+
+def resample(samples, rate, target_rate):
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    if target_rate < rate:
+        # Filter out what the lower rate cannot represent before decimating
+        samples = lowpass(samples, 0.5 * target_rate / rate * 0.9)
+    length = int(round(len(samples) * target_rate / rate))
+    positions = np.arange(length) * (rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def to_pcm16(samples):
+    return (np.clip(samples, -1, 1) * 32767).astype('<i2')
+
+
+def mulaw_encode(samples):
+    """G.711 μ-law, vectorized over the whole clip."""
+    pcm = to_pcm16(samples).astype(np.int32)
+    sign = np.where(pcm < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(pcm), MULAW_MAX) + MULAW_BIAS
+    exponent = np.floor(np.log2(magnitude)).astype(np.int32) - 7
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+def wav_bytes(payload, rate, format_tag, bits):
+    # The wave module only writes integer PCM, so μ-law gets its header by hand
+    header = b'WAVE' + b'fmt ' + struct.pack('<IHHIIHH', 16, format_tag, 1, rate, rate * bits // 8, bits // 8, bits)
+    data = b'data' + struct.pack('<I', len(payload)) + payload
+    return b'RIFF' + struct.pack('<I', len(header) + len(data)) + header + data
+
+
+def try_decode_wav(audio):
+    """decode_wav, or None for audio it cannot read."""
+    try:
+        return decode_wav(audio)
+    except (wave.Error, EOFError, ValueError) as e:
+        logger.warning(f"Could not decode audio: {e!r}")
+        return None
+
+
+def encode_audio(audio, options, decoded=None):
+    """
+    Re-encode TTS output as the client asked. Returns the bytes and their
+    content type. `decoded` skips decoding when the samples are already at
+    hand; audio that cannot be decoded is passed through as it came.
+    """
+    if options.format == 'wav':
+        return audio, 'audio/wav'
+    decoded = decoded or try_decode_wav(audio)
+    if decoded is None:
+        return audio, 'audio/wav'
+    samples, rate = decoded
+    samples = resample(samples, rate, options.sample_rate)
+    if options.format == 'mulaw':
+        return wav_bytes(mulaw_encode(samples).tobytes(), options.sample_rate, 7, 8), 'audio/wav; codecs=7'
+    return wav_bytes(to_pcm16(samples).tobytes(), options.sample_rate, 1, 16), 'audio/wav; codecs=1'
+
+
+def store_clip(audio, content_type):
+    """Keep a clip for AUDIO_URL_TTL seconds behind an unguessable token."""
+    token = secrets.token_urlsafe(24)
+    cache.set(CLIP_CACHE_PREFIX + token, (audio, content_type), settings.AUDIO_URL_TTL)
+    return token
+
+
+def load_clip(token):
+    return cache.get(CLIP_CACHE_PREFIX + token)
+
+
+def audio_fields(audio, options, clip_url):
+    """
+    The audio part of a JSON payload, with the lip-sync cues for it. `clip_url`
+    turns a stored clip's token into an absolute URL; multipart delivery
+    leaves the bytes to the caller.
+    """
+    decoded = try_decode_wav(audio)
+    if decoded is None:
+        # Audio we cannot decode still plays, as it came and without lip-sync
+        content_type, visemes = 'audio/wav', []
+    else:
+        visemes = extract_visemes(*decoded)
+        audio, content_type = encode_audio(audio, options, decoded)
+    fields = {"audio": None, "audio_format": content_type, "viseme_data": {"visemes": visemes}}
+    if options.delivery == 'inline':
+        fields["audio"] = base64.b64encode(audio).decode('utf-8')
+    elif options.delivery == 'url':
+        fields["audio_url"] = clip_url(store_clip(audio, content_type))
+    return fields, audio
+
+
+def multipart_response(payload, audio, content_type, status=200):
+    """A multipart/mixed body: the JSON payload first, then the raw audio."""
+    boundary = secrets.token_hex(16)
+    body = b''.join([
+        f'--{boundary}\r\nContent-Type: application/json\r\n\r\n'.encode(),
+        json.dumps(payload, cls=DjangoJSONEncoder).encode(),
+        f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\nContent-Length: {len(audio)}\r\n\r\n'.encode(),
+        audio,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return HttpResponse(body, status=status, content_type=f'multipart/mixed; boundary={boundary}')
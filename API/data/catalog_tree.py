@@ -0,0 +1,186 @@
+# catalog_tree.py
+import logging
+
+from django.db import transaction
+
+from .models import CatalogNode, Part
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = ' > '
+EXPAND_MORE = 'expand_more'  # Icon label scraped along with the last segment
+PATH_WIDTH = 4  # Digits per sibling position in CatalogNode.path
+MAX_POSITION = 10 ** PATH_WIDTH - 1
+MAX_DEPTH = CatalogNode._meta.get_field('path').max_length // (PATH_WIDTH + 1)
+UPDATE_BATCH_SIZE = 1000
+
+
+def parse_breadcrumb(breadcrumb):
+    """
+    Path segments of a scraped breadcrumb, root first.
+
+    The scraper writes the price book title and the section segments twice,
+    e.g. 'Book > 1 Wheels > 0110 Rims > Book > 1 Wheels > 0110 Rims > 3-Piece
+    Rim - ST873088expand_more'. The repeat and the title are dropped, leaving
+    ['1 Wheels', '0110 Rims', '3-Piece Rim - ST873088'].
+    """
+    text = (breadcrumb or '').strip()
+    if text.endswith(EXPAND_MORE):
+        text = text[:-len(EXPAND_MORE)]
+    segments = [segment.strip() for segment in text.split(SEPARATOR)]
+    segments = [segment for segment in segments if segment]
+    for size in range(len(segments) // 2, 0, -1):
+        if segments[:size] == segments[size:2 * size]:
+            # The repeated prefix starts with the price book title, which is the machine model itself
+            return segments[size + 1:]
+    return segments
+
+
+def node_path(positions):
+    return ''.join(f'{position:0{PATH_WIDTH}d}.' for position in positions)
+
+
+def path_position(path):
+    """The last sibling position of a CatalogNode.path."""
+    return int(path[-PATH_WIDTH - 1:-1])
+
+
+@transaction.atomic
+def rebuild_catalog_tree(machine_model):
+    """
+    Bring the machine model's catalog tree in line with its parts'
+    breadcrumbs, and point every part at its leaf. Nodes that are still
+    named by a breadcrumb keep their id and path, so clients can hold on to
+    them across imports; new nodes are appended after their siblings and
+    nodes no breadcrumb names any more are deleted. Part counts are summed
+    in memory, so each node knows the size of its subtree without a query.
+
+    Raises ValueError when a breadcrumb is deeper than MAX_DEPTH or a node
+    would need a sibling position past MAX_POSITION, the most a path holds.
+    """
+    parts = Part.objects.filter(machine_model=machine_model).values_list('id', 'breadcrumb')
+
+    # Trie keyed by segment name; each entry is [children, part ids, subtree part count]
+    roots = {}
+    unfiled = []  # Parts without a breadcrumb
+    paths = {}  # Breadcrumbs repeat for every part of an assembly, so parse each once
+    for part_id, breadcrumb in parts.iterator(chunk_size=10000):
+        segments = paths.get(breadcrumb)
+        if segments is None:
+            segments = paths[breadcrumb] = [segment[:255] for segment in parse_breadcrumb(breadcrumb)]
+        if not segments:
+            unfiled.append(part_id)
+            continue
+        if len(segments) > MAX_DEPTH:
+            raise ValueError(f"Breadcrumb of part {part_id} is {len(segments)} levels deep; the catalog holds {MAX_DEPTH}")
+        level = roots
+        for segment in segments:
+            entry = level.get(segment)
+            if entry is None:
+                entry = level[segment] = [{}, [], 0]
+            entry[2] += 1
+            node = entry
+            level = entry[0]
+        node[1].append(part_id)
+
+    # The existing tree, keyed by each node's names from the root; ordered by path, so parents come first
+    existing = {}
+    names_by_id = {}
+    last_positions = {}  # Parent path -> highest sibling position in use
+    for node in CatalogNode.objects.filter(machine_model=machine_model):
+        names = names_by_id.get(node.parent_id, ()) + (node.name,)
+        names_by_id[node.id] = names
+        existing[names] = node
+        parent_path = node.path[:-PATH_WIDTH - 1]
+        last_positions[parent_path] = max(last_positions.get(parent_path, 0), path_position(node.path))
+
+    # One bulk insert per level, so every parent has its id before its children are created
+    assignments = []  # (node, part ids)
+    kept = []
+    level = [(None, (), name, entry) for name, entry in roots.items()]
+    depth = 0
+    created_count = 0
+    while level:
+        created = []
+        nodes = []
+        for parent, parent_names, name, entry in level:
+            names = parent_names + (name,)
+            node = existing.get(names)
+            if node is None:
+                prefix = parent.path if parent is not None else ''
+                position = last_positions[prefix] = last_positions.get(prefix, 0) + 1
+                if position > MAX_POSITION:
+                    raise ValueError(f"Catalog node '{name}' would be child number {position}; a node holds {MAX_POSITION}")
+                node = CatalogNode(
+                    machine_model=machine_model, parent=parent, name=name, path=prefix + node_path([position]), depth=depth
+                )
+                created.append(node)
+            else:
+                kept.append(node)
+            node.child_count = len(entry[0])
+            node.part_count = entry[2]
+            nodes.append((node, names))
+        CatalogNode.objects.bulk_create(created)
+        created_count += len(created)
+        next_level = []
+        for (node, names), (_, _, _, entry) in zip(nodes, level):
+            if entry[1]:
+                assignments.append((node, entry[1]))
+            next_level.extend((node, names, name, child) for name, child in entry[0].items())
+        level = next_level
+        depth += 1
+
+    CatalogNode.objects.bulk_update(kept, ['child_count', 'part_count'], batch_size=UPDATE_BATCH_SIZE)
+    for node, part_ids in assignments + [(None, unfiled)]:
+        for start in range(0, len(part_ids), UPDATE_BATCH_SIZE):
+            Part.objects.filter(id__in=part_ids[start:start + UPDATE_BATCH_SIZE]).update(catalog_node=node)
+    # Every part has been moved off the vanished nodes by now
+    kept_ids = {node.id for node in kept}
+    vanished = [node.id for node in existing.values() if node.id not in kept_ids]
+    for start in range(0, len(vanished), UPDATE_BATCH_SIZE):
+        CatalogNode.objects.filter(id__in=vanished[start:start + UPDATE_BATCH_SIZE]).delete()
+
+    node_count = len(kept) + created_count
+    logger.info(
+        f"Catalog tree rebuilt with {node_count} nodes ({created_count} new, {len(vanished)} removed) "
+        f"for machine model {machine_model.pk}"
+    )
+    return node_count
+
+
+def node_data(node):
+    return {
+        'id': node.id,
+        'name': node.name,
+        'depth': node.depth,
+        'child_count': node.child_count,
+        'part_count': node.part_count,
+    }
+
+
+def catalog_level(machine_model_id, node_id=None):
+    """
+    One level of a machine model's catalog: the node, its ancestors, its
+    children and a queryset of the parts filed directly under it, left for
+    the caller to page through. Each piece is a single lookup on the parent
+    index, the path constraint or the part's node key.
+    """
+    nodes = CatalogNode.objects.filter(machine_model_id=machine_model_id)
+    node = None
+    ancestors = []
+    if node_id is not None:
+        node = nodes.get(pk=node_id)
+        segment = PATH_WIDTH + 1
+        prefixes = [node.path[:end] for end in range(segment, len(node.path), segment)]
+        ancestors = list(nodes.filter(path__in=prefixes)) if prefixes else []
+
+    children = list(nodes.filter(parent=node))
+    parts = Part.objects.none()
+    if node is not None and node.part_count > sum(child.part_count for child in children):
+        parts = Part.objects.filter(catalog_node=node)
+    return {
+        'node': node_data(node) if node else None,
+        'ancestors': [node_data(ancestor) for ancestor in ancestors],
+        'children': [node_data(child) for child in children],
+        'parts': parts.values('id', 'part_number', 'description', 'quantity_required'),
+    }
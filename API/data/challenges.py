@@ -0,0 +1,67 @@
+# challenges.py
+import random
+
+from .models import Message
+from .sampler import challenge_sampler
+from .serials import random_serial_number
+
+CHAT_MODEL = "gpt-4o-mini"
+
+
+def generate_random_serial_number(serial_start, serial_end):
+    if not serial_start or not serial_end:
+        raise ValueError("Serial start and end cannot be empty")
+
+    # Check if serial numbers are numeric
+    if serial_start.isdigit() and serial_end.isdigit():
+        return str(random.randint(int(serial_start), int(serial_end))).zfill(6)
+    else:
+        # Handle case where serial start has a prefix
+        prefix = ''
+        if not serial_start[0].isdigit():
+            prefix = serial_start[0]
+            serial_start = serial_start[1:]
+
+            if serial_start.isdigit() and serial_end.isdigit():
+                # Ensure that the numeric part of serial_end is greater than serial_start
+                if int(serial_end) > int(serial_start):
+                    numeric_part = str(random.randint(int(serial_start), int(serial_end))).zfill(5)
+                    return prefix + numeric_part
+                else:
+                    raise ValueError("Invalid range for alphanumeric serial numbers")
+            else:
+                raise ValueError("Invalid serial number format after removing prefix")
+        else:
+            raise ValueError("Invalid serial number format")
+
+
+def build_initial_prompt(machine_model, serial_number, part_to_find):
+    return (
+        f"You are a customer who owns a machine model '{machine_model.model_name}' with the serial number '{serial_number}'. "
+        f"You need a part but don't know the part number. The part you need is described as '{part_to_find.description}'. "
+        f"Location of the part: '{part_to_find.breadcrumb}'. "
+        "Ask the support representative to help you identify the correct part number based on the description of the part you need. "
+        "Do not reveal the part number, but check if the representative provides the correct one."
+        "If the representative provides an incorrect part number respond with: 'I just looked it up and that is not the correct part I am looking for!' "
+        "If the representative provides a correct part number, then respond with: 'That is correct, thank you!' "
+        "Also, provide a facial expression that matches your response. The available facial expressions are: smile, sad, angry, surprised, funnyFace, and default. "
+    )
+
+
+def sample_challenge(rng=random):
+    """A random (machine model, part, serial number) for a new challenge."""
+    machine_model, part_to_find = challenge_sampler.sample(rng)
+    if machine_model.serial_low is not None:
+        serial_number = random_serial_number(machine_model, rng)
+    else:
+        serial_number = generate_random_serial_number(machine_model.serial_number_start, machine_model.serial_number_end)
+    return machine_model, part_to_find, serial_number
+
+
+def challenge_history(machine_model, serial_number, part_to_find):
+    """The system messages that open a challenge."""
+    return [
+        {"role": Message.SYSTEM, "content": build_initial_prompt(machine_model, serial_number, part_to_find)},
+        {"role": Message.SYSTEM, "content": f"Expected part number: {part_to_find.part_number}"},
+        {"role": Message.SYSTEM, "content": f"Part location: {part_to_find.breadcrumb}"},
+    ]
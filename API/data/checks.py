@@ -0,0 +1,24 @@
+# checks.py
+from django.conf import settings
+from django.core import checks
+
+from .sessions import cache_is_shared
+
+
+@checks.register(checks.Tags.caches)
+def check_session_cache(app_configs, **kwargs):
+    """
+    Turn locks, Idempotency-Key replays (data.idempotency) and sessions
+    written behind (data.sessions) live in the session cache, so they only
+    hold across workers that share it.
+    """
+    if cache_is_shared():
+        return []
+    return [checks.Warning(
+        f"The '{settings.SESSION_CACHE_ALIAS}' cache is per-process, so interact-with-ai turns are only "
+        "serialized, replayed and kept up to date within one worker process.",
+        hint="Set REDIS_URL, or point SESSION_CACHE_ALIAS at a cache every worker shares, before running "
+             "more than one worker. Without one, set SESSION_FLUSH_INTERVAL=0 so every turn is written "
+             "through and checked against the database.",
+        id='data.W001',
+    )]
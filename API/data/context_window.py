@@ -0,0 +1,107 @@
+# context_window.py
+import re
+
+from django.conf import settings
+
+from .models import Message
+
+MESSAGE_OVERHEAD = 4  # Tokens the chat format adds around each message
+SUMMARY_HEADING = "Summary of the earlier conversation:"
+SUMMARY_LINE_CHARS = 160
+SPEAKERS = {Message.USER: 'Representative', Message.ASSISTANT: 'Customer'}
+PART_NUMBER = re.compile(r'\b[A-Z]{1,3}-?\d{4,}\b', re.IGNORECASE)
+TOKEN_PIECE = re.compile(r'\w+|[^\w\s]')
+SENTENCE = re.compile(r'(?<=[.!?])\s+')
+
+
+def estimate_tokens(text):
+    """
+    Local estimate of the model's token count: one token per punctuation mark
+    and roughly one per six characters of each word, which tracks the BPE
+    tokenizers closely enough for budgeting without calling the API.
+    """
+    return sum(1 + (len(piece) - 1) // 6 for piece in TOKEN_PIECE.findall(text))
+
+
+def message_tokens(message):
+    return estimate_tokens(message['content']) + MESSAGE_OVERHEAD
+
+
+def summarize_message(message):
+    """One extractive summary line: the first sentence, plus any part numbers it left out."""
+    content = ' '.join(message['content'].split())
+    line = SENTENCE.split(content, 1)[0]
+    if len(line) > SUMMARY_LINE_CHARS:
+        line = line[:SUMMARY_LINE_CHARS - 3].rstrip() + '...'
+    missing = [number for number in dict.fromkeys(PART_NUMBER.findall(content)) if number not in line]
+    if missing:
+        line += f" (mentions {', '.join(missing)})"
+    return f"{SPEAKERS.get(message['role'], message['role'])}: {line}"
+
+
+def merge_summary(summary, messages, max_tokens):
+    """
+    Fold `messages` into a stored summary, dropping its oldest lines once it
+    outgrows `max_tokens`. Only the newly folded messages are summarized.
+    """
+    lines = summary.splitlines() if summary else []
+    lines += [summarize_message(message) for message in messages]
+    total = sum(estimate_tokens(line) for line in lines)
+    while len(lines) > 1 and total > max_tokens:
+        total -= estimate_tokens(lines.pop(0))
+    return '\n'.join(lines)
+
+
+def split_turns(messages):
+    """Group dialogue messages into turns, each starting at a user message."""
+    turns = []
+    for message in messages:
+        if message['role'] == Message.USER or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def fit_history(conversation, history, reserved=0):
+    """
+    The prompt history for a turn. System messages stay pinned, the last
+    PROMPT_RECENT_TURNS turns are kept verbatim and older turns are folded
+    into `conversation.prompt_summary`. More turns are folded while the
+    estimate exceeds PROMPT_TOKEN_BUDGET less the `reserved` tokens of this
+    turn's own messages, down to the latest turn.
+
+    Messages already folded are skipped, so each message is summarized once
+    and the prompt size stays flat however long the session runs. The
+    conversation's summary fields are updated in place and saved with it.
+    """
+    pinned = [message for message in history if message['role'] == Message.SYSTEM]
+    dialogue = [
+        message for message in history
+        if message['role'] != Message.SYSTEM and message['seq'] > conversation.prompt_summary_through
+    ]
+    turns = split_turns(dialogue)
+    budget = settings.PROMPT_TOKEN_BUDGET - reserved - sum(message_tokens(message) for message in pinned)
+
+    def summary_tokens(summary):
+        return estimate_tokens(summary) + estimate_tokens(SUMMARY_HEADING) + MESSAGE_OVERHEAD if summary else 0
+
+    folded = []
+    keep = max(settings.PROMPT_RECENT_TURNS, 1)
+    while len(turns) > keep:
+        folded += turns.pop(0)
+    summary = merge_summary(conversation.prompt_summary, folded, settings.PROMPT_SUMMARY_TOKENS) if folded else conversation.prompt_summary
+    recent_tokens = sum(message_tokens(message) for turn in turns for message in turn)
+    while len(turns) > 1 and summary_tokens(summary) + recent_tokens > budget:
+        turn = turns.pop(0)
+        folded += turn
+        recent_tokens -= sum(message_tokens(message) for message in turn)
+        summary = merge_summary(summary, turn, settings.PROMPT_SUMMARY_TOKENS)
+
+    if folded:
+        conversation.prompt_summary = summary
+        conversation.prompt_summary_through = folded[-1]['seq']
+
+    window = list(pinned)
+    if summary:
+        window.append({'role': Message.SYSTEM, 'content': f"{SUMMARY_HEADING}\n{summary}"})
+    return window + [message for turn in turns for message in turn]
@@ -0,0 +1,136 @@
+# grading.py
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+
+from django.dispatch import receiver
+
+from .models import Part
+from .indexes import MachineModelIndexRegistry
+from .search import normalize_part_number
+from .signals import catalog_imported
+
+logger = logging.getLogger(__name__)
+
+CORRECT = 'correct'
+WRONG_PART = 'wrong_part'  # Names a real part of the machine model, just not the expected one
+NO_PART = 'no_part'  # Names no part of the machine model, e.g. a question
+
+
+class PartNumberMatcher:
+    """
+    Aho-Corasick automaton over normalized part numbers (upper case, letters
+    and digits only). One pass over a message finds every part number in it,
+    however many the catalog holds. Matches must start and end on a word
+    boundary of the original text, so 'AT-467 532' matches AT467532 but
+    'AT4675320' does not match AT4675.
+    """
+
+    def __init__(self, part_numbers):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        self.part_numbers = {}  # Normalized -> as written in the catalog
+
+        for part_number in part_numbers:
+            normalized = normalize_part_number(part_number)
+            if not normalized or normalized in self.part_numbers:
+                continue
+            self.part_numbers[normalized] = part_number
+            state = 0
+            for char in normalized:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = next_state
+            self.output[state] = (normalized,)
+
+        # Breadth-first so every failure link points at an already finished state
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def __contains__(self, normalized):
+        return normalized in self.part_numbers
+
+    def find(self, text):
+        """Normalized part numbers mentioned in `text`, in order of first mention."""
+        # Letters and digits only, remembering where each word of the original starts and ends
+        chars, starts, ends = [], [], []
+        previous_alnum = False
+        for index, char in enumerate(text):
+            alnum = char.isascii() and char.isalnum()
+            if alnum:
+                chars.append(char.upper())
+                starts.append(not previous_alnum)
+                ends.append(index + 1 == len(text) or not (text[index + 1].isascii() and text[index + 1].isalnum()))
+            previous_alnum = alnum
+
+        found = {}
+        state = 0
+        for position, char in enumerate(chars):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if not self.output[state] or not ends[position]:
+                continue
+            for normalized in self.output[state]:
+                if starts[position - len(normalized) + 1]:
+                    found.setdefault(normalized, position)
+        return sorted(found, key=found.get)
+
+
+def build_matcher(machine_model_id):
+    part_numbers = Part.objects.filter(machine_model_id=machine_model_id).values_list('part_number', flat=True)
+    matcher = PartNumberMatcher(part_numbers.iterator(chunk_size=10000))
+    logger.info(f"Part number matcher built with {len(matcher.part_numbers)} parts for machine model {machine_model_id}")
+    return matcher
+
+
+part_number_matchers = MachineModelIndexRegistry(build_matcher)
+
+
+@dataclass
+class Grade:
+    verdict: str
+    mentioned: list = field(default_factory=list)  # Part numbers as written in the catalog
+
+
+def grade_answer(machine_model_id, expected_part_number, text):
+    """Classify a trainee's message against the expected part number."""
+    expected = normalize_part_number(expected_part_number)
+    catalog = part_number_matchers.get(machine_model_id) if machine_model_id else PartNumberMatcher([])
+    found = catalog.find(text)
+    mentioned = [catalog.part_numbers[normalized] for normalized in found]
+
+    if expected in catalog:
+        correct = expected in found
+    else:
+        # The expected part left the catalog, or the session has no machine model
+        correct = bool(PartNumberMatcher([expected_part_number]).find(text))
+        if correct:
+            mentioned.append(expected_part_number)
+
+    if correct:
+        verdict = CORRECT
+    elif mentioned:
+        verdict = WRONG_PART
+    else:
+        verdict = NO_PART
+    return Grade(verdict=verdict, mentioned=mentioned)
+
+
+@receiver(catalog_imported)
+def drop_part_number_matcher(sender, result=None, **kwargs):
+    part_number_matchers.invalidate(result.machine_model.pk if result is not None else None)
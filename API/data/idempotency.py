@@ -0,0 +1,280 @@
+# idempotency.py
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, QueryDict, StreamingHttpResponse
+from rest_framework import status
+
+from .sessions import session_cache
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05  # Seconds between checks while waiting on a lock or an in-flight duplicate
+RESULT_PREFIX = 'idempotent-response:'
+IN_FLIGHT_PREFIX = 'idempotent-lock:'
+SESSION_LOCK_PREFIX = 'session-lock:'
+DONE_EVENT = b'event: done\n'  # Last event of a turn streamed to the end, see data.streaming
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+MULTIPART_CONTENT_TYPE = 'multipart/form-data'
+
+
+class CacheLock:
+    """
+    A lock shared by every worker through the session cache, as long as that
+    cache is shared (check data.W001). cache.add is atomic on locmem,
+    Memcached and Redis, and the timeout frees the lock if its holder dies
+    mid-turn. Release is check-then-delete, which is safe as long as
+    holders finish within the timeout.
+    """
+
+    def __init__(self, key, timeout=None):
+        self.key = key
+        self.timeout = settings.TURN_LOCK_TIMEOUT if timeout is None else timeout
+        self.token = uuid.uuid4().hex
+
+    def try_acquire(self):
+        return session_cache().add(self.key, self.token, self.timeout)
+
+    def acquire(self, wait):
+        deadline = time.monotonic() + wait
+        while not self.try_acquire():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    def refresh(self):
+        """Restart the timeout of a lock this holder still has."""
+        if session_cache().get(self.key) == self.token:
+            session_cache().touch(self.key, self.timeout)
+
+    def release(self):
+        if session_cache().get(self.key) == self.token:
+            session_cache().delete(self.key)
+
+
+def scope_key(session_id, key):
+    return hashlib.blake2b(f'{session_id}\0{key}'.encode(), digest_size=16).hexdigest()
+
+
+def request_data(request):
+    """
+    The fields of a turn request, read the way DRF's default parsers read
+    them for the view: form fields from urlencoded and multipart bodies,
+    JSON otherwise. A body that doesn't parse has no fields.
+    """
+    if request.content_type == FORM_CONTENT_TYPE:
+        return QueryDict(request.body, encoding=request.encoding or settings.DEFAULT_CHARSET)
+    if request.content_type == MULTIPART_CONTENT_TYPE:
+        return request.POST
+    try:
+        data = json.loads(request.body or b'{}')
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def read_request(request):
+    """
+    The idempotency key and session id of a turn request, and a fingerprint
+    of its body. Raises ValueError for a malformed key.
+    """
+    key = request.headers.get(HEADER)
+    if key is not None and not (0 < len(key) <= MAX_KEY_LENGTH and key.isprintable()):
+        raise ValueError(f"{HEADER} must be 1 to {MAX_KEY_LENGTH} printable characters.")
+    fingerprint = hashlib.blake2b(request.body, digest_size=16).hexdigest()
+    session_id = request_data(request).get('session_id')
+    return key, session_id if isinstance(session_id, str) else None, fingerprint
+
+
+def replay(record, fingerprint):
+    if record['fingerprint'] != fingerprint:
+        return JsonResponse(
+            {"error": f"{HEADER} was already used for a different request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = HttpResponse(record['content'], status=record['status'], content_type=record['content_type'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def make_record(response, fingerprint, content=None):
+    return {
+        'status': response.status_code,
+        'content_type': response['Content-Type'],
+        'content': response.content if content is None else content,
+        'fingerprint': fingerprint,
+    }
+
+
+def busy_response(message):
+    return JsonResponse({"error": message}, status=status.HTTP_409_CONFLICT)
+
+
+class SerializedTurn:
+    """
+    The locks and stored response of one interact-with-ai request, shared by
+    the sync and async views; see serialized_turn. Raises ValueError for a
+    malformed Idempotency-Key.
+    """
+
+    def __init__(self, request):
+        key, session_id, self.fingerprint = read_request(request)
+        self.scope = scope_key(session_id, key) if key else None
+        self.in_flight = CacheLock(IN_FLIGHT_PREFIX + self.scope) if self.scope else None
+        self.session_lock = CacheLock(SESSION_LOCK_PREFIX + session_id) if session_id else None
+        self.refreshed_at = 0.0
+
+    def enter(self):
+        """
+        Take the turn's locks, waiting on a duplicate in flight and then on
+        the session's other turns. Returns the response to send instead of
+        running the view: a replay, or a conflict after TURN_LOCK_TIMEOUT.
+        """
+        if self.in_flight is not None:
+            deadline = time.monotonic() + settings.TURN_LOCK_TIMEOUT
+            while True:
+                record = session_cache().get(RESULT_PREFIX + self.scope)
+                if record is not None:
+                    return replay(record, self.fingerprint)
+                if self.in_flight.try_acquire():
+                    break
+                if time.monotonic() >= deadline:
+                    return busy_response("A request with this Idempotency-Key is still in progress.")
+                time.sleep(POLL_INTERVAL)
+
+        if self.session_lock is not None and not self.session_lock.acquire(wait=settings.TURN_LOCK_TIMEOUT):
+            self.release()
+            return busy_response("Another turn of this session is still in progress.")
+        # The wait for the session may have used up most of the in-flight marker's timeout
+        self.refresh(force=True)
+        return None
+
+    def refresh(self, force=False):
+        """Keep the locks alive while the turn runs; at most a few cache writes per timeout."""
+        if not force and time.monotonic() - self.refreshed_at < settings.TURN_LOCK_TIMEOUT / 4:
+            return
+        self.refreshed_at = time.monotonic()
+        for lock in (self.session_lock, self.in_flight):
+            if lock is not None:
+                lock.refresh()
+
+    def store(self, response, content=None):
+        if self.scope and response.status_code < 500:
+            session_cache().set(
+                RESULT_PREFIX + self.scope, make_record(response, self.fingerprint, content), settings.IDEMPOTENCY_TTL
+            )
+
+    def release(self):
+        """Free the locks; safe to repeat, a lock taken over by another request is left alone."""
+        if self.session_lock is not None:
+            self.session_lock.release()
+        if self.in_flight is not None:
+            self.in_flight.release()
+
+
+class HeldStream:
+    """
+    A streamed turn's content, passed through with the turn's locks held.
+    They are released when the stream ends, or when the server closes the
+    response, which it does even for a stream that is never read. A stream
+    that fails midway still has status 200 but ends with an `error` event
+    instead of `done`; only one that ended with `done` is stored, so a retry
+    of a failed one runs the turn again.
+    """
+
+    def __init__(self, content, response, turn):
+        self.content = content
+        self.response = response
+        self.turn = turn
+
+    def __aiter__(self):
+        return self.stream()
+
+    async def stream(self):
+        chunks = []
+        completed = False
+        try:
+            async for chunk in self.content:
+                chunks.append(chunk)
+                yield chunk
+                await sync_to_async(self.turn.refresh)()
+            completed = bool(chunks) and chunks[-1].startswith(DONE_EVENT)
+        finally:
+            if completed:
+                await sync_to_async(self.turn.store)(self.response, b''.join(chunks))
+            await sync_to_async(self.turn.release)()
+
+    def close(self):
+        self.turn.release()
+
+
+def serialized_turn(view):
+    """
+    Run interact-with-ai turns one at a time per session, across workers,
+    and make them idempotent under an Idempotency-Key header: a duplicate
+    of a finished request gets the stored response back for
+    IDEMPOTENCY_TTL seconds, and a duplicate of one still running waits for
+    it instead of starting a second completion. Responses with a 5xx status
+    are not stored, so the client may retry them. Works on sync and async
+    views; streamed responses hold the session until the stream ends and, if
+    it ended with its `done` event, are replayed as one body.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method != 'POST':
+                return await view(request, *args, **kwargs)
+            try:
+                turn = SerializedTurn(request)
+            except ValueError as ve:
+                return JsonResponse({"error": str(ve)}, status=status.HTTP_400_BAD_REQUEST)
+            # Waiting for the locks sleeps between polls, so it runs off the event loop
+            refusal = await sync_to_async(turn.enter, thread_sensitive=False)()
+            if refusal is not None:
+                return refusal
+
+            response = None
+            try:
+                response = await view(request, *args, **kwargs)
+                if isinstance(response, StreamingHttpResponse):
+                    response.streaming_content = HeldStream(response.streaming_content, response, turn)
+                else:
+                    await sync_to_async(turn.store)(response)
+                return response
+            finally:
+                if not isinstance(response, StreamingHttpResponse):
+                    await sync_to_async(turn.release)()
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return view(request, *args, **kwargs)
+        try:
+            turn = SerializedTurn(request)
+        except ValueError as ve:
+            return JsonResponse({"error": str(ve)}, status=status.HTTP_400_BAD_REQUEST)
+        refusal = turn.enter()
+        if refusal is not None:
+            return refusal
+
+        try:
+            response = view(request, *args, **kwargs)
+            # DRF responses render lazily; the stored copy needs the bytes now
+            if turn.scope and hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            turn.store(response)
+            return response
+        finally:
+            turn.release()
+    return wrapper
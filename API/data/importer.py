@@ -0,0 +1,512 @@
+# importer.py
+import hashlib
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+
+import openpyxl
+from django.db import transaction
+
+from .catalog_tree import rebuild_catalog_tree
+from .models import ImportedFile, ImportedSheet, MachineModel, OpeningTurn, Part
+from .serials import serial_range_fields
+from .signals import catalog_imported
+
+logger = logging.getLogger(__name__)
+
+# Maps the price-book column headers onto Part fields
+COLUMN_MAP = {
+    'Part Number': 'part_number',
+    'Part Description': 'description',
+    'Quantity Required': 'quantity_required',
+    'Canvas Image': 'canvas_image',
+    'Breadcrumb': 'breadcrumb',
+}
+REQUIRED_HEADERS = ('Part Number', 'Part Description', 'Quantity Required', 'Breadcrumb')
+UPDATE_FIELDS = ['description', 'quantity_required', 'canvas_image', 'breadcrumb', 'content_hash']
+DEFAULT_BATCH_SIZE = 1000
+# Shared-string cells in a sheet's XML, e.g. <c r="A2" t="s"><v>3</v></c>
+SHARED_STRING_REF = re.compile(rb'<(?:\w+:)?c\b[^>]*\bt="s"[^>]*>\s*<(?:\w+:)?v>(\d+)<')
+
+
+@dataclass
+class SheetResult:
+    sheet_name: str
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    unchanged: bool = False
+    content_hash: str = ''
+    fingerprint: str = ''
+    row_hashes: list = field(default_factory=list)  # [part number, row hash] per row, None for skipped rows
+    read: bool = True  # False when the sheet's rows were taken from the last import
+
+
+@dataclass
+class ImportResult:
+    filename: str
+    machine_model: MachineModel
+    sheets: list = field(default_factory=list)
+    inserted_parts: list = field(default_factory=list)
+    updated_parts: list = field(default_factory=list)
+    deleted_parts: list = field(default_factory=list)
+    unchanged: bool = False
+    # Progress counters
+    rows_read: int = 0
+    rows_to_write: int = 0
+    rows_written: int = 0
+
+    @property
+    def inserted(self):
+        return len(self.inserted_parts)
+
+    @property
+    def updated(self):
+        return len(self.updated_parts)
+
+    @property
+    def deleted(self):
+        return len(self.deleted_parts)
+
+    @property
+    def skipped(self):
+        return sum(sheet.skipped for sheet in self.sheets)
+
+    def diff(self):
+        return {
+            'inserted': self.inserted_parts,
+            'updated': self.updated_parts,
+            'deleted': self.deleted_parts,
+        }
+
+    def summary(self):
+        if self.unchanged:
+            return f"{self.filename}: unchanged since the last import"
+        changed_sheets = sum(1 for sheet in self.sheets if not sheet.unchanged)
+        return (
+            f"{self.filename}: {self.inserted} inserted, {self.updated} updated, "
+            f"{self.deleted} deleted, {self.skipped} skipped; "
+            f"{changed_sheets} of {len(self.sheets)} sheets changed"
+        )
+
+
+def extract_serial_numbers(filename):
+    # Matches the price-book filename formats, e.g.
+    # "260E Articulated Dump Truck (PIN 1DW260EX_ _D677827-708124) - PC15085.xlsx"
+    # The factory code letter is kept on the start serial so the D and F price
+    # books for the same numeric range stay separate machine models.
+    pattern = r'(.+?) \(PIN 1(?:FF|DW|BZ|T0)\d{3}[A-Z]{1,2}_ _([A-Z]{1,2}\d*)-([A-Z]?\d+)\).*'
+    match = re.search(pattern, os.path.basename(filename))
+    if match:
+        model_name = match.group(1).strip()
+        serial_start = match.group(2)
+        serial_end = match.group(3)
+        return model_name, serial_start, serial_end
+    else:
+        raise ValueError(f'Invalid filename format: {filename}')
+
+
+def adopt_legacy_machine_model(model_name, serial_start, serial_end):
+    """
+    Price books imported before the factory letter was kept are stored under
+    the bare number, so D677827 and F677827 share one machine model keyed
+    677827. The first book imported for such a range takes that row over, so
+    its id and conversations carry on and the import diff drops the other
+    factory's parts; a legacy row left once the new key exists is deleted.
+    """
+    if not serial_start[:1].isalpha():
+        return
+    legacy = MachineModel.objects.filter(
+        model_name=model_name,
+        serial_number_start=serial_start[1:],
+        serial_number_end=serial_end,
+    )
+    key = {'model_name': model_name, 'serial_number_start': serial_start, 'serial_number_end': serial_end}
+    if MachineModel.objects.filter(**key).exists():
+        deleted, _ = legacy.delete()
+        if deleted:
+            logger.info(f"Deleted the legacy machine model for {model_name} {serial_start}-{serial_end}")
+    elif legacy.update(serial_number_start=serial_start, **serial_range_fields(serial_start, serial_end)):
+        logger.info(f"Re-keyed the legacy machine model for {model_name} to {serial_start}-{serial_end}")
+
+
+def resolve_machine_model(filename):
+    model_name, serial_start, serial_end = extract_serial_numbers(filename)
+    adopt_legacy_machine_model(model_name, serial_start, serial_end)
+    machine_model, created = MachineModel.objects.get_or_create(
+        model_name=model_name,
+        serial_number_start=serial_start,
+        serial_number_end=serial_end,
+        defaults=serial_range_fields(serial_start, serial_end)
+    )
+    if not created and machine_model.serial_low is None:
+        # Machine models created before serial ranges were parsed
+        fields = serial_range_fields(serial_start, serial_end)
+        if fields['serial_low'] is not None:
+            for name, value in fields.items():
+                setattr(machine_model, name, value)
+            machine_model.save(update_fields=list(fields))
+    return machine_model
+
+
+def hash_file(source):
+    hasher = hashlib.blake2b(digest_size=16)
+    if hasattr(source, 'read'):
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            hasher.update(chunk)
+        source.seek(0)
+    else:
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def find_unchanged_import(filename, file_hash):
+    model_name, serial_start, serial_end = extract_serial_numbers(filename)
+    return ImportedFile.objects.filter(
+        machine_model__model_name=model_name,
+        machine_model__serial_number_start=serial_start,
+        machine_model__serial_number_end=serial_end,
+        content_hash=file_hash,
+    ).select_related('machine_model').first()
+
+
+class StreamingWorkbook:
+    """
+    Re-iterable row source that streams a workbook with openpyxl in read-only
+    mode. Every sheet's header row is validated when the workbook is opened,
+    rows are then generated one at a time so memory stays flat however large
+    the workbook is.
+    """
+
+    def __init__(self, source):
+        self._workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+        self._columns = {}
+        try:
+            self._validate_headers()
+        except Exception:
+            self.close()
+            raise
+
+    def fingerprint(self, sheet_name):
+        """
+        A hash of what the sheet's rows are made of, taken without parsing
+        them: the sheet's XML, the shared strings its cells refer to, and
+        the styles. Strings another sheet adds to the shared table leave it
+        unchanged, so editing one sheet does not make the others look edited.
+        An openpyxl without the internals this reads gets a hash of the
+        parsed rows instead, which costs a read of the sheet.
+        """
+        worksheet = self._workbook[sheet_name]
+        archive, path, strings = self._internals(worksheet)
+        if archive is None or path is None or strings is None:
+            return self._row_fingerprint(worksheet)
+        xml = archive.read(path)
+        hasher = hashlib.blake2b(xml, digest_size=16)
+        for index in sorted({int(index) for index in SHARED_STRING_REF.findall(xml)}):
+            hasher.update(b'\x1f' + (str(strings[index]) if index < len(strings) else '').encode('utf-8'))
+        for name in archive.namelist():
+            if name.endswith('styles.xml'):
+                hasher.update(f'\x1e{archive.getinfo(name).CRC}'.encode('ascii'))
+        return hasher.hexdigest()
+
+    def _internals(self, worksheet):
+        # The read-only workbook keeps the archive open; openpyxl 3.1, pinned
+        # in requirements.txt, names it _archive
+        return (
+            getattr(self._workbook, '_archive', None),
+            getattr(worksheet, '_worksheet_path', None),
+            getattr(worksheet, '_shared_strings', None),
+        )
+
+    def _row_fingerprint(self, worksheet):
+        hasher = hashlib.blake2b(b'rows', digest_size=16)
+        for row in self._rows(worksheet, self._columns[worksheet.title]):
+            hasher.update(repr(row).encode('utf-8'))
+        return hasher.hexdigest()
+
+    def _validate_headers(self):
+        for worksheet in self._workbook.worksheets:
+            header = next(worksheet.iter_rows(max_row=1, values_only=True), None)
+            if not header or all(cell is None for cell in header):
+                # Empty placeholder sheets such as 'dummy'
+                continue
+            header = [str(cell).strip() if cell is not None else None for cell in header]
+            missing = [name for name in REQUIRED_HEADERS if name not in header]
+            if missing:
+                raise ValueError(f"Sheet '{worksheet.title}' is missing columns: {', '.join(missing)}")
+            self._columns[worksheet.title] = [
+                header.index(name) if name in header else None for name in COLUMN_MAP
+            ]
+
+    def sheets(self):
+        for sheet_name, positions in self._columns.items():
+            worksheet = self._workbook[sheet_name]
+            yield sheet_name, self._rows(worksheet, positions)
+
+    def _rows(self, worksheet, positions):
+        for row in worksheet.iter_rows(min_row=2, values_only=True):
+            yield tuple(
+                row[position] if position is not None and position < len(row) else None
+                for position in positions
+            )
+
+    def close(self):
+        self._workbook.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse_workbook(source):
+    """
+    Read every sheet of a price-book workbook into column arrays.
+    Returns a list of (sheet_name, columns, fingerprint) for the sheets that
+    hold parts.
+    """
+    sheets = []
+    with StreamingWorkbook(source) as workbook:
+        for sheet_name, rows in workbook.sheets():
+            columns = {field_name: [] for field_name in COLUMN_MAP.values()}
+            for row in rows:
+                for field_name, value in zip(COLUMN_MAP.values(), row):
+                    columns[field_name].append(value)
+            sheets.append((sheet_name, columns, workbook.fingerprint(sheet_name)))
+    return sheets
+
+
+class ParsedWorkbook:
+    """Re-iterable row source over sheets parsed into column arrays."""
+
+    def __init__(self, sheets):
+        self._sheets = sheets
+        self._fingerprints = {sheet_name: fingerprint for sheet_name, _, fingerprint in sheets}
+
+    def fingerprint(self, sheet_name):
+        return self._fingerprints[sheet_name]
+
+    def sheets(self):
+        for sheet_name, columns, _ in self._sheets:
+            yield sheet_name, zip(*(columns[field_name] for field_name in COLUMN_MAP.values()))
+
+
+def _clean_quantity(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return int(float(value))
+        except (TypeError, ValueError, OverflowError):
+            return None
+
+
+def clean_row(row):
+    """
+    Normalise a raw (part number, description, quantity, canvas image, breadcrumb)
+    row. Returns None for rows without a part number, description or quantity.
+    """
+    part_number, description, quantity_required, canvas_image, breadcrumb = row
+    part_number = str(part_number).strip() if part_number is not None else ''
+    quantity_required = _clean_quantity(quantity_required)
+    if not part_number or description is None or quantity_required is None:
+        return None
+    return (
+        part_number,
+        str(description),
+        quantity_required,
+        str(canvas_image) if canvas_image else None,
+        str(breadcrumb) if breadcrumb is not None else None,
+    )
+
+
+def hash_row(row):
+    values = ('' if value is None else str(value) for value in row)
+    return hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def upsert_parts(parts):
+    Part.objects.bulk_create(
+        parts,
+        update_conflicts=True,
+        unique_fields=['machine_model', 'part_number'],
+        update_fields=UPDATE_FIELDS,
+    )
+
+
+def write_workbook(filename, workbook, file_hash='', force=False, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Apply one price-book file to the catalog in a single transaction.
+
+    The first pass hashes every sheet and row and picks the last row for each
+    part number. A sheet whose fingerprint matches the last import is not read
+    at all: its row hashes are taken from ImportedSheet. Only rows whose hash
+    differs from the stored part are written, in a second pass over the
+    sheets that hold them, and parts that are no longer in the file are
+    deleted from the machine model.
+
+    `progress`, if given, is called with the ImportResult as its row counters
+    advance.
+    """
+    if not hasattr(workbook, 'sheets'):
+        workbook = ParsedWorkbook(workbook)
+
+    with transaction.atomic():
+        machine_model = resolve_machine_model(filename)
+        result = ImportResult(filename=os.path.basename(filename), machine_model=machine_model)
+        imported_file, created = ImportedFile.objects.get_or_create(
+            machine_model=machine_model,
+            defaults={'filename': result.filename}
+        )
+        if file_hash and not force and imported_file.content_hash == file_hash:
+            result.unchanged = True
+            return result
+
+        stored_sheets = {sheet.sheet_name: sheet for sheet in imported_file.sheets.all()}
+        stored_rows = dict(
+            Part.objects.filter(machine_model=machine_model).values_list('part_number', 'content_hash')
+        )
+
+        # First pass: hash sheets and rows, the last row for a part number wins
+        winners = {}  # part_number -> (sheet_index, row_index, row_hash)
+        for sheet_index, (sheet_name, rows) in enumerate(workbook.sheets()):
+            sheet_result = SheetResult(sheet_name=sheet_name, fingerprint=workbook.fingerprint(sheet_name))
+            stored = stored_sheets.get(sheet_name)
+            if not force and stored is not None and stored.fingerprint == sheet_result.fingerprint:
+                sheet_result.read = False
+                sheet_result.unchanged = True
+                sheet_result.content_hash = stored.content_hash
+                sheet_result.row_hashes = stored.row_hashes
+            else:
+                sheet_hasher = hashlib.blake2b(digest_size=16)
+                for row in rows:
+                    result.rows_read += 1
+                    if progress and result.rows_read % batch_size == 0:
+                        progress(result)
+                    row = clean_row(row)
+                    if row is None:
+                        sheet_result.row_hashes.append(None)
+                        continue
+                    row_hash = hash_row(row)
+                    sheet_hasher.update(row_hash.encode('ascii'))
+                    sheet_result.row_hashes.append([row[0], row_hash])
+                sheet_result.content_hash = sheet_hasher.hexdigest()
+                sheet_result.unchanged = stored is not None and stored.content_hash == sheet_result.content_hash
+
+            for row_index, entry in enumerate(sheet_result.row_hashes):
+                if entry is None:
+                    sheet_result.skipped += 1
+                    continue
+                part_number, row_hash = entry
+                previous = winners.get(part_number)
+                if previous is not None:
+                    # The earlier row for this part number is superseded
+                    loser = sheet_result if previous[0] == sheet_index else result.sheets[previous[0]]
+                    loser.skipped += 1
+                winners[part_number] = (sheet_index, row_index, row_hash)
+            result.sheets.append(sheet_result)
+
+        pending = {}  # sheet_index -> {row_index: row_hash}
+        for part_number, (sheet_index, row_index, row_hash) in winners.items():
+            if stored_rows.get(part_number) != row_hash:
+                pending.setdefault(sheet_index, {})[row_index] = row_hash
+                result.rows_to_write += 1
+        if progress:
+            progress(result)
+
+        # Second pass: write the changed rows, skipping sheets without any
+        batch = []
+        for sheet_index, (sheet_name, rows) in enumerate(workbook.sheets()):
+            wanted = pending.get(sheet_index)
+            if not wanted:
+                continue
+            sheet_result = result.sheets[sheet_index]
+            for row_index, row in enumerate(rows):
+                if row_index not in wanted:
+                    continue
+                part_number, description, quantity_required, canvas_image, breadcrumb = clean_row(row)
+                if part_number in stored_rows:
+                    sheet_result.updated += 1
+                    result.updated_parts.append(part_number)
+                else:
+                    sheet_result.inserted += 1
+                    result.inserted_parts.append(part_number)
+                batch.append(Part(
+                    machine_model=machine_model,
+                    part_number=part_number,
+                    description=description,
+                    quantity_required=quantity_required,
+                    canvas_image=canvas_image,
+                    breadcrumb=breadcrumb,
+                    content_hash=wanted[row_index],
+                ))
+                if len(batch) >= batch_size:
+                    upsert_parts(batch)
+                    result.rows_written += len(batch)
+                    batch = []
+                    if progress:
+                        progress(result)
+        if batch:
+            upsert_parts(batch)
+            result.rows_written += len(batch)
+            if progress:
+                progress(result)
+
+        # Parts dropped from the price book
+        result.deleted_parts = sorted(set(stored_rows) - set(winners))
+        for start in range(0, len(result.deleted_parts), batch_size):
+            Part.objects.filter(
+                machine_model=machine_model,
+                part_number__in=result.deleted_parts[start:start + batch_size]
+            ).delete()
+
+        # Remember the hashes for the next import
+        imported_file.sheets.exclude(sheet_name__in=[sheet.sheet_name for sheet in result.sheets]).delete()
+        ImportedSheet.objects.bulk_create(
+            [
+                ImportedSheet(
+                    imported_file=imported_file,
+                    sheet_name=sheet.sheet_name,
+                    content_hash=sheet.content_hash,
+                    fingerprint=sheet.fingerprint,
+                    row_hashes=sheet.row_hashes,
+                )
+                for sheet in result.sheets if sheet.read
+            ],
+            update_conflicts=True,
+            unique_fields=['imported_file', 'sheet_name'],
+            update_fields=['content_hash', 'fingerprint', 'row_hashes'],
+        )
+        imported_file.filename = result.filename
+        imported_file.content_hash = file_hash
+        imported_file.save()
+
+        if result.inserted or result.updated or result.deleted:
+            rebuild_catalog_tree(machine_model)
+            # Pooled openings may quote a description or location that just changed
+            OpeningTurn.objects.filter(machine_model=machine_model).delete()
+            transaction.on_commit(lambda: catalog_imported.send(sender=Part, result=result))
+
+    logger.info(result.summary())
+    return result
+
+
+def import_workbook(source, filename=None, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    filename = filename or getattr(source, 'name', None) or str(source)
+    # Fail on a bad filename before spending time parsing the workbook
+    extract_serial_numbers(filename)
+
+    file_hash = hash_file(source)
+    imported_file = find_unchanged_import(filename, file_hash)
+    if imported_file is not None:
+        return ImportResult(
+            filename=os.path.basename(filename),
+            machine_model=imported_file.machine_model,
+            unchanged=True
+        )
+    with StreamingWorkbook(source) as workbook:
+        return write_workbook(filename, workbook, file_hash=file_hash, batch_size=batch_size, progress=progress)
@@ -0,0 +1,107 @@
+# indexes.py
+import functools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class LazyIndex:
+    """
+    An in-memory index over the catalog, built on first use by `build()`.
+    catalog_imported drops it in the process that ran the import; other
+    processes pick the import up when it is CATALOG_INDEX_TTL seconds old.
+    An expired index keeps being served while a background thread builds its
+    replacement, so only the first use of a cold index waits on the build.
+    A build that raced an invalidation is not kept.
+    """
+
+    def __init__(self, build, ttl=None):
+        self.build = build
+        self.ttl = ttl  # Seconds; None reads CATALOG_INDEX_TTL
+        self._lock = threading.Lock()
+        self._building = threading.Lock()
+        self._index = None
+        self._built_at = 0.0
+        self._generation = 0
+
+    def get(self, wait=True):
+        """The index, built now if it is cold; None if it is cold and another caller is building it, unless `wait`."""
+        with self._lock:
+            index, built_at, generation = self._index, self._built_at, self._generation
+        if index is not None:
+            ttl = settings.CATALOG_INDEX_TTL if self.ttl is None else self.ttl
+            if time.monotonic() - built_at > ttl and self._building.acquire(blocking=False):
+                threading.Thread(target=self._rebuild_in_background, args=(generation,), daemon=True).start()
+            return index
+
+        if not self._building.acquire(blocking=wait):
+            return None
+        try:
+            with self._lock:
+                if self._index is not None:
+                    return self._index
+                generation = self._generation
+            return self._rebuild(generation)
+        finally:
+            self._building.release()
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._generation += 1
+
+    def _rebuild(self, generation):
+        index = self.build()
+        with self._lock:
+            if self._generation == generation:
+                self._index = index
+                self._built_at = time.monotonic()
+        return index
+
+    def _rebuild_in_background(self, generation):
+        try:
+            self._rebuild(generation)
+        except Exception as e:
+            logger.error(f"Error building {self.build}: {e}")
+        finally:
+            self._building.release()
+            connection.close()
+
+
+class MachineModelIndexRegistry:
+    """
+    A LazyIndex per machine model. `build` receives the machine model id;
+    invalidate drops one machine model's index, or all of them.
+    """
+
+    def __init__(self, build, ttl=None):
+        self.build = build
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def index(self, machine_model_id):
+        with self._lock:
+            index = self._indexes.get(machine_model_id)
+            if index is None:
+                index = self._indexes[machine_model_id] = LazyIndex(
+                    functools.partial(self.build, machine_model_id), ttl=self.ttl
+                )
+            return index
+
+    def get(self, machine_model_id):
+        return self.index(machine_model_id).get()
+
+    def invalidate(self, machine_model_id=None):
+        with self._lock:
+            if machine_model_id is None:
+                indexes = list(self._indexes.values())
+            else:
+                indexes = [self._indexes[machine_model_id]] if machine_model_id in self._indexes else []
+        for index in indexes:
+            index.invalidate()
@@ -0,0 +1,177 @@
+# jobs.py
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .importer import StreamingWorkbook, extract_serial_numbers, import_workbook
+from .models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 1.0  # Seconds between progress writes while a job runs
+HEARTBEAT_INTERVAL = 30.0  # Seconds between heartbeats of a running job without progress
+MAX_ATTEMPTS = 3  # Claims of a job whose worker keeps dying before it is failed
+
+
+def enqueue_import(uploaded_file):
+    """
+    Save an uploaded workbook to the staging area and queue it for the import
+    worker. Raises ValueError for filenames without a PIN range and for
+    sheets missing a required column, before anything is staged.
+    """
+    extract_serial_numbers(uploaded_file.name)
+    # Opening the workbook read-only checks every sheet's header row
+    StreamingWorkbook(uploaded_file).close()
+
+    os.makedirs(settings.IMPORT_STAGING_DIR, exist_ok=True)
+    staged_path = os.path.join(settings.IMPORT_STAGING_DIR, f'{uuid.uuid4()}.xlsx')
+    with open(staged_path, 'wb') as staged_file:
+        for chunk in uploaded_file.chunks():
+            staged_file.write(chunk)
+
+    return ImportJob.objects.create(filename=os.path.basename(uploaded_file.name), staged_path=staged_path)
+
+
+def claim_next_job():
+    """
+    Mark the oldest waiting job running and return it. A running job whose
+    heartbeat is older than IMPORT_JOB_STALE_AFTER seconds lost its worker
+    and waits again, until it has been claimed MAX_ATTEMPTS times.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.IMPORT_JOB_STALE_AFTER)
+    # skip_locked lets several workers share the queue without double-claiming
+    with transaction.atomic():
+        jobs = (
+            ImportJob.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=ImportJob.QUEUED) | Q(status=ImportJob.RUNNING, heartbeat_at__lt=stale))
+            .order_by('created_at')
+        )
+        for job in jobs:
+            now = timezone.now()
+            if job.attempts >= MAX_ATTEMPTS:
+                logger.error(f"Import job {job.pk} lost its worker {job.attempts} times, giving up")
+                job.status = ImportJob.FAILED
+                job.message = f"The import worker stopped responding {job.attempts} times."
+                job.finished_at = now
+                job.save(update_fields=['status', 'message', 'finished_at'])
+                continue
+            if job.status == ImportJob.RUNNING:
+                logger.warning(f"Reclaiming import job {job.pk}, its worker stopped responding")
+            job.status = ImportJob.RUNNING
+            job.attempts += 1
+            job.started_at = now
+            job.heartbeat_at = now
+            job.save(update_fields=['status', 'attempts', 'started_at', 'heartbeat_at'])
+            return job
+    return None
+
+
+class ProgressReporter(threading.Thread):
+    """
+    Writes a running job's row counters on a timer. The import holds its own
+    transaction open for the whole file, so the counters are saved from this
+    thread's separate connection where pollers can see them straight away.
+    Every write is also the job's heartbeat, sent at least every
+    `heartbeat_interval` seconds, so a job whose worker died can be reclaimed.
+    """
+
+    def __init__(self, job, interval=PROGRESS_INTERVAL, heartbeat_interval=HEARTBEAT_INTERVAL):
+        super().__init__(daemon=True)
+        self.job = job
+        self.interval = interval
+        self.heartbeat_interval = heartbeat_interval
+        self.counters = None
+        self._saved = None
+        self._done = threading.Event()
+
+    def update(self, result):
+        self.counters = {
+            'rows_read': result.rows_read,
+            'rows_to_write': result.rows_to_write,
+            'rows_written': result.rows_written,
+        }
+
+    def run(self):
+        try:
+            last_beat = time.monotonic()
+            while not self._done.wait(self.interval):
+                counters = self.counters
+                changed = counters and counters != self._saved
+                if changed or time.monotonic() - last_beat >= self.heartbeat_interval:
+                    ImportJob.objects.filter(pk=self.job.pk).update(
+                        **(counters if changed else {}), heartbeat_at=timezone.now()
+                    )
+                    self._saved = counters
+                    last_beat = time.monotonic()
+        except Exception as e:
+            logger.error(f"Error saving progress for import job {self.job.pk}: {e}")
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def run_job(job, progress_interval=PROGRESS_INTERVAL):
+    reporter = ProgressReporter(job, interval=progress_interval)
+    reporter.start()
+    try:
+        result = import_workbook(job.staged_path, job.filename, progress=reporter.update)
+    except Exception as e:
+        reporter.stop()
+        logger.error(f"Import job {job.pk} failed: {e}")
+        job.status = ImportJob.FAILED
+        job.message = str(e)
+        job.finished_at = timezone.now()
+        job.save()
+        return job
+
+    reporter.stop()
+    job.status = ImportJob.SUCCEEDED
+    job.rows_read = result.rows_read
+    job.rows_to_write = result.rows_to_write
+    job.rows_written = result.rows_written
+    job.rows_inserted = result.inserted
+    job.rows_updated = result.updated
+    job.rows_deleted = result.deleted
+    job.rows_skipped = result.skipped
+    job.message = result.summary()
+    job.finished_at = timezone.now()
+    job.save()
+
+    # Failed uploads stay staged so they can be inspected
+    try:
+        os.remove(job.staged_path)
+    except OSError:
+        pass
+    return job
+
+
+def job_status(job):
+    return {
+        'id': job.pk,
+        'filename': job.filename,
+        'status': job.status,
+        'attempts': job.attempts,
+        'rows_read': job.rows_read,
+        'rows_to_write': job.rows_to_write,
+        'rows_written': job.rows_written,
+        'rows_inserted': job.rows_inserted,
+        'rows_updated': job.rows_updated,
+        'rows_deleted': job.rows_deleted,
+        'rows_skipped': job.rows_skipped,
+        'message': job.message,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'heartbeat_at': job.heartbeat_at,
+        'finished_at': job.finished_at,
+    }
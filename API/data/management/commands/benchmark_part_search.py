@@ -0,0 +1,70 @@
+# data/management/commands/benchmark_part_search.py
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from data.models import MachineModel
+from data.search import NgramIndex, search_parts
+
+WORDS = [
+    'bolt', 'nut', 'washer', 'screw', 'bracket', 'hose', 'clamp', 'seal', 'gasket', 'bearing', 'shaft',
+    'pin', 'bushing', 'filter', 'valve', 'cylinder', 'pump', 'sensor', 'harness', 'cover', 'plate', 'spring',
+    'ring', 'fitting', 'tube', 'wheel', 'rim', 'hub', 'cab', 'door', 'mirror', 'lamp', 'switch', 'relay',
+]
+
+class Command(BaseCommand):
+    help = 'Measure part search latency on a synthetic catalog or on the real database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--parts', type=int, default=300000, help='Size of the synthetic catalog')
+        parser.add_argument('--queries', type=int, default=2000, help='Number of timed searches')
+        parser.add_argument(
+            '--machine-model', type=int,
+            help='Search this machine model through the configured database instead of a synthetic index'
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        if options['machine_model']:
+            if not MachineModel.objects.filter(pk=options['machine_model']).exists():
+                raise CommandError(f"Machine model {options['machine_model']} does not exist")
+            part_numbers = list(
+                MachineModel.objects.get(pk=options['machine_model']).parts.values_list('part_number', flat=True)
+            )
+            if not part_numbers:
+                raise CommandError('The machine model has no parts')
+            search = lambda query: search_parts(options['machine_model'], query)
+            self.stdout.write(f"Searching {len(part_numbers)} parts on {connection.vendor}")
+        else:
+            rows = [
+                (number, f'{rng.choice("ADRT")}{rng.choice("TH")}{rng.randrange(10 ** 6):06d}',
+                 f'{rng.randrange(1, 40)} - {" ".join(rng.sample(WORDS, 3))}', 'Group > Section')
+                for number in range(options['parts'])
+            ]
+            part_numbers = [row[1] for row in rows]
+            start = time.perf_counter()
+            index = NgramIndex(rows)
+            self.stdout.write(f"Built an index over {len(index)} parts in {time.perf_counter() - start:.1f}s")
+            search = index.search
+
+        queries = []
+        for _ in range(options['queries']):
+            part_number = rng.choice(part_numbers)
+            kind = rng.randrange(3)
+            if kind == 0:
+                queries.append(part_number)
+            elif kind == 1:
+                queries.append(part_number[:rng.randrange(3, len(part_number))])
+            else:
+                queries.append(' '.join(rng.sample(WORDS, rng.randrange(1, 3))))
+
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            search(query)
+            timings.append(time.perf_counter() - start)
+
+        timings.sort()
+        for label, quantile in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            self.stdout.write(f"{label}: {timings[int(quantile * (len(timings) - 1))] * 1000:.2f}ms")
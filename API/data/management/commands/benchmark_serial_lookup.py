@@ -0,0 +1,46 @@
+# data/management/commands/benchmark_serial_lookup.py
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from data.serials import SerialIndex
+
+class Command(BaseCommand):
+    help = 'Measure serial-to-machine-model lookups over many synthetic PIN ranges'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ranges', type=int, default=100000, help='Number of synthetic serial ranges')
+        parser.add_argument('--queries', type=int, default=100000, help='Number of timed lookups')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        rows = []
+        for machine_model_id in range(options['ranges']):
+            low = rng.randrange(10 ** 6)
+            rows.append((rng.choice(['', 'C', 'D', 'F']), low, low + rng.randrange(1, 100), machine_model_id))
+
+        start = time.perf_counter()
+        index = SerialIndex.build_from(rows)
+        self.stdout.write(f"Built an index over {len(rows)} ranges in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+        queries = [f"1DW260EX{rng.choice('CDF')}{rng.choice('CDF')}{rng.randrange(10 ** 6):06d}" for _ in range(options['queries'])]
+        matches = 0
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            matches += len(SerialIndex.search(index, query))
+            timings.append(time.perf_counter() - start)
+
+        # The same lookups by linear scan, for comparison
+        sample = queries[:max(len(queries) // 100, 1)]
+        start = time.perf_counter()
+        for query in sample:
+            number = int(query[-6:])
+            [row for row in rows if row[0] == query[-7] and row[1] <= number <= row[2]]
+        scan = (time.perf_counter() - start) / len(sample)
+
+        timings.sort()
+        self.stdout.write(f"{len(queries)} lookups, {matches / len(queries):.1f} matches each on average")
+        for label, quantile in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            self.stdout.write(f"{label}: {timings[int(quantile * (len(timings) - 1))] * 1e6:.1f}us")
+        self.stdout.write(f"linear scan: {scan * 1e6:.0f}us per lookup")
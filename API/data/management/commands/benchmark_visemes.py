@@ -0,0 +1,40 @@
+# data/management/commands/benchmark_visemes.py
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from data.visemes import extract_visemes
+
+class Command(BaseCommand):
+    help = 'Time viseme extraction on synthetic speech-like audio'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=float, default=3.0, help='Length of the generated clip')
+        parser.add_argument('--rates', type=int, nargs='+', default=[16000, 24000, 44100], help='Sample rates to test')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per sample rate; the best is reported')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        self.stdout.write(f"{'Rate':>8} {'Audio (s)':>10} {'Best (ms)':>10} {'x realtime':>11} {'Cues':>7}")
+        for rate in options['rates']:
+            samples = self.speech_like(rng, rate, options['minutes'] * 60)
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                cues = extract_visemes(samples, rate)
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            seconds = len(samples) / rate
+            self.stdout.write(f"{rate:>8} {seconds:>10.0f} {best * 1000:>10.1f} {seconds / best:>11.0f} {len(cues):>7}")
+
+    @staticmethod
+    def speech_like(rng, rate, seconds):
+        # Syllable-rate bursts of voiced harmonics with noisy consonants and pauses between them
+        t = np.arange(int(rate * seconds)) / rate
+        syllable = (np.sin(2 * np.pi * 4 * t) > -0.2).astype(np.float32)
+        pause = (np.sin(2 * np.pi * 0.3 * t) > -0.8).astype(np.float32)
+        pitch = 120 + 30 * np.sin(2 * np.pi * 0.5 * t)
+        phase = 2 * np.pi * np.cumsum(pitch) / rate
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+        noise = rng.standard_normal(len(t))
+        return ((0.3 * voiced * syllable + 0.05 * noise * (1 - syllable)) * pause).astype(np.float32)
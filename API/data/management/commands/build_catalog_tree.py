@@ -0,0 +1,20 @@
+# data/management/commands/build_catalog_tree.py
+from django.core.management.base import BaseCommand, CommandError
+from data.catalog_tree import rebuild_catalog_tree
+from data.models import MachineModel
+
+class Command(BaseCommand):
+    help = 'Rebuild the catalog tree from part breadcrumbs, e.g. for catalogs imported before the tree existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--machine-model', type=int, help='Rebuild only this machine model')
+
+    def handle(self, *args, **options):
+        machine_models = MachineModel.objects.order_by('id')
+        if options['machine_model']:
+            machine_models = machine_models.filter(pk=options['machine_model'])
+            if not machine_models.exists():
+                raise CommandError(f"Machine model {options['machine_model']} does not exist")
+        for machine_model in machine_models:
+            node_count = rebuild_catalog_tree(machine_model)
+            self.stdout.write(f"{machine_model}: {node_count} nodes")
@@ -1,85 +1,145 @@
 # myapp/management/commands/import_data.py
+import glob
 import os
-import re
-import pandas as pd
-from django.core.management.base import BaseCommand
-from data.models import MachineModel, Part
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from data.importer import extract_serial_numbers, find_unchanged_import, hash_file, parse_workbook, write_workbook
+
+
+def find_price_books(source):
+    """
+    Resolve a directory or glob pattern to the price-book workbooks it holds,
+    skipping Excel lock files and files whose name carries no PIN range.
+    """
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, '*.xlsx'))
+    else:
+        paths = glob.glob(source)
+
+    price_books, rejected = [], []
+    for path in sorted(paths):
+        filename = os.path.basename(path)
+        if filename.startswith('~$') or not filename.lower().endswith('.xlsx'):
+            continue
+        try:
+            extract_serial_numbers(filename)
+        except ValueError:
+            rejected.append(path)
+            continue
+        price_books.append(path)
+    return price_books, rejected
+
+
+def parse_price_book(path):
+    # Runs in a pool worker; only the parsed column arrays go back to the writer
+    started = time.perf_counter()
+    sheets = parse_workbook(path)
+    return path, sheets, time.perf_counter() - started
+
 
 class Command(BaseCommand):
     help = 'Import data from Excel files into the database'
 
-    def handle(self, *args, **kwargs):
-        # Path to the directory containing the Excel files
-        excel_dir = r'C:\coding projects\JD_AI_PARTS\API\excel files'
-
-        # List of Excel files to be processed
-        excel_files = [
-            '260E Articulated Dump Truck (PIN 1DW260E_ _F708125-716724) - PC15346.xlsx',
-            '260E Articulated Dump Truck (PIN 1DW260E_ _D708125-716724) - PC15347.xlsx',
-            '260E Articulated Dump Truck (PIN 1DW260EX_ _D677827-708124) - PC15085.xlsx',
-            '260E Articulated Dump Truck (PIN 1DW260EX_ _F677827-708124) - PC15087.xlsx'
-        ]
-
-        for file in excel_files:
-            file_path = os.path.join(excel_dir, file)
-            self.stdout.write(self.style.SUCCESS(f'Processing file: {file_path}'))
-
-            # Check if file exists
-            if not os.path.exists(file_path):
-                self.stdout.write(self.style.ERROR(f'File not found: {file_path}'))
-                continue
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'source', nargs='?', default=os.path.join(settings.BASE_DIR, 'excel files'),
+            help='Directory or glob pattern of price-book .xlsx files'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Number of processes used to parse workbooks'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report what would be imported, running the import in a transaction that is rolled back'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Re-check every row even when a file is unchanged since the last import'
+        )
 
-            # Extract model name and serial number range from the filename
-            try:
-                model_name, serial_start, serial_end = self._extract_serial_numbers(file)
-            except ValueError as e:
-                self.stdout.write(self.style.ERROR(f'Error extracting serial numbers from file {file}: {e}'))
-                continue
+    def handle(self, *args, **options):
+        paths, rejected = find_price_books(options['source'])
+        for path in rejected:
+            self.stdout.write(self.style.ERROR(f'Error extracting serial numbers from file {path}'))
+        if not paths:
+            raise CommandError(f'No price-book files found in {options["source"]}')
+
+        # Files whose content hash matches the last import need no parsing at all
+        file_hashes = {path: hash_file(path) for path in paths}
+        if not options['force']:
+            unchanged = [path for path in paths if find_unchanged_import(path, file_hashes[path])]
+            for path in unchanged:
+                self.stdout.write(f'Unchanged since the last import: {os.path.basename(path)}')
+            paths = [path for path in paths if path not in unchanged]
+            if not paths:
+                return
 
-            # Read the Excel file
+        workers = max(1, min(options['workers'], len(paths)))
+        self.stdout.write(self.style.SUCCESS(f'Processing {len(paths)} files with {workers} workers'))
+
+        timings = []
+        started = time.perf_counter()
+        for path, sheets, parse_seconds in self._parse_all(paths, workers):
+            if sheets is None:
+                continue
+            rows = sum(len(columns['part_number']) for _, columns, _ in sheets)
+            write_started = time.perf_counter()
             try:
-                xls = pd.ExcelFile(file_path)
-                for sheet_name in xls.sheet_names:
-                    df = pd.read_excel(xls, sheet_name=sheet_name)
-                    self._import_data(df, model_name, serial_start, serial_end)
+                result = self._write(path, sheets, file_hashes[path], options)
             except Exception as e:
-                self.stdout.write(self.style.ERROR(f'Error processing file {file}: {e}'))
-
-    def _extract_serial_numbers(self, filename):
-        # Updated regex pattern to match the filename format
-        pattern = r'(.+?) \(PIN 1DW260E(X?)_ _([DF]\d+)-(\d+)\)'
-        match = re.search(pattern, filename)
-        if match:
-            model_name = match.group(1).strip()
-            serial_start = match.group(2)
-            serial_end = match.group(3)
-            return model_name, serial_start, serial_end
-        else:
-            raise ValueError(f'Invalid filename format: {filename}')
-
-    def _import_data(self, df, model_name, serial_start, serial_end):
-        # Create or update MachineModel
-        machine_model, created = MachineModel.objects.get_or_create(
-            model_name=model_name,
-            serial_number_start=serial_start,
-            serial_number_end=serial_end
-        )
+                self.stdout.write(self.style.ERROR(f'Error processing file {path}: {e}'))
+                continue
+            write_seconds = time.perf_counter() - write_started
+            summary = result.summary()
+            if options['dry_run']:
+                summary = f'Dry run, nothing written: {summary}'
+            self.stdout.write(self.style.SUCCESS(summary))
+            timings.append((os.path.basename(path), rows, parse_seconds, write_seconds))
+
+        self._write_timings(timings, time.perf_counter() - started)
+
+    def _write(self, path, sheets, file_hash, options):
+        with transaction.atomic():
+            result = write_workbook(path, sheets, file_hash=file_hash, force=options['force'])
+            if options['dry_run']:
+                # Undoes the writes and drops the catalog_imported notification with them
+                transaction.set_rollback(True)
+        return result
+
+    def _parse_all(self, paths, workers):
+        if workers == 1:
+            for path in paths:
+                yield self._parse_one(path)
+            return
+
+        # Parsing is CPU-bound, so spread it over processes and keep one writer here
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+            futures = {pool.submit(parse_price_book, path): path for path in paths}
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f'Error processing file {futures[future]}: {e}'))
+                    yield futures[future], None, 0.0
+
+    def _parse_one(self, path):
+        try:
+            return parse_price_book(path)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error processing file {path}: {e}'))
+            return path, None, 0.0
 
-        for _, row in df.iterrows():
-            part_number = row.get('Part Number')
-            description = row.get('Part Description')
-            quantity_required = row.get('Quantity Required')
-            canvas_image = row.get('Canvas Image')
-            breadcrumb = row.get('Breadcrumb')
-
-            # Create or update Part
-            Part.objects.update_or_create(
-                machine_model=machine_model,
-                part_number=part_number,
-                defaults={
-                    'description': description,
-                    'quantity_required': quantity_required,
-                    'canvas_image': canvas_image,
-                    'breadcrumb': breadcrumb
-                }
-            )
+    def _write_timings(self, timings, elapsed):
+        self.stdout.write('')
+        self.stdout.write(f'{"File":<80} {"Rows":>8} {"Parse s":>9} {"Write s":>9}')
+        for filename, rows, parse_seconds, write_seconds in timings:
+            self.stdout.write(f'{filename:<80} {rows:>8} {parse_seconds:>9.2f} {write_seconds:>9.2f}')
+        total_rows = sum(timing[1] for timing in timings)
+        self.stdout.write(f'{len(timings)} files, {total_rows} rows in {elapsed:.2f}s')
@@ -0,0 +1,39 @@
+# data/management/commands/run_import_worker.py
+import time
+
+from django.core.management.base import BaseCommand
+from data.jobs import claim_next_job, run_job
+from data.models import ImportJob
+
+class Command(BaseCommand):
+    help = 'Process queued catalog import jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll-interval', type=float, default=2.0,
+            help='Seconds to wait before checking an empty queue again'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Drain the queue and exit instead of polling forever'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Import worker started'))
+        try:
+            while True:
+                job = claim_next_job()
+                if job is None:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                self.stdout.write(f'Running import job {job.pk}: {job.filename}')
+                job = run_job(job)
+                if job.status == ImportJob.SUCCEEDED:
+                    self.stdout.write(self.style.SUCCESS(job.message))
+                else:
+                    self.stdout.write(self.style.ERROR(f'Import job {job.pk} failed: {job.message}'))
+        except KeyboardInterrupt:
+            self.stdout.write('Import worker stopped')
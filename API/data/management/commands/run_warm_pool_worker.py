@@ -0,0 +1,43 @@
+# data/management/commands/run_warm_pool_worker.py
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from openai import OpenAI
+from data.warm_pool import refill
+
+class Command(BaseCommand):
+    help = 'Keep the pool of pre-generated opening turns filled'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target', type=int, default=settings.WARM_POOL_SIZE,
+            help='Number of opening turns to keep ready'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=5.0,
+            help='Seconds to wait before checking a full pool again'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Fill the pool once and exit instead of polling forever'
+        )
+
+    def handle(self, *args, **options):
+        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        self.stdout.write(self.style.SUCCESS('Warm pool worker started'))
+        try:
+            while True:
+                try:
+                    added = refill(client, options['target'])
+                except Exception as e:
+                    # Upstream hiccups should not stop the worker
+                    self.stdout.write(self.style.ERROR(f'Refill failed: {e}'))
+                    added = 0
+                if added:
+                    self.stdout.write(f'Added {added} opening turns')
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            self.stdout.write('Warm pool worker stopped')
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+def remove_duplicate_parts(apps, schema_editor):
+    # Keep the most recently written row for each (machine_model, part_number)
+    Part = apps.get_model('data', 'Part')
+    duplicates = (
+        Part.objects.values('machine_model', 'part_number')
+        .annotate(keep_id=models.Max('id'), count=models.Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        Part.objects.filter(
+            machine_model=duplicate['machine_model'],
+            part_number=duplicate['part_number']
+        ).exclude(id=duplicate['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0003_alter_machinemodel_unique_together'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_parts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='part',
+            constraint=models.UniqueConstraint(fields=('machine_model', 'part_number'), name='unique_part_per_machine_model'),
+        ),
+    ]
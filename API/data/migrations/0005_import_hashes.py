@@ -0,0 +1,42 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0004_part_unique_part_per_machine_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='part',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='ImportedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255)),
+                ('content_hash', models.CharField(blank=True, default='', max_length=64)),
+                ('imported_at', models.DateTimeField(auto_now=True)),
+                ('machine_model', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='imported_file', to='data.machinemodel')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ImportedSheet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sheet_name', models.CharField(max_length=255)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('imported_file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sheets', to='data.importedfile')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='importedsheet',
+            constraint=models.UniqueConstraint(fields=('imported_file', 'sheet_name'), name='unique_sheet_per_imported_file'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0005_import_hashes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255)),
+                ('staged_path', models.CharField(max_length=500)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], db_index=True, default='queued', max_length=20)),
+                ('rows_read', models.IntegerField(default=0)),
+                ('rows_to_write', models.IntegerField(default=0)),
+                ('rows_written', models.IntegerField(default=0)),
+                ('rows_inserted', models.IntegerField(default=0)),
+                ('rows_updated', models.IntegerField(default=0)),
+                ('rows_deleted', models.IntegerField(default=0)),
+                ('rows_skipped', models.IntegerField(default=0)),
+                ('message', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
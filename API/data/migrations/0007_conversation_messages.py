@@ -0,0 +1,93 @@
+# Generated by Django 5.0.7 on 2026-10-18 10:54
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def history_to_messages(apps, schema_editor):
+    # Move each JSON history into Message rows and recover the challenge state
+    # that used to be string-matched out of the system messages
+    Conversation = apps.get_model('data', 'Conversation')
+    Message = apps.get_model('data', 'Message')
+    Part = apps.get_model('data', 'Part')
+
+    for conversation in Conversation.objects.exclude(history=[]).iterator():
+        messages = []
+        model_name = None
+        for item in conversation.history or []:
+            content = item.get('content', '')
+            messages.append(Message(conversation=conversation, role=item.get('role', 'user'), content=content))
+            if item.get('role') != 'system':
+                continue
+            if content.startswith('Expected part number: '):
+                conversation.expected_part_number = content.split(': ', 1)[1][:50]
+            match = re.search(r"machine model '([^']*)' with the serial number '([^']*)'", content)
+            if match:
+                model_name, conversation.serial_number = match.groups()
+        Message.objects.bulk_create(messages)
+
+        if conversation.expected_part_number:
+            parts = Part.objects.filter(part_number=conversation.expected_part_number)
+            if model_name:
+                parts = parts.filter(machine_model__model_name=model_name)
+            part = parts.first()
+            if part is not None:
+                conversation.expected_part = part
+                conversation.machine_model_id = part.machine_model_id
+        conversation.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0006_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='expected_part',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='data.part'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='expected_part_number',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='incorrect_attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='machine_model',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='data.machinemodel'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='serial_number',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('system', 'System'), ('user', 'User'), ('assistant', 'Assistant')], max_length=20)),
+                ('content', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='data.conversation')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['conversation', 'id'], name='message_conversation_id_idx')],
+            },
+        ),
+        migrations.RunPython(history_to_messages, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='conversation',
+            name='history',
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# Django compiles icontains to UPPER(column::text) LIKE UPPER(...) on Postgres,
+# so the trigram indexes are built on that same expression
+INDEXES = {
+    'data_part_number_trgm_idx': 'part_number',
+    'data_part_description_trgm_idx': 'description',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # GIN/pg_trgm only exist on Postgres; other databases search in process
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON data_part USING gin (UPPER({column}::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0007_conversation_messages'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:09
+
+import re
+
+from django.db import migrations, models
+
+
+def parse_serial_ranges(apps, schema_editor):
+    # Same rules as data.serials.parse_serial_range, frozen for this migration
+    MachineModel = apps.get_model('data', 'MachineModel')
+    for machine_model in MachineModel.objects.iterator():
+        start = re.fullmatch(r'([A-Z]{0,2})(\d+)', machine_model.serial_number_start.strip().upper())
+        end = re.fullmatch(r'([A-Z]{0,2})(\d+)', machine_model.serial_number_end.strip().upper())
+        if not start or not end or end.group(1) not in ('', start.group(1)):
+            continue
+        low, high = int(start.group(2)), int(end.group(2))
+        if low > high:
+            continue
+        machine_model.serial_prefix = start.group(1)
+        machine_model.serial_low = low
+        machine_model.serial_high = high
+        machine_model.save(update_fields=['serial_prefix', 'serial_low', 'serial_high'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0008_part_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='machinemodel',
+            name='serial_high',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='machinemodel',
+            name='serial_low',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='machinemodel',
+            name='serial_prefix',
+            field=models.CharField(blank=True, default='', max_length=2),
+        ),
+        migrations.AddIndex(
+            model_name='machinemodel',
+            index=models.Index(fields=['serial_prefix', 'serial_low', 'serial_high'], name='machine_model_serial_idx'),
+        ),
+        migrations.RunPython(parse_serial_ranges, migrations.RunPython.noop),
+    ]
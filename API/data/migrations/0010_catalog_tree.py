@@ -0,0 +1,43 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0009_machinemodel_serial_range'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('path', models.CharField(max_length=255)),
+                ('depth', models.PositiveSmallIntegerField()),
+                ('child_count', models.PositiveIntegerField(default=0)),
+                ('part_count', models.PositiveIntegerField(default=0)),
+                ('machine_model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_nodes', to='data.machinemodel')),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='data.catalognode')),
+            ],
+            options={
+                'ordering': ['path'],
+            },
+        ),
+        migrations.AddField(
+            model_name='part',
+            name='catalog_node',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='parts', to='data.catalognode'),
+        ),
+        migrations.AddIndex(
+            model_name='catalognode',
+            index=models.Index(fields=['machine_model', 'parent'], name='catalog_node_parent_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='catalognode',
+            constraint=models.UniqueConstraint(fields=('machine_model', 'path'), name='unique_catalog_node_path'),
+        ),
+    ]
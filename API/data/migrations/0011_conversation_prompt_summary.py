@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0010_catalog_tree'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='prompt_summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='prompt_summary_through',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0011_conversation_prompt_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpeningTurn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('serial_number', models.CharField(max_length=255)),
+                ('history', models.JSONField()),
+                ('text', models.TextField()),
+                ('audio', models.BinaryField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('machine_model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='data.machinemodel')),
+                ('part', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='data.part')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+def number_messages(apps, schema_editor):
+    # Messages are numbered per conversation in id order; the summary marker moves from ids to numbers
+    Conversation = apps.get_model('data', 'Conversation')
+    Message = apps.get_model('data', 'Message')
+    for conversation in Conversation.objects.iterator():
+        messages = list(Message.objects.filter(conversation=conversation).order_by('id'))
+        through = 0
+        for seq, message in enumerate(messages, start=1):
+            message.seq = seq
+            if message.id <= conversation.prompt_summary_through:
+                through = seq
+        Message.objects.bulk_update(messages, ['seq'], batch_size=1000)
+        if conversation.prompt_summary_through:
+            conversation.prompt_summary_through = through
+            conversation.save(update_fields=['prompt_summary_through'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0012_openingturn'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(number_messages, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('conversation', 'seq'), name='unique_message_seq_per_conversation'),
+        ),
+    ]
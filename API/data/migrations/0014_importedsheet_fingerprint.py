@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-18 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0013_session_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importedsheet',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='importedsheet',
+            name='row_hashes',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# Part search filters on the normalized forms of the columns (see
+# data.search.NormalizedPartNumber and NormalizedText), so the trigram
+# indexes are built on those same expressions instead of UPPER(column)
+INDEXES = {
+    'data_part_number_trgm_idx': "REGEXP_REPLACE(UPPER(part_number::text), '[^0-9A-Z]', '', 'g')",
+    'data_part_description_trgm_idx': "TRIM(REGEXP_REPLACE(LOWER(description::text), '[^0-9a-z]+', ' ', 'g'))",
+}
+PREVIOUS_INDEXES = {
+    'data_part_number_trgm_idx': 'UPPER(part_number::text)',
+    'data_part_description_trgm_idx': 'UPPER(description::text)',
+}
+
+
+def build_indexes(schema_editor, indexes):
+    # GIN/pg_trgm only exist on Postgres; other databases search in process
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, expression in indexes.items():
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+        schema_editor.execute(f'CREATE INDEX {name} ON data_part USING gin (({expression}) gin_trgm_ops)')
+
+
+def create_normalized_indexes(apps, schema_editor):
+    build_indexes(schema_editor, INDEXES)
+
+
+def restore_previous_indexes(apps, schema_editor):
+    build_indexes(schema_editor, PREVIOUS_INDEXES)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0015_importjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_normalized_indexes, restore_previous_indexes),
+    ]
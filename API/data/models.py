@@ -5,9 +5,16 @@ class MachineModel(models.Model):
     model_name = models.CharField(max_length=255)
     serial_number_start = models.CharField(max_length=255)
     serial_number_end = models.CharField(max_length=255)
+    # The serial range parsed at import, e.g. D677827-708124 is D / 677827 / 708124
+    serial_prefix = models.CharField(max_length=2, blank=True, default='')
+    serial_low = models.PositiveIntegerField(blank=True, null=True)
+    serial_high = models.PositiveIntegerField(blank=True, null=True)
     
     class Meta:
         unique_together = ('model_name', 'serial_number_start', 'serial_number_end')
+        indexes = [
+            models.Index(fields=['serial_prefix', 'serial_low', 'serial_high'], name='machine_model_serial_idx'),
+        ]
 
     def __str__(self):
         return self.model_name
@@ -19,14 +26,159 @@ class Part(models.Model):
     quantity_required = models.IntegerField()
     canvas_image = models.URLField(blank=True, null=True)
     breadcrumb = models.TextField(blank=True, null=True)
+    # Leaf of the parsed breadcrumb, rebuilt by the importer
+    catalog_node = models.ForeignKey(
+        'CatalogNode', related_name='parts', on_delete=models.SET_NULL, blank=True, null=True
+    )
+    content_hash = models.CharField(max_length=64, blank=True, default='')  # Hash of the imported row
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['machine_model', 'part_number'], name='unique_part_per_machine_model')
+        ]
 
     def __str__(self):
         return self.part_number
+
+class CatalogNode(models.Model):
+    machine_model = models.ForeignKey(MachineModel, related_name='catalog_nodes', on_delete=models.CASCADE)
+    parent = models.ForeignKey('self', related_name='children', on_delete=models.CASCADE, blank=True, null=True)
+    name = models.CharField(max_length=255)
+    # Materialized path of sibling positions, e.g. 0001.0003. for the third child of the first root
+    path = models.CharField(max_length=255)
+    depth = models.PositiveSmallIntegerField()
+    child_count = models.PositiveIntegerField(default=0)
+    part_count = models.PositiveIntegerField(default=0)  # Parts anywhere in the subtree
+
+    class Meta:
+        ordering = ['path']
+        constraints = [
+            models.UniqueConstraint(fields=['machine_model', 'path'], name='unique_catalog_node_path')
+        ]
+        indexes = [
+            models.Index(fields=['machine_model', 'parent'], name='catalog_node_parent_idx')
+        ]
+
+    def __str__(self):
+        return self.name
     
+class ImportedFile(models.Model):
+    machine_model = models.OneToOneField(MachineModel, related_name='imported_file', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    imported_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.filename
+
+class ImportedSheet(models.Model):
+    imported_file = models.ForeignKey(ImportedFile, related_name='sheets', on_delete=models.CASCADE)
+    sheet_name = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64)
+    # Hash of the sheet's parts of the .xlsx archive; a match skips reading the sheet
+    fingerprint = models.CharField(max_length=64, blank=True, default='')
+    row_hashes = models.JSONField(blank=True, default=list)  # [part number, row hash] per row, null for skipped rows
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['imported_file', 'sheet_name'], name='unique_sheet_per_imported_file')
+        ]
+
+    def __str__(self):
+        return self.sheet_name
+
+class ImportJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    filename = models.CharField(max_length=255)
+    staged_path = models.CharField(max_length=500)  # Upload saved in the staging area
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    rows_read = models.IntegerField(default=0)
+    rows_to_write = models.IntegerField(default=0)
+    rows_written = models.IntegerField(default=0)
+    rows_inserted = models.IntegerField(default=0)
+    rows_updated = models.IntegerField(default=0)
+    rows_deleted = models.IntegerField(default=0)
+    rows_skipped = models.IntegerField(default=0)
+    message = models.TextField(blank=True, default='')  # Import summary or error
+    attempts = models.PositiveSmallIntegerField(default=0)  # Times a worker claimed the job
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)  # Last sign of life from the worker running it
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'{self.filename} ({self.status})'
+
 class Conversation(models.Model):
     session_id = models.CharField(max_length=255, unique=True)
-    history = models.JSONField(default=list)  # Stores the conversation history as a list of messages
+    # Current challenge
+    machine_model = models.ForeignKey(MachineModel, related_name='+', on_delete=models.SET_NULL, blank=True, null=True)
+    expected_part = models.ForeignKey(Part, related_name='+', on_delete=models.SET_NULL, blank=True, null=True)
+    expected_part_number = models.CharField(max_length=50, blank=True, default='')
+    serial_number = models.CharField(max_length=255, blank=True, default='')
+    incorrect_attempts = models.IntegerField(default=0)
+    # Extractive summary of the turns that no longer fit the prompt, see data.context_window
+    prompt_summary = models.TextField(blank=True, default='')
+    prompt_summary_through = models.PositiveIntegerField(default=0)  # Seq of the last message folded in
+    version = models.PositiveIntegerField(default=0)  # Session state version last flushed, see data.sessions
     last_interaction = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return self.session_id   
+        return self.session_id
+
+class OpeningTurn(models.Model):
+    """A ready-to-serve first turn, see data.warm_pool."""
+    machine_model = models.ForeignKey(MachineModel, related_name='+', on_delete=models.CASCADE)
+    part = models.ForeignKey(Part, related_name='+', on_delete=models.CASCADE)
+    serial_number = models.CharField(max_length=255)
+    history = models.JSONField()  # System messages that seed the conversation
+    text = models.TextField()  # The customer's opening line
+    audio = models.BinaryField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f'{self.machine_model}: {self.part}'
+
+class Message(models.Model):
+    SYSTEM = 'system'
+    USER = 'user'
+    ASSISTANT = 'assistant'
+    ROLE_CHOICES = [
+        (SYSTEM, 'System'),
+        (USER, 'User'),
+        (ASSISTANT, 'Assistant'),
+    ]
+
+    conversation = models.ForeignKey(Conversation, related_name='messages', on_delete=models.CASCADE)
+    seq = models.PositiveIntegerField(default=0)  # Position in the conversation, the id clients see
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES)
+    content = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'seq'], name='unique_message_seq_per_conversation')
+        ]
+        indexes = [
+            models.Index(fields=['conversation', 'id'], name='message_conversation_id_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.role}: {self.content[:50]}'
@@ -0,0 +1,13 @@
+# pagination.py
+from rest_framework.pagination import CursorPagination
+
+
+class CatalogCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key: every page is one indexed range
+    scan, however deep the client pages into the catalog.
+    """
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
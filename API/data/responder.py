@@ -0,0 +1,63 @@
+# responder.py
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from .grading import CORRECT, WRONG_PART
+
+CORRECT_LINE = "That is correct, thank you!"
+WRONG_LINE = "I just looked it up and that is not the correct part I am looking for!"
+
+
+@dataclass(frozen=True)
+class Reply:
+    text: str
+    facial_expression: str
+    animation: str
+
+
+# (verdict, wrong answers so far) -> reply. A count past the last entry for a
+# verdict uses that entry. The lines are fixed, so their speech is cached too.
+TEMPLATES = {
+    (CORRECT, 0): Reply(CORRECT_LINE, "smile", "Clapping"),
+    (CORRECT, 1): Reply(f"{CORRECT_LINE} Glad we got there in the end.", "smile", "ThoughtfulHeadNod"),
+    (WRONG_PART, 1): Reply(WRONG_LINE, "sad", "ThoughtfulHeadShake"),
+    (WRONG_PART, 2): Reply(f"{WRONG_LINE} Could you check the description again?", "sad", "ThoughtfulHeadShake"),
+    (WRONG_PART, 3): Reply(
+        f"{WRONG_LINE} That is the third wrong one, please take another look at the parts diagram.",
+        "angry", "ThoughtfulHeadShake"
+    ),
+}
+
+
+def facial_expression_for(ai_response, verdict=None):
+    # Graded answers decide the expression; otherwise go by the AI response
+    if verdict == CORRECT:
+        return "smile"
+    elif verdict == WRONG_PART:
+        return "sad"
+    elif "correct, thank you" in ai_response.lower():
+        return "smile"
+    elif "not the correct part" in ai_response.lower():
+        return "sad"
+    return "default"
+
+
+def opening_reply(text):
+    """A pooled opening line, voiced the way the model's first turn would be."""
+    return Reply(text, facial_expression_for(text), "Talking")
+
+
+def fast_reply(verdict, attempts):
+    """
+    The fixed reply for a graded turn, or None when the turn is open-ended
+    and needs the model. `attempts` counts the wrong answers so far,
+    including this one.
+    """
+    if not settings.FAST_REPLIES_ENABLED:
+        return None
+    for count in range(attempts, -1, -1):
+        reply = TEMPLATES.get((verdict, count))
+        if reply is not None:
+            return reply
+    return None
@@ -0,0 +1,76 @@
+# sampler.py
+import logging
+import random
+from array import array
+
+from django.dispatch import receiver
+
+from .indexes import LazyIndex
+from .models import MachineModel, Part
+from .signals import catalog_imported
+
+logger = logging.getLogger(__name__)
+
+
+class ChallengeSampler:
+    """
+    Draws a random (machine model, part) challenge from a compact in-memory
+    index instead of evaluating whole querysets.
+
+    Part ids are held in one array sorted by machine model, with each machine
+    model owning a contiguous slice of it. With weighting='machine_model'
+    (the default) a machine model is picked uniformly and then a part within
+    it, matching the old random.choice over models then parts; with
+    weighting='part' every part is equally likely. Either way a draw is O(1)
+    followed by a single primary-key fetch.
+    """
+
+    def __init__(self, weighting='machine_model', ttl=None):
+        if weighting not in ('machine_model', 'part'):
+            raise ValueError(f'Unknown weighting: {weighting}')
+        self.weighting = weighting
+        self.index = LazyIndex(self.build, ttl=ttl)
+
+    def build(self):
+        part_ids = array('q')
+        machine_model_ids = array('q')
+        offsets = array('q')
+        rows = Part.objects.order_by('machine_model_id', 'id').values_list('machine_model_id', 'id')
+        for machine_model_id, part_id in rows.iterator(chunk_size=10000):
+            if not machine_model_ids or machine_model_ids[-1] != machine_model_id:
+                machine_model_ids.append(machine_model_id)
+                offsets.append(len(part_ids))
+            part_ids.append(part_id)
+        offsets.append(len(part_ids))
+        logger.info(f"Challenge index built with {len(part_ids)} parts over {len(machine_model_ids)} machine models")
+        return part_ids, machine_model_ids, offsets
+
+    def invalidate(self):
+        self.index.invalidate()
+
+    def _draw(self, rng):
+        part_ids, machine_model_ids, offsets = self.index.get()
+        if not part_ids:
+            raise MachineModel.DoesNotExist('No parts in the catalog')
+        if self.weighting == 'part':
+            return part_ids[rng.randrange(len(part_ids))]
+        segment = rng.randrange(len(machine_model_ids))
+        return part_ids[rng.randrange(offsets[segment], offsets[segment + 1])]
+
+    def sample(self, rng=random):
+        """Return a random (machine_model, part) pair."""
+        try:
+            part = Part.objects.select_related('machine_model').get(pk=self._draw(rng))
+        except Part.DoesNotExist:
+            # The catalog changed under a stale index
+            self.invalidate()
+            part = Part.objects.select_related('machine_model').get(pk=self._draw(rng))
+        return part.machine_model, part
+
+
+challenge_sampler = ChallengeSampler()
+
+
+@receiver(catalog_imported)
+def rebuild_challenge_index(sender, **kwargs):
+    challenge_sampler.invalidate()
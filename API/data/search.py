@@ -0,0 +1,207 @@
+# search.py
+import logging
+import re
+import threading
+
+import numpy as np
+from django.contrib.postgres.lookups import TrigramSimilar
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, F, FloatField, Func, Q, Value, When
+from django.db.models.functions import Greatest
+from django.dispatch import receiver
+
+from .indexes import MachineModelIndexRegistry
+from .models import MachineModel, Part
+from .signals import catalog_imported
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MIN_SCORE = 0.3  # Share of the query's trigrams a part must contain to be a candidate
+CANDIDATES = 200  # Trigram matches rescored with the exact/prefix/substring bonuses
+
+# Ranking bonuses on top of trigram overlap, so exact part numbers always lead
+EXACT_BONUS = 3.0
+PREFIX_BONUS = 2.0
+SUBSTRING_BONUS = 1.0
+
+
+def normalize_part_number(text):
+    return re.sub(r'[^0-9A-Z]', '', text.upper())
+
+
+def normalize_text(text):
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', text.lower()).split())
+
+
+class NormalizedPartNumber(Func):
+    """normalize_part_number in SQL; migration 0016 indexes this same expression."""
+    template = "REGEXP_REPLACE(UPPER(%(expressions)s::text), '[^0-9A-Z]', '', 'g')"
+
+
+class NormalizedText(Func):
+    """normalize_text in SQL; migration 0016 indexes this same expression."""
+    template = "TRIM(REGEXP_REPLACE(LOWER(%(expressions)s::text), '[^0-9a-z]+', ' ', 'g'))"
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def search_terms(query):
+    """The part-number and description forms of a query, and its trigrams."""
+    part_number = normalize_part_number(query)
+    text = normalize_text(query)
+    grams = trigrams(part_number.lower()) | {gram for word in text.split() for gram in trigrams(word)}
+    return part_number, text, grams
+
+
+class NgramIndex:
+    """
+    Trigram index over one machine model's parts. Each trigram of a part's
+    normalized part number and description words maps to a sorted array of
+    part positions; a query counts its trigrams' postings with one bincount
+    and only the best candidates are rescored.
+    """
+
+    def __init__(self, rows):
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.part_numbers = [row[1] for row in rows]
+        self.descriptions = [row[2] for row in rows]
+        self.breadcrumbs = [row[3] for row in rows]
+        self.normalized_numbers = [normalize_part_number(part_number) for part_number in self.part_numbers]
+        self.normalized_descriptions = [normalize_text(description or '') for description in self.descriptions]
+
+        postings = {}
+        for position, (part_number, description) in enumerate(zip(self.normalized_numbers, self.normalized_descriptions)):
+            grams = trigrams(part_number.lower())
+            for word in description.split():
+                grams |= trigrams(word)
+            for gram in grams:
+                postings.setdefault(gram, []).append(position)
+        self.postings = {gram: np.array(positions, dtype=np.int32) for gram, positions in postings.items()}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        part_number, text, grams = search_terms(query)
+        if not grams or not len(self):
+            return []
+
+        matched = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not matched:
+            return []
+        counts = np.bincount(np.concatenate(matched), minlength=len(self))
+        scores = counts / len(grams)
+
+        candidates = np.flatnonzero(scores >= MIN_SCORE)
+        if len(candidates) > CANDIDATES:
+            candidates = candidates[np.argpartition(-scores[candidates], CANDIDATES)[:CANDIDATES]]
+
+        results = []
+        for position in candidates.tolist():
+            normalized = self.normalized_numbers[position]
+            score = float(scores[position])
+            if part_number and normalized == part_number:
+                score += EXACT_BONUS
+            elif part_number and normalized.startswith(part_number):
+                score += PREFIX_BONUS
+            elif (part_number and part_number in normalized) or (text and text in self.normalized_descriptions[position]):
+                score += SUBSTRING_BONUS
+            results.append((score, position))
+
+        results.sort(key=lambda result: (-result[0], self.part_numbers[result[1]]))
+        return [self._result(position, score) for score, position in results[:limit]]
+
+    def _result(self, position, score):
+        return {
+            'id': int(self.ids[position]),
+            'part_number': self.part_numbers[position],
+            'description': self.descriptions[position],
+            'breadcrumb': self.breadcrumbs[position],
+            'score': round(score, 3),
+        }
+
+
+def build_ngram_index(machine_model_id):
+    rows = list(
+        Part.objects.filter(machine_model_id=machine_model_id).order_by('id')
+        .values_list('id', 'part_number', 'description', 'breadcrumb')
+    )
+    logger.info(f"Search index built with {len(rows)} parts for machine model {machine_model_id}")
+    return NgramIndex(rows)
+
+
+search_indexes = MachineModelIndexRegistry(build_ngram_index)
+
+
+def search_parts_postgres(machine_model_id, query, limit=DEFAULT_LIMIT):
+    """
+    Ranked search on Postgres along the lines of NgramIndex: the query and
+    the columns are normalized the same way, a part is a candidate when its
+    normalized part number or description contains the query or is
+    trigram-similar to it, and the same bonuses rank the matches. The
+    similarity is pg_trgm's, shared trigrams over all the trigrams of both
+    strings, where NgramIndex divides by the query's alone, so long
+    descriptions score lower here and the two can rank differently. The
+    pg_trgm GIN indexes from migration 0016 serve both filters.
+    """
+    part_number, text, _ = search_terms(query)
+    if not part_number:
+        return []
+    rank = Case(
+        When(number=part_number, then=Value(EXACT_BONUS)),
+        When(number__startswith=part_number, then=Value(PREFIX_BONUS)),
+        When(Q(number__contains=part_number) | Q(words__contains=text), then=Value(SUBSTRING_BONUS)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+    similarity = Greatest(TrigramSimilarity('number', part_number), TrigramSimilarity('words', text))
+    rows = (
+        Part.objects.filter(machine_model_id=machine_model_id)
+        .annotate(number=NormalizedPartNumber('part_number'), words=NormalizedText('description'))
+        .filter(
+            Q(number__contains=part_number) | Q(words__contains=text)
+            | Q(TrigramSimilar(F('number'), part_number)) | Q(TrigramSimilar(F('words'), text))
+        )
+        .annotate(score=rank + similarity)
+        .order_by('-score', 'part_number')
+        .values('id', 'part_number', 'description', 'breadcrumb', 'score')[:limit]
+    )
+    return [dict(row, score=round(row['score'], 3)) for row in rows]
+
+
+def build_search_indexes():
+    try:
+        for machine_model_id in MachineModel.objects.values_list('id', flat=True):
+            search_indexes.get(machine_model_id)
+    except Exception as e:
+        logger.error(f"Error warming the search indexes: {e}")
+    finally:
+        connection.close()
+
+
+def warm_search_indexes():
+    """
+    Build every machine model's NgramIndex on a background thread when a
+    worker starts, so no search request waits on a build. Postgres searches
+    in the database and needs none.
+    """
+    if connection.vendor != 'postgresql':
+        threading.Thread(target=build_search_indexes, daemon=True).start()
+
+
+def search_parts(machine_model_id, query, limit=DEFAULT_LIMIT):
+    """Parts of one machine model best matching a partial part number or description."""
+    if connection.vendor == 'postgresql':
+        return search_parts_postgres(machine_model_id, query, limit)
+    return search_indexes.get(machine_model_id).search(query, limit)
+
+
+@receiver(catalog_imported)
+def drop_search_index(sender, result=None, **kwargs):
+    search_indexes.invalidate(result.machine_model.pk if result is not None else None)
@@ -1,20 +1,49 @@
 # serializers.py
 from rest_framework import serializers
-from .models import MachineModel, Part, Conversation
+from .models import MachineModel, Part, Message
 
-class PartSerializer(serializers.ModelSerializer):
+def query_param_set(request, name):
+    """Comma-separated values of a query parameter, or None when it is absent."""
+    if request is None or not request.query_params.get(name):
+        return None
+    return {value.strip() for value in request.query_params[name].split(',') if value.strip()}
+
+class DynamicFieldsMixin:
+    """
+    Limits the output to the fields named in ?fields=. Fields listed in
+    `expandable_fields` are left out unless named in ?expand=.
+    """
+    expandable_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        expand = query_param_set(request, 'expand') or set()
+        for name in self.expandable_fields:
+            if name not in expand:
+                self.fields.pop(name, None)
+
+        fields = query_param_set(request, 'fields')
+        if fields is not None:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+class PartSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    # Listed so the importer's bookkeeping (content_hash, catalog_node) stays internal
     class Meta:
         model = Part
-        fields = '__all__'
+        fields = ['id', 'machine_model', 'part_number', 'description', 'quantity_required', 'canvas_image', 'breadcrumb']
 
-class MachineModelSerializer(serializers.ModelSerializer):
+class MachineModelSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     parts = PartSerializer(many=True, read_only=True)
+    expandable_fields = ('parts',)
 
     class Meta:
         model = MachineModel
         fields = '__all__'
         
-class ConversationSerializer(serializers.ModelSerializer):
-    class Meta: 
-        model = Conversation
-        fields = ['session_id', 'history', 'last_interaction']
+class MessageSerializer(serializers.ModelSerializer):
+    """A history entry as interact-with-ai returns it, from a Message or a cached session's message."""
+    class Meta:
+        model = Message
+        fields = ['seq', 'role', 'content']
@@ -0,0 +1,154 @@
+# serials.py
+import logging
+import random
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+
+from django.dispatch import receiver
+
+from .indexes import LazyIndex
+from .models import MachineModel
+from .signals import catalog_imported
+
+logger = logging.getLogger(__name__)
+
+SERIAL_PART = re.compile(r'([A-Z]{0,2})(\d+)')
+QUERY_SERIAL = re.compile(r'([A-Z]*)(\d+)')
+
+
+@dataclass(frozen=True)
+class SerialRange:
+    prefix: str
+    low: int
+    high: int
+
+
+def parse_serial_range(serial_start, serial_end):
+    """
+    Parse a price book's PIN range, e.g. ('D677827', '708124'), into its
+    factory prefix and numeric bounds. The end carries the start's prefix
+    implicitly. Returns None for ranges that don't parse.
+    """
+    start = SERIAL_PART.fullmatch((serial_start or '').strip().upper())
+    end = SERIAL_PART.fullmatch((serial_end or '').strip().upper())
+    if not start or not end or end.group(1) not in ('', start.group(1)):
+        return None
+    low, high = int(start.group(2)), int(end.group(2))
+    if low > high:
+        return None
+    return SerialRange(prefix=start.group(1), low=low, high=high)
+
+
+def serial_range_fields(serial_start, serial_end):
+    serial_range = parse_serial_range(serial_start, serial_end)
+    if serial_range is None:
+        return {'serial_prefix': '', 'serial_low': None, 'serial_high': None}
+    return {'serial_prefix': serial_range.prefix, 'serial_low': serial_range.low, 'serial_high': serial_range.high}
+
+
+def random_serial_number(machine_model, rng=random):
+    """A serial inside the machine model's parsed range, formatted like generate_random_serial_number."""
+    number = rng.randint(machine_model.serial_low, machine_model.serial_high)
+    if machine_model.serial_prefix:
+        return machine_model.serial_prefix + str(number).zfill(5)
+    return str(number).zfill(6)
+
+
+def parse_serial_query(serial):
+    """
+    The candidate (prefix, number) readings of a serial or full PIN, e.g.
+    'D677900' or '1DW260EXCD677900'. The letters before the number may carry
+    more than the prefix, so every prefix length up to two is tried.
+    """
+    match = None
+    for match in QUERY_SERIAL.finditer(re.sub(r'[^0-9A-Z]', '', (serial or '').upper())):
+        pass
+    if match is None:
+        return []
+    letters, number = match.group(1), int(match.group(2))
+    return [(letters[len(letters) - length:] if length else '', number) for length in range(min(len(letters), 2), -1, -1)]
+
+
+class SerialIndex:
+    """
+    Sorted interval index over the parsed serial ranges. Ranges are grouped by
+    prefix and sorted by their low bound, next to a running maximum of the high
+    bounds; a lookup bisects to the last range starting at or below the serial
+    and walks back while an earlier range could still reach it. Price book
+    ranges of one prefix barely overlap, so that walk is short, but it is not
+    bounded by the matches: one long range that starts early keeps the
+    running maximum up, and a serial it covers walks back over every range
+    after it, O(n) in the worst case.
+    """
+
+    def __init__(self, ttl=None):
+        self.index = LazyIndex(self.build, ttl=ttl)
+
+    @staticmethod
+    def build_from(rows):
+        """`rows` are (prefix, low, high, machine_model_id) tuples."""
+        index = {}
+        for prefix, low, high, machine_model_id in sorted(rows):
+            lows, highs, reach, ids = index.setdefault(prefix, ([], [], [], []))
+            lows.append(low)
+            highs.append(high)
+            reach.append(max(high, reach[-1]) if reach else high)
+            ids.append(machine_model_id)
+        return index
+
+    def build(self):
+        rows = MachineModel.objects.filter(serial_low__isnull=False).values_list(
+            'serial_prefix', 'serial_low', 'serial_high', 'id'
+        )
+        index = self.build_from(rows)
+        logger.info(f"Serial index built over {sum(len(group[0]) for group in index.values())} ranges")
+        return index
+
+    def invalidate(self):
+        self.index.invalidate()
+
+    @staticmethod
+    def search(index, serial):
+        """Ids of the machine models whose range covers `serial`, most specific prefix first."""
+        found = []
+        for prefix, number in parse_serial_query(serial):
+            group = index.get(prefix)
+            if group is None:
+                continue
+            lows, highs, reach, ids = group
+            position = bisect_right(lows, number) - 1
+            while position >= 0 and reach[position] >= number:
+                if highs[position] >= number:
+                    found.append(ids[position])
+                position -= 1
+            if found:
+                break
+        return found
+
+    def lookup(self, serial):
+        index = self.index.get(wait=False)
+        if index is None:
+            # Cold and being built by another request; the database answers meanwhile
+            return lookup_in_database(serial)
+        return self.search(index, serial)
+
+
+serial_index = SerialIndex()
+
+
+def lookup_in_database(serial):
+    """The same lookup as SerialIndex, answered by machine_model_serial_idx while the index is rebuilt."""
+    for prefix, number in parse_serial_query(serial):
+        ids = list(
+            MachineModel.objects.filter(serial_prefix=prefix, serial_low__lte=number, serial_high__gte=number)
+            .values_list('id', flat=True)
+        )
+        if ids:
+            return ids
+    return []
+
+
+@receiver(catalog_imported)
+def rebuild_serial_index(sender, **kwargs):
+    serial_index.invalidate()
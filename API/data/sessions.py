@@ -0,0 +1,249 @@
+# sessions.py
+import atexit
+import logging
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+SESSION_TTL = timedelta(days=1)
+CACHE_PREFIX = 'session-state:'
+MESSAGES_PREFIX = 'session-messages:'
+MESSAGE_CHUNK = 16  # Messages per cache entry; a turn rewrites only the last one or two
+CONVERSATION_FIELDS = (
+    'machine_model_id', 'expected_part_id', 'expected_part_number', 'serial_number',
+    'incorrect_attempts', 'prompt_summary', 'prompt_summary_through',
+)
+
+
+def session_cache():
+    return caches[settings.SESSION_CACHE_ALIAS]
+
+
+def cache_is_shared():
+    """Whether every worker sees the same session cache, rather than one of its own."""
+    return not isinstance(session_cache(), (LocMemCache, DummyCache))
+
+
+def checks_stored_version():
+    """
+    Whether a cached session has to be checked against the database. A
+    shared cache always holds the latest turn. A per-process cache written
+    through (SESSION_FLUSH_INTERVAL 0) is how several workers run without
+    one, and each may have missed turns the others wrote; see check data.W001.
+    """
+    return not cache_is_shared() and settings.SESSION_FLUSH_INTERVAL <= 0
+
+
+@dataclass
+class SessionState:
+    """
+    A conversation as the turns see it: the Conversation columns, the
+    expected part's location and the whole transcript. Messages are numbered
+    per session, so a turn can append to the transcript without the database
+    handing out ids. `version` grows with every saved turn.
+    """
+    session_id: str
+    machine_model_id: int = None
+    expected_part_id: int = None
+    expected_part_number: str = ''
+    part_location: str = None
+    serial_number: str = ''
+    incorrect_attempts: int = 0
+    prompt_summary: str = ''
+    prompt_summary_through: int = 0
+    last_interaction: datetime = None
+    messages: list = field(default_factory=list)  # {"seq", "role", "content"}
+    version: int = 0
+    cached_messages: int = field(default=0, repr=False, compare=False)  # How many the cache holds, see cache_session
+
+    def add_messages(self, messages):
+        added = [
+            {"seq": len(self.messages) + number, "role": message["role"], "content": message["content"]}
+            for number, message in enumerate(messages, start=1)
+        ]
+        self.messages.extend(added)
+        return added
+
+    @classmethod
+    def from_conversation(cls, conversation):
+        return cls(
+            session_id=conversation.session_id,
+            **{name: getattr(conversation, name) for name in CONVERSATION_FIELDS},
+            part_location=conversation.expected_part.breadcrumb if conversation.expected_part else None,
+            last_interaction=conversation.last_interaction,
+            messages=[
+                {"seq": seq, "role": role, "content": content}
+                for seq, role, content in conversation.messages.order_by('seq').values_list('seq', 'role', 'content')
+            ],
+            version=conversation.version,
+        )
+
+
+def message_chunk_key(session_id, chunk):
+    return f'{MESSAGES_PREFIX}{session_id}:{chunk}'
+
+
+def cache_session(state):
+    """
+    Cache a session state. The transcript is kept in chunks of MESSAGE_CHUNK
+    messages beside the other fields, and only the chunks holding messages
+    added since the state was last cached are written, so what a turn writes
+    does not grow with the conversation.
+    """
+    count = len(state.messages)
+    entries = {
+        message_chunk_key(state.session_id, chunk): state.messages[chunk * MESSAGE_CHUNK:(chunk + 1) * MESSAGE_CHUNK]
+        for chunk in range(state.cached_messages // MESSAGE_CHUNK, -(-count // MESSAGE_CHUNK))
+    }
+    entries[CACHE_PREFIX + state.session_id] = (replace(state, messages=[]), count)
+    session_cache().set_many(entries, timeout=SESSION_TTL.total_seconds())
+    state.cached_messages = count
+
+
+def cached_session(session_id):
+    """The cached state of a session, or None unless the cache holds all of it."""
+    entry = session_cache().get(CACHE_PREFIX + session_id)
+    if entry is None:
+        return None
+    state, count = entry
+    keys = [message_chunk_key(session_id, chunk) for chunk in range(-(-count // MESSAGE_CHUNK))]
+    chunks = session_cache().get_many(keys)
+    if len(chunks) < len(keys):
+        return None  # A chunk was evicted; the database copy is whole
+    state.messages = [message for key in keys for message in chunks[key]]
+    state.cached_messages = count
+    return state
+
+
+def load_session(session_id):
+    """
+    The session's state, or None for a new session. A cached session costs
+    no query unless checks_stored_version(); then a copy behind the
+    database, which another worker wrote after this cache last saw the
+    session, is reloaded.
+    """
+    state = cached_session(session_id)
+    if state is not None:
+        if not checks_stored_version():
+            return state
+        stored_version = Conversation.objects.filter(session_id=session_id).values_list('version', flat=True).first()
+        if stored_version is None or state.version >= stored_version:
+            return state
+    conversation = Conversation.objects.select_related('expected_part').filter(session_id=session_id).first()
+    if conversation is None:
+        return None
+    state = SessionState.from_conversation(conversation)
+    cache_session(state)
+    return state
+
+
+def save_session(state, flush=False):
+    """
+    Store a changed session in the cache. The database copy follows within
+    SESSION_FLUSH_INTERVAL seconds, or straight away with `flush` or when the
+    interval is 0.
+    """
+    state.version += 1
+    state.last_interaction = timezone.now()
+    cache_session(state)
+    if flush or settings.SESSION_FLUSH_INTERVAL <= 0:
+        flush_session(state)
+    else:
+        session_flusher.mark(state.session_id)
+
+
+def discard_session(session_id):
+    session_cache().delete(CACHE_PREFIX + session_id)
+    Conversation.objects.filter(session_id=session_id).delete()
+
+
+def flush_session(state):
+    """
+    Write a session state to the database. The row only ever moves forward:
+    a state whose version is not newer than the stored one is skipped, and
+    messages are inserted by their per-session number, so a flush repeated
+    after a crash, or racing another worker, cannot duplicate or roll back
+    anything. Returns whether the row was written.
+    """
+    with transaction.atomic():
+        conversation, _ = Conversation.objects.select_for_update().get_or_create(session_id=state.session_id)
+        if conversation.version >= state.version:
+            if conversation.version > state.version:
+                logger.warning(
+                    f"Session {state.session_id} version {state.version} is older than the stored "
+                    f"version {conversation.version}, not written"
+                )
+            return False
+        stored = conversation.messages.aggregate(last=Max('seq'))['last'] or 0
+        Message.objects.bulk_create(
+            [
+                Message(conversation=conversation, seq=message["seq"], role=message["role"], content=message["content"])
+                for message in state.messages[stored:]
+            ],
+            ignore_conflicts=True,
+        )
+        Conversation.objects.filter(pk=conversation.pk).update(
+            **{name: getattr(state, name) for name in CONVERSATION_FIELDS},
+            last_interaction=state.last_interaction or timezone.now(),
+            version=state.version,
+        )
+    return True
+
+
+class SessionFlusher(threading.Thread):
+    """
+    Flushes the sessions this process changed on a timer, from its own
+    database connection. Each flush re-reads the latest state from the
+    cache, so a session changed several times between ticks is written once.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._running = False  # Thread keeps its own _started
+
+    def mark(self, session_id):
+        with self._lock:
+            self._dirty.add(session_id)
+            if not self._running:
+                self._running = True
+                self.start()
+
+    def run(self):
+        while True:
+            time.sleep(settings.SESSION_FLUSH_INTERVAL)
+            self.flush()
+            connection.close()
+
+    def flush(self):
+        with self._lock:
+            session_ids, self._dirty = self._dirty, set()
+        for session_id in session_ids:
+            state = cached_session(session_id)
+            if state is None:
+                continue  # Expired, or evicted before it could be written
+            try:
+                flush_session(state)
+            except Exception as e:
+                logger.error(f"Error flushing session {session_id}: {e}")
+                with self._lock:
+                    self._dirty.add(session_id)
+
+
+session_flusher = SessionFlusher()
+# Write what is still pending when the worker shuts down
+atexit.register(session_flusher.flush)
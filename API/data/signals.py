@@ -0,0 +1,6 @@
+# signals.py
+from django.dispatch import Signal
+
+# Sent after a price-book import commits changes to the catalog.
+# Receivers get the ImportResult as `result`.
+catalog_imported = Signal()
@@ -0,0 +1,266 @@
+# speech.py
+import hashlib
+import logging
+import os
+import threading
+import unicodedata
+import uuid
+from collections import OrderedDict
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .upstream import get_http_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VOICE_ID = "pNInz6obpgDQGcFmaJgB"
+OUTPUT_FORMAT = "wav"
+ELEVENLABS_URL = "https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+
+# Reuse connections to ElevenLabs across requests handled by this process
+session = requests.Session()
+
+
+def _elevenlabs_request(text, api_key):
+    headers = {
+        "xi-api-key": api_key,
+        "Content-Type": "application/json"
+    }
+    data = {
+        "text": text,
+        "output_format": OUTPUT_FORMAT
+    }
+    return headers, data
+
+
+def synthesize_speech_with_elevenlabs(text, api_key, voice_id=DEFAULT_VOICE_ID):
+    """Synthesize `text` and return the audio as bytes, without touching disk."""
+    url = ELEVENLABS_URL.format(voice_id=voice_id)
+    headers, data = _elevenlabs_request(text, api_key)
+
+    try:
+        response = session.post(url, headers=headers, json=data)
+
+        if response.status_code == 200:
+            audio = response.content
+            spool_audio(audio)
+            return audio
+        else:
+            error_message = response.json().get('message', 'Unknown error')
+            logger.error(f"Error: {error_message}, Status Code: {response.status_code}, Response: {response.text}")
+            raise Exception(f"Error: {error_message}")
+
+    except requests.RequestException as e:
+        logger.error(f"RequestException: {str(e)}, Response: {e.response.text if e.response else 'No response'}")
+        raise Exception(f"RequestException: {str(e)}")
+
+
+async def asynthesize_speech_with_elevenlabs(text, api_key, voice_id=DEFAULT_VOICE_ID):
+    """Async counterpart of synthesize_speech_with_elevenlabs on the shared pool."""
+    url = ELEVENLABS_URL.format(voice_id=voice_id)
+    headers, data = _elevenlabs_request(text, api_key)
+
+    try:
+        response = await get_http_client().post(url, headers=headers, json=data)
+    except httpx.HTTPError as e:
+        logger.error(f"HTTPError: {str(e)}")
+        raise Exception(f"HTTPError: {str(e)}")
+
+    if response.status_code != 200:
+        error_message = response.json().get('message', 'Unknown error')
+        logger.error(f"Error: {error_message}, Status Code: {response.status_code}, Response: {response.text}")
+        raise Exception(f"Error: {error_message}")
+    audio = response.content
+    if settings.TTS_SPOOL_DIR:
+        await sync_to_async(spool_audio, thread_sensitive=False)(audio)
+    return audio
+
+
+def spool_audio(audio):
+    """
+    Keep a copy of synthesized audio for debugging when TTS_SPOOL_DIR is set.
+    The oldest files are removed once the spool grows past TTS_SPOOL_MAX_BYTES.
+    """
+    spool_dir = settings.TTS_SPOOL_DIR
+    if not spool_dir:
+        return None
+    try:
+        os.makedirs(spool_dir, exist_ok=True)
+        path = os.path.join(spool_dir, f"message_{uuid.uuid4()}.wav")
+        with open(path, 'wb') as audio_file:
+            audio_file.write(audio)
+
+        entries = sorted(
+            (entry for entry in os.scandir(spool_dir) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= settings.TTS_SPOOL_MAX_BYTES:
+                break
+            total -= entry.stat().st_size
+            os.remove(entry.path)
+        return path
+    except OSError as e:
+        # The spool is only a debugging aid, never fail the turn over it
+        logger.warning(f"Could not spool audio: {e}")
+        return None
+
+
+def normalize_text(text):
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+class AudioCache:
+    """
+    Content-addressed cache of synthesized audio, keyed on the normalized text,
+    voice and output format. Entries live in a byte-bounded in-memory LRU in
+    front of a byte-bounded directory on local disk, where the file mtime
+    serves as the LRU clock.
+    """
+
+    def __init__(self, directory=None, max_memory_bytes=0, max_disk_bytes=0):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(text, voice_id, output_format):
+        raw = '\x1f'.join([normalize_text(text), voice_id, output_format])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.{OUTPUT_FORMAT}')
+
+    def get(self, key):
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return audio
+
+        audio = self._read_disk(key)
+        with self._lock:
+            if audio is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, audio)
+        return audio
+
+    def set(self, key, audio):
+        with self._lock:
+            self._remember(key, audio)
+        self._write_disk(key, audio)
+
+    def _remember(self, key, audio):
+        if len(audio) > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as audio_file:
+                audio = audio_file.read()
+            os.utime(path)  # Mark as recently used
+            return audio
+        except OSError:
+            return None
+
+    def _write_disk(self, key, audio):
+        if not self.directory or len(audio) > self.max_disk_bytes:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(temp_path, 'wb') as audio_file:
+                audio_file.write(audio)
+            os.replace(temp_path, path)
+            with self._lock:
+                if self._disk_bytes is None:
+                    self._disk_bytes = sum(entry.stat().st_size for entry in self._disk_entries())
+                else:
+                    self._disk_bytes += len(audio)
+                if self._disk_bytes > self.max_disk_bytes:
+                    self._evict_disk()
+        except OSError as e:
+            logger.warning(f"Could not write TTS cache entry: {e}")
+
+    def _disk_entries(self):
+        return [
+            entry for entry in os.scandir(self.directory)
+            if entry.is_file() and entry.name.endswith(f'.{OUTPUT_FORMAT}')
+        ]
+
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries(), key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.max_disk_bytes:
+                break
+            total -= entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+            }
+
+
+audio_cache = AudioCache(
+    directory=settings.TTS_CACHE_DIR,
+    max_memory_bytes=settings.TTS_CACHE_MEMORY_BYTES,
+    max_disk_bytes=settings.TTS_CACHE_DISK_BYTES,
+)
+
+
+def synthesize_speech(text, voice_id=DEFAULT_VOICE_ID):
+    """Return audio for `text`, only calling the TTS API on a cache miss."""
+    key = audio_cache.make_key(text, voice_id, OUTPUT_FORMAT)
+    audio = audio_cache.get(key)
+    if audio is None:
+        audio = synthesize_speech_with_elevenlabs(text, settings.ELEVEN_LABS_API_KEY, voice_id=voice_id)
+        audio_cache.set(key, audio)
+    return audio
+
+
+async def asynthesize_speech(text, voice_id=DEFAULT_VOICE_ID):
+    """Async counterpart of synthesize_speech; cache file I/O runs off the event loop."""
+    key = audio_cache.make_key(text, voice_id, OUTPUT_FORMAT)
+    audio = await sync_to_async(audio_cache.get, thread_sensitive=False)(key)
+    if audio is None:
+        audio = await asynthesize_speech_with_elevenlabs(text, settings.ELEVEN_LABS_API_KEY, voice_id=voice_id)
+        await sync_to_async(audio_cache.set, thread_sensitive=False)(key, audio)
+    return audio
@@ -0,0 +1,142 @@
+# streaming.py
+import asyncio
+import json
+import logging
+import re
+from collections import deque
+
+from asgiref.sync import sync_to_async
+
+from .audio import audio_fields
+from .speech import asynthesize_speech
+from .trainer import CHAT_MODEL, finish_turn, response_history, select_animation
+
+logger = logging.getLogger(__name__)
+
+# Sentence ends at ., ! or ? (plus closing quotes/brackets) followed by whitespace,
+# so decimals like "1.5" and part numbers stay inside their sentence
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*\s+')
+MIN_SENTENCE_CHARS = 12  # Shorter fragments wait for the next sentence rather than cost a TTS call
+
+
+class SentenceSplitter:
+    """Accumulates streamed tokens and hands back each sentence once it is complete."""
+
+    def __init__(self, min_chars=MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ''
+
+    def feed(self, text):
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            if match.end() - start < self.min_chars:
+                continue
+            sentences.append(self._buffer[start:match.end()].strip())
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        sentence, self._buffer = self._buffer.strip(), ''
+        return [sentence] if sentence else []
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def completion_deltas(turn, openai_client):
+    """Text deltas of the turn's answer; a fixed reply comes as one delta without calling the model."""
+    if turn.reply is not None:
+        yield turn.reply.text
+        return
+    stream = await openai_client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=turn.prompt_messages(),
+        stream=True,
+    )
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
+async def stream_turn(turn, openai_client, audio_options, clip_url):
+    """
+    Run a turn as server-sent events: `start` with what is known before the
+    model answers, `text` for every token delta, `audio` for every sentence in
+    order as soon as its speech is ready, then `done` once the turn is saved.
+    Sentences are synthesized concurrently while the completion keeps streaming.
+    Audio is inline or a fetch URL, in the format of `audio_options`.
+    """
+    yield sse_event('start', {
+        "session_id": turn.conversation.session_id,
+        "part_number_correct": turn.part_number_correct,
+        "answer_verdict": turn.verdict,
+        "expected_part_number": turn.expected_part_number,
+        "part_location": turn.part_location,
+        "animation": select_animation(turn),
+    })
+
+    splitter = SentenceSplitter()
+    pending = deque()
+    chunks = []
+
+    async def encode(audio):
+        fields, _ = await sync_to_async(audio_fields, thread_sensitive=False)(audio, audio_options, clip_url)
+        return fields
+
+    async def speak(sentence):
+        return await encode(await asynthesize_speech(sentence))
+
+    def synthesize(sentences):
+        if turn.audio is not None:
+            return  # A pooled opening was spoken ahead of time as a whole
+        for sentence in sentences:
+            pending.append((sentence, asyncio.ensure_future(speak(sentence))))
+
+    def audio_event(index, sentence, task):
+        return sse_event('audio', {"index": index, "text": sentence, **task.result()})
+
+    index = 0
+    try:
+        async for delta in completion_deltas(turn, openai_client):
+            chunks.append(delta)
+            yield sse_event('text', {"delta": delta})
+            synthesize(splitter.feed(delta))
+
+            # Hand over finished audio without waiting on the sentences behind it
+            while pending and pending[0][1].done():
+                sentence, task = pending.popleft()
+                yield audio_event(index, sentence, task)
+                index += 1
+
+        synthesize(splitter.flush())
+        if turn.audio is not None:
+            pending.append((turn.reply.text, asyncio.ensure_future(encode(turn.audio))))
+        while pending:
+            sentence, task = pending[0]
+            await task
+            pending.popleft()
+            yield audio_event(index, sentence, task)
+            index += 1
+    except Exception as e:
+        logger.error(f"Error streaming turn: {str(e)}")
+        yield sse_event('error', {"error": "Error streaming response"})
+        return
+    finally:
+        # Also reached when the client disconnects mid-stream
+        for _, task in pending:
+            task.cancel()
+
+    ai_response = ''.join(chunks).strip()
+    await sync_to_async(finish_turn)(turn, ai_response)
+    yield sse_event('done', {
+        "response": ai_response,
+        "history": response_history(turn),
+        "facial_expression": turn.facial_expression(),
+    })
@@ -1,3 +1,1604 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import wave
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import boto3
+import numpy as np
+import pandas as pd
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import assets, idempotency
+from .assets import PresignedUrlCache, presigned_urls
+from .audio import AudioOptions, audio_fields, decode_wav, encode_audio, mulaw_encode, parse_audio_options
+from .catalog_tree import parse_breadcrumb
+from .checks import check_session_cache
+from .context_window import estimate_tokens, fit_history, message_tokens, summarize_message
+from .grading import PartNumberMatcher, grade_answer, part_number_matchers
+from .indexes import LazyIndex, MachineModelIndexRegistry
+from .importer import extract_serial_numbers, import_workbook
+from .jobs import MAX_ATTEMPTS, claim_next_job, enqueue_import, run_job
+from .models import (
+    CatalogNode, Conversation, ImportedFile, ImportJob, MachineModel, Message, OpeningTurn, Part,
+)
+from .sampler import ChallengeSampler, challenge_sampler
+from .search import build_ngram_index, build_search_indexes, search_indexes, search_parts_postgres
+from .serials import SerialIndex, SerialRange, lookup_in_database, parse_serial_range, serial_index
+from .sessions import (
+    MESSAGE_CHUNK, SessionState, cache_session, flush_session, load_session, save_session, session_cache, session_flusher
+)
+from .signals import catalog_imported
+from .streaming import SentenceSplitter
+from .speech import AudioCache, spool_audio, synthesize_speech
+from .upstream import close_clients, get_http_client, with_lifespan
+from .visemes import extract_visemes
+from .warm_pool import claim_opening_turn, is_opening_query, refill
+
+FILENAME = '260E Articulated Dump Truck (PIN 1DW260EX_ _D677827-708124) - PC15085.xlsx'
+
+
+def make_workbook(sheets):
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        for sheet_name, rows in sheets.items():
+            pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+def part_row(part_number, description='1 - Wheel', quantity=1, breadcrumb='Machine > Wheels'):
+    return {
+        'Part Description': description,
+        'Part Number': part_number,
+        'Quantity Required': quantity,
+        'Canvas Image': None,
+        'Breadcrumb': breadcrumb,
+    }
+
+
+class ImporterTests(TestCase):
+    def test_extract_serial_numbers(self):
+        self.assertEqual(
+            extract_serial_numbers(FILENAME),
+            ('260E Articulated Dump Truck', 'D677827', '708124')
+        )
+        with self.assertRaises(ValueError):
+            extract_serial_numbers('parts.xlsx')
+
+    def test_import_reports_inserted_updated_and_skipped(self):
+        workbook = make_workbook({
+            'dummy': {},
+            'ST8': [part_row('AT467532', quantity=6), part_row('AT441417'), part_row(None)],
+            'ST87': [part_row('AT467532', description='1 - Three Piece Wheel Rim'), part_row('AT440578')],
+        })
+        result = import_workbook(workbook, FILENAME)
+
+        self.assertEqual(MachineModel.objects.count(), 1)
+        self.assertEqual([sheet.sheet_name for sheet in result.sheets], ['ST8', 'ST87'])
+        # The ST8 row for AT467532 is superseded by the later ST87 row
+        self.assertEqual((result.sheets[0].inserted, result.sheets[0].updated, result.sheets[0].skipped), (1, 0, 2))
+        self.assertEqual((result.sheets[1].inserted, result.sheets[1].updated, result.sheets[1].skipped), (2, 0, 0))
+        self.assertEqual(Part.objects.count(), 3)
+        self.assertEqual(Part.objects.get(part_number='AT467532').description, '1 - Three Piece Wheel Rim')
+
+    def test_reimport_updates_in_place(self):
+        import_workbook(make_workbook({'ST8': [part_row('AT467532')]}), FILENAME)
+        result = import_workbook(make_workbook({'ST8': [part_row('AT467532', quantity=4)]}), FILENAME)
+
+        self.assertEqual((result.inserted, result.updated), (0, 1))
+        self.assertEqual(Part.objects.get().quantity_required, 4)
+
+
+    def test_sheet_missing_required_headers_is_rejected(self):
+        workbook = make_workbook({'ST8': [{'Part Number': 'AT467532', 'Quantity Required': 1}]})
+        with self.assertRaisesMessage(ValueError, "Sheet 'ST8' is missing columns: Part Description, Breadcrumb"):
+            import_workbook(workbook, FILENAME)
+        self.assertFalse(Part.objects.exists())
+
+
+class LegacyMachineModelTests(TestCase):
+    def setUp(self):
+        # Imported before the factory letter was kept: the D and F books share one row
+        self.legacy = MachineModel.objects.create(
+            model_name='260E Articulated Dump Truck', serial_number_start='677827', serial_number_end='708124'
+        )
+        Part.objects.create(machine_model=self.legacy, part_number='AT467532', description='1 - Wheel', quantity_required=1)
+        Part.objects.create(machine_model=self.legacy, part_number='AT999999', description='F only', quantity_required=1)
+        self.conversation = Conversation.objects.create(session_id='session-1', machine_model=self.legacy)
+
+    def test_first_import_takes_the_legacy_row_over(self):
+        import_workbook(make_workbook({'ST8': [part_row('AT467532')]}), FILENAME)
+
+        machine_model = MachineModel.objects.get()
+        self.assertEqual(machine_model.pk, self.legacy.pk)
+        self.assertEqual(
+            (machine_model.serial_number_start, machine_model.serial_prefix, machine_model.serial_low),
+            ('D677827', 'D', 677827)
+        )
+        self.assertEqual(list(Part.objects.values_list('part_number', flat=True)), ['AT467532'])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.machine_model_id, machine_model.pk)
+
+        import_workbook(make_workbook({'ST8': [part_row('AT999999')]}), FILENAME.replace('_D677827', '_F677827'))
+        self.assertEqual(
+            sorted(MachineModel.objects.values_list('serial_number_start', flat=True)), ['D677827', 'F677827']
+        )
+
+    def test_legacy_row_left_beside_the_new_key_is_deleted(self):
+        current = MachineModel.objects.create(
+            model_name='260E Articulated Dump Truck', serial_number_start='D677827', serial_number_end='708124'
+        )
+        import_workbook(make_workbook({'ST8': [part_row('AT467532')]}), FILENAME)
+
+        self.assertEqual(list(MachineModel.objects.values_list('pk', flat=True)), [current.pk])
+        self.assertEqual(Part.objects.get().machine_model_id, current.pk)
+        self.conversation.refresh_from_db()
+        self.assertIsNone(self.conversation.machine_model_id)
+
+
+class ImportDataCommandTests(TestCase):
+    def setUp(self):
+        source = tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        self.source = source.name
+        self.other = FILENAME.replace('_D677827', '_F677827')
+        self.write(FILENAME, {'ST8': [part_row('AT467532'), part_row('AT441417')]})
+        self.write(self.other, {'ST8': [part_row('AT440578')]})
+
+    def write(self, filename, sheets):
+        with open(os.path.join(self.source, filename), 'wb') as f:
+            f.write(make_workbook(sheets).getvalue())
+
+    def run_command(self, *args, **options):
+        out = io.StringIO()
+        call_command('import_data', *args, stdout=out, **options)
+        return out.getvalue()
+
+    def test_directory_is_searched_for_price_books(self):
+        self.write('~$' + FILENAME, {'ST8': [part_row('AT999999')]})  # Excel lock file
+        self.write('parts.xlsx', {'ST8': [part_row('AT999999')]})
+        with open(os.path.join(self.source, 'notes.txt'), 'w') as f:
+            f.write('not a workbook')
+
+        output = self.run_command(self.source, workers=1)
+
+        self.assertEqual(MachineModel.objects.count(), 2)
+        self.assertEqual(Part.objects.count(), 3)
+        self.assertFalse(Part.objects.filter(part_number='AT999999').exists())
+        self.assertIn('Error extracting serial numbers from file', output)
+        self.assertIn('parts.xlsx', output)
+        self.assertIn('2 files, 3 rows in', output)
+
+    def test_glob_pattern_selects_files(self):
+        self.run_command(os.path.join(self.source, '*_D677827-*.xlsx'), workers=1)
+
+        self.assertEqual(list(MachineModel.objects.values_list('serial_number_start', flat=True)), ['D677827'])
+        self.assertEqual(Part.objects.count(), 2)
+
+    def test_dry_run_reports_the_import_and_writes_nothing(self):
+        self.run_command(self.source, workers=1)
+        self.write(FILENAME, {'ST8': [part_row('AT467532'), part_row('AT999999')]})
+
+        with mock.patch('data.importer.catalog_imported.send') as send:
+            output = self.run_command(self.source, workers=1, dry_run=True)
+
+        self.assertIn(f'Dry run, nothing written: {FILENAME}: 1 inserted, 0 updated, 1 deleted', output)
+        self.assertEqual(
+            set(Part.objects.values_list('part_number', flat=True)), {'AT467532', 'AT441417', 'AT440578'}
+        )
+        self.assertEqual(ImportedFile.objects.count(), 2)
+        self.assertIn(f'Unchanged since the last import: {self.other}', output)
+        send.assert_not_called()
+
+        self.run_command(self.source, workers=1)
+        self.assertTrue(Part.objects.filter(part_number='AT999999').exists())
+
+    def test_workbooks_are_parsed_by_several_workers(self):
+        output = self.run_command(self.source, workers=2)
+
+        self.assertIn('Processing 2 files with 2 workers', output)
+        self.assertEqual(Part.objects.count(), 3)
+
+    def test_unreadable_file_is_reported_and_the_rest_imported(self):
+        with open(os.path.join(self.source, self.other), 'wb') as f:
+            f.write(b'not a workbook')
+
+        output = self.run_command(self.source, workers=1)
+
+        self.assertIn(f'Error processing file {os.path.join(self.source, self.other)}', output)
+        self.assertEqual(list(Part.objects.values_list('part_number', flat=True).order_by('part_number')),
+                         ['AT441417', 'AT467532'])
+        self.assertIn('1 files, 2 rows in', output)
+
+    def test_unchanged_files_are_skipped(self):
+        self.run_command(self.source, workers=1)
+        output = self.run_command(self.source, workers=1)
+
+        self.assertIn(f'Unchanged since the last import: {FILENAME}', output)
+        self.assertIn(f'Unchanged since the last import: {self.other}', output)
+        self.assertNotIn('Processing', output)
+
+    def test_timing_summary_lists_every_file(self):
+        output = self.run_command(self.source, workers=1)
+
+        header, *rows, total = output.strip().splitlines()[-4:]
+        self.assertEqual(header.split(), ['File', 'Rows', 'Parse', 's', 'Write', 's'])
+        self.assertEqual(sorted(row.rsplit(None, 3)[0] for row in rows), sorted([FILENAME, self.other]))
+        self.assertEqual(sorted(int(row.split()[-3]) for row in rows), [1, 2])
+        self.assertTrue(total.startswith('2 files, 3 rows in '))
+
+    def test_empty_source_is_an_error(self):
+        empty = tempfile.TemporaryDirectory()
+        self.addCleanup(empty.cleanup)
+        with self.assertRaisesMessage(CommandError, 'No price-book files found'):
+            self.run_command(empty.name)
+
+
+class IncrementalImportTests(TestCase):
+    def setUp(self):
+        self.sheets = {
+            'ST8': [part_row('AT467532'), part_row('AT441417')],
+            'ST87': [part_row('AT440578'), part_row('R123456')],
+        }
+        self.workbook = make_workbook(self.sheets).getvalue()
+        import_workbook(io.BytesIO(self.workbook), FILENAME)
+
+    def test_unchanged_file_is_a_no_op(self):
+        with self.assertNumQueries(1):
+            result = import_workbook(io.BytesIO(self.workbook), FILENAME)
+        self.assertTrue(result.unchanged)
+
+    def test_only_changed_rows_are_written_and_dropped_parts_deleted(self):
+        self.sheets['ST87'] = [part_row('AT440578', quantity=2)]
+        result = import_workbook(make_workbook(self.sheets), FILENAME)
+
+        self.assertEqual(result.diff(), {'inserted': [], 'updated': ['AT440578'], 'deleted': ['R123456']})
+        self.assertEqual([sheet.unchanged for sheet in result.sheets], [True, False])
+        self.assertFalse(Part.objects.filter(part_number='R123456').exists())
+        self.assertEqual(Part.objects.get(part_number='AT440578').quantity_required, 2)
+
+    def test_unchanged_sheet_is_not_read(self):
+        self.sheets['ST87'] = [part_row('AT440578', quantity=2), part_row('R123456')]
+        result = import_workbook(make_workbook(self.sheets), FILENAME)
+
+        self.assertEqual([sheet.read for sheet in result.sheets], [False, True])
+        self.assertEqual(result.rows_read, 2)
+        self.assertEqual(result.diff(), {'inserted': [], 'updated': ['AT440578'], 'deleted': []})
+        self.assertEqual(Part.objects.count(), 4)
+
+    def test_sheets_are_fingerprinted_from_their_rows_without_the_openpyxl_internals(self):
+        with mock.patch('data.importer.StreamingWorkbook._internals', return_value=(None, None, None)):
+            self.sheets['ST87'] = [part_row('AT440578', quantity=3), part_row('R123456')]
+            import_workbook(make_workbook(self.sheets), FILENAME)
+            self.sheets['ST87'] = [part_row('AT440578', quantity=2), part_row('R123456')]
+            result = import_workbook(make_workbook(self.sheets), FILENAME)
+
+        self.assertEqual([sheet.read for sheet in result.sheets], [False, True])
+        self.assertEqual(result.diff(), {'inserted': [], 'updated': ['AT440578'], 'deleted': []})
+
+    def test_part_moved_out_of_a_changed_sheet_falls_back_to_the_unchanged_one(self):
+        self.sheets['ST87'] = [part_row('AT440578'), part_row('R123456'), part_row('AT441417', quantity=9)]
+        import_workbook(make_workbook(self.sheets), FILENAME)
+        self.assertEqual(Part.objects.get(part_number='AT441417').quantity_required, 9)
+
+        self.sheets['ST87'] = [part_row('AT440578'), part_row('R123456')]
+        result = import_workbook(make_workbook(self.sheets), FILENAME)
+
+        self.assertFalse(result.sheets[0].read)
+        self.assertEqual(result.diff(), {'inserted': [], 'updated': ['AT441417'], 'deleted': []})
+        self.assertEqual(Part.objects.get(part_number='AT441417').quantity_required, 1)
+
+    def test_other_price_book_for_the_same_range_is_untouched(self):
+        other = FILENAME.replace('_D677827', '_F677827')
+        import_workbook(make_workbook({'ST8': [part_row('AT999999')]}), other)
+
+        self.assertEqual(MachineModel.objects.count(), 2)
+        self.assertEqual(Part.objects.count(), 5)
+
+
+class ImportJobTests(TestCase):
+    def setUp(self):
+        staging = tempfile.TemporaryDirectory()
+        self.addCleanup(staging.cleanup)
+        self.staging_dir = staging.name
+        self.settings_override = override_settings(IMPORT_STAGING_DIR=staging.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def upload(self, filename=FILENAME):
+        workbook = make_workbook({'ST8': [part_row('AT467532'), part_row('AT441417')]})
+        return SimpleUploadedFile(filename, workbook.getvalue())
+
+    def test_queued_job_is_run_by_the_worker(self):
+        job = enqueue_import(self.upload())
+        self.assertEqual(job.status, ImportJob.QUEUED)
+        self.assertFalse(Part.objects.exists())
+
+        claimed = claim_next_job()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertIsNone(claim_next_job())
+
+        job = run_job(claimed)
+        self.assertEqual(job.status, ImportJob.SUCCEEDED)
+        self.assertEqual((job.rows_read, job.rows_written, job.rows_inserted), (2, 2, 2))
+        self.assertEqual(Part.objects.count(), 2)
+        self.assertFalse(os.path.exists(job.staged_path))
+
+    def test_job_of_a_dead_worker_is_reclaimed(self):
+        job = enqueue_import(self.upload())
+        self.assertEqual(claim_next_job().pk, job.pk)
+        self.assertIsNone(claim_next_job())
+
+        # The worker died mid-import and its heartbeat went stale
+        ImportJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=301))
+        claimed = claim_next_job()
+        self.assertEqual((claimed.pk, claimed.attempts), (job.pk, 2))
+        self.assertEqual(run_job(claimed).status, ImportJob.SUCCEEDED)
+
+    def test_job_that_keeps_losing_its_worker_is_failed(self):
+        job = enqueue_import(self.upload())
+        ImportJob.objects.filter(pk=job.pk).update(
+            status=ImportJob.RUNNING, attempts=MAX_ATTEMPTS, heartbeat_at=timezone.now() - timedelta(seconds=301)
+        )
+        self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_upload_returns_immediately_and_status_can_be_polled(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+
+        response = self.client.post(reverse('admin:upload_excel'), {'excel_file': self.upload()})
+        self.assertEqual(response.status_code, 302)
+        job = ImportJob.objects.get()
+        self.assertFalse(Part.objects.exists())
+
+        run_job(claim_next_job())
+        status = self.client.get(reverse('admin:import_job_status', args=[job.pk])).json()
+        self.assertEqual(status['status'], ImportJob.SUCCEEDED)
+        self.assertEqual(status['rows_inserted'], 2)
+
+    def test_bad_filename_is_rejected_before_staging(self):
+        with self.assertRaises(ValueError):
+            enqueue_import(self.upload('parts.xlsx'))
+        self.assertFalse(ImportJob.objects.exists())
+
+
+    def test_missing_columns_are_reported_by_the_upload_form(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+        rows = [{key: value for key, value in part_row('AT467532').items() if key != 'Part Number'}]
+        upload = SimpleUploadedFile(FILENAME, make_workbook({'ST8': rows}).getvalue())
+
+        response = self.client.post(reverse('admin:upload_excel'), {'excel_file': upload}, follow=True)
+        self.assertContains(response, "Sheet &#x27;ST8&#x27; is missing columns: Part Number")
+        self.assertFalse(ImportJob.objects.exists())
+        self.assertEqual(os.listdir(self.staging_dir), [])
+
+
+class ChallengeSamplerTests(TestCase):
+    def setUp(self):
+        self.small = MachineModel.objects.create(model_name='310SL', serial_number_start='C1', serial_number_end='9')
+        self.large = MachineModel.objects.create(model_name='260E', serial_number_start='D1', serial_number_end='9')
+        Part.objects.create(machine_model=self.small, part_number='SMALL', description='Bolt', quantity_required=1)
+        for i in range(9):
+            Part.objects.create(machine_model=self.large, part_number=f'LARGE{i}', description='Nut', quantity_required=1)
+
+    def test_sample_costs_one_query_once_the_index_is_built(self):
+        sampler = ChallengeSampler()
+        sampler.sample()
+        with self.assertNumQueries(1):
+            machine_model, part = sampler.sample()
+        self.assertEqual(part.machine_model_id, machine_model.pk)
+
+    def test_machine_model_weighting_picks_models_uniformly(self):
+        rng = random.Random(0)
+        sampler = ChallengeSampler()
+        draws = [sampler.sample(rng)[0].pk for _ in range(400)]
+        self.assertAlmostEqual(draws.count(self.small.pk) / len(draws), 0.5, delta=0.1)
+
+        sampler = ChallengeSampler(weighting='part')
+        draws = [sampler.sample(rng)[0].pk for _ in range(400)]
+        self.assertAlmostEqual(draws.count(self.small.pk) / len(draws), 0.1, delta=0.06)
+
+    def test_index_is_rebuilt_after_a_catalog_import(self):
+        challenge_sampler.sample()
+        with self.captureOnCommitCallbacks(execute=True):
+            import_workbook(make_workbook({'ST8': [part_row('AT467532')]}), FILENAME)
+
+        drawn = {challenge_sampler.sample()[1].part_number for _ in range(60)}
+        self.assertIn('AT467532', drawn)
+
+    def test_empty_catalog_raises_does_not_exist(self):
+        Part.objects.all().delete()
+        with self.assertRaises(MachineModel.DoesNotExist):
+            ChallengeSampler().sample()
+
+
+def chat_completion(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def fake_synthesis(text, api_key, voice_id=None):
+    return b'RIFF'
+
+
+class TurnTestCase(TestCase):
+    """
+    Fixture for the interact-with-ai tests: one machine model with one part
+    to ask about, an empty session cache and no calls to OpenAI or
+    ElevenLabs. `openai` is the mocked client the view under test uses.
+    """
+    url = '/api/interact-with-ai'
+
+    def setUp(self):
+        session_cache().clear()
+        self.addCleanup(session_cache().clear)
+        self.machine_model = MachineModel.objects.create(
+            model_name='260E Articulated Dump Truck', serial_number_start='D677827', serial_number_end='708124'
+        )
+        self.part = Part.objects.create(
+            machine_model=self.machine_model, part_number='AT467532', description='1 - Wheel',
+            quantity_required=6, breadcrumb='Wheels > Rim'
+        )
+        challenge_sampler.invalidate()
+        part_number_matchers.invalidate()
+
+        self.openai = self.patch('data.views.client')
+        self.synthesis = self.patch('data.speech.synthesize_speech_with_elevenlabs', side_effect=fake_synthesis)
+        self.patch('data.speech.audio_cache', new=AudioCache(max_memory_bytes=1024))
+
+    def patch(self, target, **kwargs):
+        patcher = mock.patch(target, **kwargs)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def interact(self, query, session_id='session-1', **kwargs):
+        return self.client.post(
+            self.url, {'query': query, 'session_id': session_id}, content_type='application/json', **kwargs
+        )
+
+
+class AsyncTurnTestCase(TurnTestCase):
+    """TurnTestCase for the async view, on the pooled upstream clients."""
+    url = '/api/interact-with-ai-async'
+
+    def setUp(self):
+        super().setUp()
+        self.openai = mock.MagicMock()
+        self.openai.chat.completions.create = mock.AsyncMock()
+        self.patch('data.views.get_async_openai', return_value=self.openai)
+        self.patch('data.views.asynthesize_speech', new=mock.AsyncMock(return_value=b'RIFF'))
+        self.patch('data.streaming.asynthesize_speech', new=mock.AsyncMock(return_value=b'RIFF'))
+
+
+class PartNumberMatcherTests(TestCase):
+    def test_finds_every_catalog_part_number_on_word_boundaries(self):
+        matcher = PartNumberMatcher(['AT467532', 'AT4675', 'R-123456', 'T1'])
+        self.assertEqual(matcher.find('Is it at4675 or AT 467532? Maybe r123456.'), ['AT4675', 'AT467532', 'R123456'])
+        self.assertEqual(matcher.find('AT4675320 and XAT4675 are not parts'), [])
+        self.assertEqual(matcher.find('a T1 bolt'), ['T1'])
+
+    def test_grades_correct_wrong_and_missing_part_numbers(self):
+        machine_model = MachineModel.objects.create(model_name='260E', serial_number_start='D1', serial_number_end='2')
+        for part_number in ('AT467532', 'AT123456'):
+            Part.objects.create(machine_model=machine_model, part_number=part_number, description='Wheel', quantity_required=1)
+        part_number_matchers.invalidate()
+
+        self.assertEqual(grade_answer(machine_model.pk, 'AT467532', 'It is AT-467532').verdict, 'correct')
+        grade = grade_answer(machine_model.pk, 'AT467532', 'Try at123456')
+        self.assertEqual((grade.verdict, grade.mentioned), ('wrong_part', ['AT123456']))
+        self.assertEqual(grade_answer(machine_model.pk, 'AT467532', 'What color is it?').verdict, 'no_part')
+        self.assertEqual(grade_answer(None, 'AT467532', 'AT467532 please').verdict, 'correct')
+
+
+@override_settings(SESSION_FLUSH_INTERVAL=0)
+class InteractWithAITests(TurnTestCase):
+    def test_first_turn_starts_a_challenge(self):
+        self.openai.chat.completions.create.return_value = chat_completion('Hi, I need a wheel.')
+        response = self.interact('Hello')
+
+        self.assertEqual(response.status_code, 200)
+        conversation = Conversation.objects.get(session_id='session-1')
+        self.assertEqual(conversation.expected_part_number, 'AT467532')
+        self.assertTrue(conversation.serial_number.startswith('D'))
+        self.assertEqual(
+            list(conversation.messages.values_list('role', flat=True)),
+            ['system', 'system', 'system', 'user', 'assistant']
+        )
+        self.assertEqual(response.json()['history'][-1]['content'], 'Hi, I need a wheel.')
+        self.assertEqual(base64.b64decode(response.json()['audio']), b'RIFF')
+
+    @override_settings(FAST_REPLIES_ENABLED=False)
+    def test_follow_up_turns_are_graded_from_the_stored_challenge(self):
+        self.openai.chat.completions.create.return_value = chat_completion('Hi, I need a wheel.')
+        self.interact('Hello')
+
+        Part.objects.create(
+            machine_model=Conversation.objects.get().machine_model, part_number='AT123456',
+            description='Wheel Nut', quantity_required=12
+        )
+        part_number_matchers.invalidate()
+
+        self.openai.chat.completions.create.return_value = chat_completion('Which wheel?')
+        response = self.interact('Is that the front wheel, AT000000?')
+        self.assertEqual(response.json()['answer_verdict'], 'no_part')
+        self.assertEqual(Conversation.objects.get().incorrect_attempts, 0)
+
+        self.openai.chat.completions.create.return_value = chat_completion('I just looked it up and that is not the correct part I am looking for!')
+        response = self.interact('Try at 123456')
+        self.assertFalse(response.json()['part_number_correct'])
+        self.assertEqual(response.json()['answer_verdict'], 'wrong_part')
+        self.assertEqual(Conversation.objects.get().incorrect_attempts, 1)
+        prompt = self.openai.chat.completions.create.call_args.kwargs['messages']
+        self.assertIn('gives AT123456, which is not the part you need', prompt[-2]['content'])
+
+        self.openai.chat.completions.create.return_value = chat_completion('Great, thanks.')
+        response = self.interact('It is at-467532')
+        data = response.json()
+        self.assertTrue(data['part_number_correct'])
+        self.assertEqual(data['facial_expression'], 'smile')
+        self.assertEqual(Conversation.objects.get().incorrect_attempts, 0)
+        self.assertEqual(Message.objects.count(), 11)
+
+    def test_graded_turns_are_answered_without_the_model(self):
+        self.openai.chat.completions.create.return_value = chat_completion('Hi, I need a wheel.')
+        self.interact('Hello')
+        Part.objects.create(
+            machine_model=Conversation.objects.get().machine_model, part_number='AT123456',
+            description='Wheel Nut', quantity_required=12
+        )
+        part_number_matchers.invalidate()
+        self.openai.chat.completions.create.reset_mock()
+
+        replies = [self.interact('Try AT123456').json() for _ in range(3)]
+        self.assertEqual(replies[0]['response'], 'I just looked it up and that is not the correct part I am looking for!')
+        self.assertIn('check the description again', replies[1]['response'])
+        self.assertEqual((replies[2]['facial_expression'], replies[2]['animation']), ('angry', 'ThoughtfulHeadShake'))
+
+        data = self.interact('It is AT467532').json()
+        self.assertEqual(data['response'], 'That is correct, thank you! Glad we got there in the end.')
+        self.assertEqual((data['facial_expression'], data['animation']), ('smile', 'ThoughtfulHeadNod'))
+        self.openai.chat.completions.create.assert_not_called()
+        self.assertEqual(data['history'][-1]['content'], data['response'])
+
+        # Questions still go to the model
+        self.openai.chat.completions.create.return_value = chat_completion('Thanks again.')
+        self.assertEqual(self.interact('Anything else?').json()['response'], 'Thanks again.')
+
+    def test_delta_history_returns_only_new_messages_without_system_prompts(self):
+        self.openai.chat.completions.create.return_value = chat_completion('Hi, I need a wheel.')
+        first = self.interact('Hello').json()
+        self.assertEqual([item['role'] for item in first['history']], ['user', 'assistant'])
+
+        response = self.client.post('/api/interact-with-ai', {
+            'query': 'Where is it?', 'session_id': 'session-1', 'last_message_seq': first['history'][-1]['seq']
+        }, content_type='application/json')
+        self.assertEqual([item['content'] for item in response.json()['history']], ['Where is it?', 'Hi, I need a wheel.'])
+        self.assertEqual(set(response.json()['history'][0]), {'seq', 'role', 'content'})
+
+        response = self.client.post('/api/interact-with-ai', {
+            'query': 'Anything else?', 'session_id': 'session-1', 'history': 'delta'
+        }, content_type='application/json')
+        self.assertEqual(len(response.json()['history']), 2)
+        self.assertEqual(response.json()['history'][0]['content'], 'Anything else?')
+
+    def test_url_delivery_keeps_audio_out_of_the_json(self):
+        self.openai.chat.completions.create.return_value = chat_completion('Hi, I need a wheel.')
+        response = self.client.post('/api/interact-with-ai', {
+            'query': 'Hello', 'session_id': 'session-1', 'audio_delivery': 'url'
+        }, content_type='application/json')
+        data = response.json()
+        self.assertIsNone(data['audio'])
+
+        clip = self.client.get(data['audio_url'])
+        self.assertEqual(clip.content, b'RIFF')
+        self.assertEqual(clip['Content-Type'], 'audio/wav')
+        self.assertEqual(self.client.get('/api/audio/missing').status_code, 404)
+
+    def test_multipart_delivery_sends_audio_as_a_binary_part(self):
+        self.openai.chat.completions.create.return_value = chat_completion('Hi, I need a wheel.')
+        response = self.client.post('/api/interact-with-ai', {
+            'query': 'Hello', 'session_id': 'session-1', 'audio_delivery': 'multipart'
+        }, content_type='application/json')
+        self.assertTrue(response['Content-Type'].startswith('multipart/mixed; boundary='))
+        boundary = response['Content-Type'].split('boundary=')[1]
+        parts = response.content.split(f'--{boundary}'.encode())
+        self.assertEqual(json.loads(parts[1].split(b'\r\n\r\n', 1)[1])['response'], 'Hi, I need a wheel.')
+        self.assertEqual(parts[2].split(b'\r\n\r\n', 1)[1], b'RIFF\r\n')
+
+    @override_settings(PROMPT_RECENT_TURNS=2)
+    def test_long_sessions_fold_old_turns_into_a_summary(self):
+        for number in range(5):
+            self.openai.chat.completions.create.return_value = chat_completion(f'Answer {number}. More detail here.')
+            self.interact(f'Question {number}? Maybe AT99999{number}.')
+
+        prompt = self.openai.chat.completions.create.call_args.kwargs['messages']
+        self.assertEqual([message['role'] for message in prompt[:3]], ['system'] * 3)
+        self.assertTrue(prompt[3]['content'].startswith('Summary of the earlier conversation:'))
+        # The two turns before this one stay verbatim, the ones before them are summarized
+        self.assertEqual([message['content'] for message in prompt[4:]], [
+            'Question 2? Maybe AT999992.', 'Answer 2. More detail here.',
+            'Question 3? Maybe AT999993.', 'Answer 3. More detail here.',
+            'Question 4? Maybe AT999994.',
+        ])
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.prompt_summary.splitlines(), [
+            'Representative: Question 0? (mentions AT999990)', 'Customer: Answer 0.',
+            'Representative: Question 1? (mentions AT999991)', 'Customer: Answer 1.',
+        ])
+        self.assertEqual(len(self.interact('Done').json()['history']), 12)
+
+
+@override_settings(SESSION_FLUSH_INTERVAL=5)
+class SessionCacheTests(TurnTestCase):
+    def setUp(self):
+        super().setUp()
+        self.openai.chat.completions.create.return_value = chat_completion('Which wheel?')
+        # The timer thread is driven by hand below
+        start_patch = mock.patch.object(session_flusher, 'start')
+        start_patch.start()
+        self.addCleanup(start_patch.stop)
+        self.addCleanup(session_flusher.flush)
+
+    def test_cached_turns_do_not_touch_the_database_until_flushed(self):
+        self.interact('Hello')
+        self.interact('Which side?')
+        self.assertFalse(Conversation.objects.exists())
+
+        with self.assertNumQueries(0):
+            history = self.interact('Front or rear?').json()['history']
+        self.assertEqual([item['seq'] for item in history], list(range(4, 10)))
+
+        session_flusher.flush()
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.version, 4)
+        self.assertEqual(list(conversation.messages.values_list('seq', flat=True)), list(range(1, 10)))
+
+    def test_a_turn_writes_only_the_tail_of_the_transcript(self):
+        state = SessionState(session_id='session-2')
+        state.add_messages([{'role': 'user', 'content': f'Message {number}'} for number in range(3 * MESSAGE_CHUNK + 2)])
+        cache_session(state)
+        state.add_messages([{'role': 'user', 'content': 'Which side?'}, {'role': 'assistant', 'content': 'Front.'}])
+        with mock.patch.object(session_cache(), 'set_many', wraps=session_cache().set_many) as set_many:
+            save_session(state)
+        written = set_many.call_args.args[0]
+        self.assertEqual(sorted(written), ['session-messages:session-2:3', 'session-state:session-2'])
+        self.assertEqual(len(written['session-messages:session-2:3']), 4)
+
+        cached = load_session('session-2')
+        self.assertEqual((cached.version, cached.messages), (1, state.messages))
+    def test_solving_the_challenge_flushes_at_once(self):
+        self.interact('Hello')
+        self.interact('It is AT467532')
+        self.assertEqual(Message.objects.count(), 7)
+        self.assertEqual(Conversation.objects.get().incorrect_attempts, 0)
+
+    def test_flushes_are_idempotent_and_never_roll_back(self):
+        state = SessionState(session_id='session-2', version=2)
+        state.add_messages([{'role': 'user', 'content': 'Hi'}, {'role': 'assistant', 'content': 'Hello'}])
+        stale = SessionState(session_id='session-2', version=1, incorrect_attempts=5)
+        self.assertTrue(flush_session(state))
+        self.assertFalse(flush_session(state))
+        self.assertFalse(flush_session(stale))
+        conversation = Conversation.objects.get(session_id='session-2')
+        self.assertEqual((conversation.version, conversation.incorrect_attempts, conversation.messages.count()), (2, 0, 2))
+
+        # A lost flush marker replays the same messages without duplicating them
+        state.add_messages([{'role': 'user', 'content': 'Again'}])
+        state.version = 3
+        Conversation.objects.filter(pk=conversation.pk).update(version=0)
+        self.assertTrue(flush_session(state))
+        self.assertEqual(conversation.messages.count(), 3)
+
+    @override_settings(SESSION_FLUSH_INTERVAL=0)
+    def test_cached_copy_behind_the_database_is_reloaded(self):
+        self.interact('Hello')
+        # Another worker, which cannot see this cache, answered a turn and wrote it through
+        newer = load_session('session-1')
+        newer.add_messages([{'role': 'user', 'content': 'Which side?'}, {'role': 'assistant', 'content': 'Front.'}])
+        newer.incorrect_attempts = 1
+        newer.version += 1
+        flush_session(newer)
+
+        state = load_session('session-1')
+        self.assertEqual((state.version, state.incorrect_attempts, len(state.messages)), (newer.version, 1, 7))
+        history = self.interact('And the bolts?').json()['history']
+        self.assertEqual([item['content'] for item in history][-4:], ['Which side?', 'Front.', 'And the bolts?', 'Which wheel?'])
+
+    def test_only_per_process_caches_written_through_check_the_stored_version(self):
+        self.interact('Hello')
+        with self.assertNumQueries(0):
+            load_session('session-1')
+        with override_settings(SESSION_FLUSH_INTERVAL=0), self.assertNumQueries(1):
+            load_session('session-1')
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name}
+        with override_settings(CACHES={'default': shared}, SESSION_FLUSH_INTERVAL=0):
+            self.interact('Hello', session_id='session-2')
+            with self.assertNumQueries(0):
+                self.assertIsNotNone(load_session('session-2'))
+
+    def test_evicted_sessions_reload_from_the_database(self):
+        self.interact('Hello')
+        session_flusher.flush()
+        session_cache().clear()
+        state = load_session('session-1')
+        self.assertEqual(state.part_location, 'Wheels > Rim')
+        self.assertEqual([message['seq'] for message in state.messages], [1, 2, 3, 4, 5])
+        history = self.interact('Which side?').json()['history']
+        self.assertEqual([item['seq'] for item in history], [4, 5, 6, 7])
+
+
+@override_settings(SESSION_FLUSH_INTERVAL=0)
+class IdempotencyTests(TurnTestCase):
+    def setUp(self):
+        super().setUp()
+        self.openai.chat.completions.create.return_value = chat_completion('Hi, I need a wheel.')
+
+    def interact(self, query='Hello', key='retry-1'):
+        return super().interact(query, headers={'Idempotency-Key': key} if key else {})
+
+    def test_retries_replay_the_stored_response(self):
+        first = self.interact()
+        second = self.interact()
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(self.openai.chat.completions.create.call_count, 1)
+        self.assertEqual(Message.objects.count(), 5)
+
+        self.assertEqual(self.interact(query='Something else').status_code, 422)
+        self.assertEqual(self.interact(key='x' * 300).status_code, 400)
+        self.interact(key='retry-2')
+        self.assertEqual(Message.objects.count(), 7)
+
+    def test_form_encoded_turns_are_keyed_by_their_session(self):
+        form = 'query=Hello&session_id=session-1'
+        factory = RequestFactory()
+        for request in [
+            factory.post(self.url, form, content_type='application/x-www-form-urlencoded'),
+            factory.post(self.url, {'query': 'Hello', 'session_id': 'session-1'}),  # multipart
+        ]:
+            self.assertEqual(idempotency.read_request(request)[1], 'session-1')
+
+        headers = {'Idempotency-Key': 'form-1'}
+        first = self.client.post(self.url, form, content_type='application/x-www-form-urlencoded', headers=headers)
+        second = self.client.post(self.url, form, content_type='application/x-www-form-urlencoded', headers=headers)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(self.openai.chat.completions.create.call_count, 1)
+
+    def test_per_process_cache_is_flagged_at_startup(self):
+        self.assertEqual([warning.id for warning in check_session_cache(None)], ['data.W001'])
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name}
+        with override_settings(CACHES={'default': shared}):
+            self.assertEqual(check_session_cache(None), [])
+
+    def test_duplicates_wait_for_the_request_in_flight(self):
+        body = json.dumps({'query': 'Hello', 'session_id': 'session-1'}).encode()
+        scope = idempotency.scope_key('session-1', 'retry-1')
+        lock = idempotency.CacheLock(idempotency.IN_FLIGHT_PREFIX + scope)
+        self.assertTrue(lock.try_acquire())
+
+        def finish():
+            response = HttpResponse(b'{"response": "done"}', content_type='application/json')
+            fingerprint = hashlib.blake2b(body, digest_size=16).hexdigest()
+            session_cache().set(idempotency.RESULT_PREFIX + scope, idempotency.make_record(response, fingerprint))
+            lock.release()
+
+        timer = threading.Timer(0.2, finish)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        response = self.interact()
+        self.assertEqual(response.json(), {'response': 'done'})
+        self.openai.chat.completions.create.assert_not_called()
+
+    @override_settings(TURN_LOCK_TIMEOUT=0.3)
+    def test_waiting_for_the_session_does_not_use_up_the_in_flight_marker(self):
+        lock = idempotency.CacheLock(idempotency.SESSION_LOCK_PREFIX + 'session-1', timeout=60)
+        self.assertTrue(lock.try_acquire())
+        timer = threading.Timer(0.25, lock.release)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        in_flight = idempotency.IN_FLIGHT_PREFIX + idempotency.scope_key('session-1', 'retry-1')
+        held = []
+
+        def complete(**kwargs):
+            time.sleep(0.15)  # Past the marker's timeout counted from before the wait
+            held.append(session_cache().get(in_flight) is not None)
+            return chat_completion('Hi, I need a wheel.')
+
+        self.openai.chat.completions.create.side_effect = complete
+        self.assertEqual(self.interact().status_code, 200)
+        self.assertEqual(held, [True])
+
+    @override_settings(TURN_LOCK_TIMEOUT=0.2)
+    def test_turns_of_one_session_run_one_at_a_time(self):
+        lock = idempotency.CacheLock(idempotency.SESSION_LOCK_PREFIX + 'session-1', timeout=60)
+        self.assertTrue(lock.try_acquire())
+        self.assertEqual(self.interact(key=None).status_code, 409)
+        lock.release()
+        self.assertEqual(self.interact(key=None).status_code, 200)
+        # Failed turns are not stored, and the lock is free again afterwards
+        self.openai.chat.completions.create.side_effect = RuntimeError('upstream down')
+        self.assertEqual(self.interact(query='Which one?', key='retry-3').status_code, 500)
+        self.openai.chat.completions.create.side_effect = None
+        self.assertEqual(self.interact(query='Which one?', key='retry-3').status_code, 200)
+
+
+class ContextWindowTests(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create(session_id='session-1')
+        self.history = [{'seq': 1, 'role': 'system', 'content': 'You are a customer.'}]
+        for number in range(2, 42, 2):
+            self.history += [
+                {'seq': number, 'role': 'user', 'content': f'Question {number} ' + 'word ' * 20},
+                {'seq': number + 1, 'role': 'assistant', 'content': f'Answer {number} ' + 'word ' * 20},
+            ]
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens('Is it AT467532?'), 5)
+        self.assertEqual(estimate_tokens(''), 0)
+
+    @override_settings(PROMPT_TOKEN_BUDGET=300, PROMPT_RECENT_TURNS=6, PROMPT_SUMMARY_TOKENS=80)
+    def test_window_stays_under_the_budget(self):
+        window = fit_history(self.conversation, self.history)
+        self.assertEqual(window[0], self.history[0])
+        self.assertLessEqual(sum(message_tokens(message) for message in window), 300)
+        self.assertEqual(window[-1], self.history[-1])
+        self.assertLessEqual(estimate_tokens(self.conversation.prompt_summary), 80)
+        self.assertIn('Answer 34', self.conversation.prompt_summary)
+        self.assertNotIn('Question 2 ', self.conversation.prompt_summary)
+
+    @override_settings(PROMPT_TOKEN_BUDGET=10000, PROMPT_RECENT_TURNS=2, PROMPT_SUMMARY_TOKENS=1000)
+    def test_summary_is_updated_incrementally(self):
+        fit_history(self.conversation, self.history[:9])
+        self.assertEqual(self.conversation.prompt_summary_through, 5)
+        with mock.patch('data.context_window.summarize_message', wraps=summarize_message) as summarize:
+            window = fit_history(self.conversation, self.history[:11])
+        # Only the turn that just left the window is summarized
+        self.assertEqual(summarize.call_count, 2)
+        self.assertEqual(self.conversation.prompt_summary_through, 7)
+        self.assertEqual([message['seq'] for message in window[2:]], [8, 9, 10, 11])
+
+
+@override_settings(SESSION_FLUSH_INTERVAL=0)
+class WarmPoolTests(TestCase):
+    def setUp(self):
+        session_cache().clear()
+        workbook = make_workbook({'ST873088': [part_row('AT467532', breadcrumb='Wheels > Rim')]})
+        self.machine_model = import_workbook(workbook, FILENAME).machine_model
+        challenge_sampler.invalidate()
+        part_number_matchers.invalidate()
+
+        self.pool_client = mock.MagicMock()
+        self.pool_client.chat.completions.create.return_value = chat_completion('Hi, I need a wheel for my truck.')
+        synthesis_patch = mock.patch('data.warm_pool.synthesize_speech', return_value=b'POOLED')
+        synthesis_patch.start()
+        self.addCleanup(synthesis_patch.stop)
+        for target, kwargs in [
+            ('data.speech.synthesize_speech_with_elevenlabs', {'side_effect': fake_synthesis}),
+            ('data.speech.audio_cache', {'new': AudioCache(max_memory_bytes=1024)}),
+        ]:
+            patcher = mock.patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        client_patch = mock.patch('data.views.client')
+        self.openai = client_patch.start()
+        self.addCleanup(client_patch.stop)
+
+    def test_refill_tops_up_to_the_target(self):
+        self.assertEqual(refill(self.pool_client, target=3), 3)
+        self.assertEqual(refill(self.pool_client, target=3), 0)
+        opening = OpeningTurn.objects.first()
+        self.assertEqual(opening.part.part_number, 'AT467532')
+        self.assertTrue(opening.serial_number.startswith('D'))
+        self.assertEqual([item['role'] for item in opening.history], ['system'] * 3)
+
+    def test_first_turn_claims_a_pooled_opening(self):
+        refill(self.pool_client, target=2)
+        response = self.client.post(
+            '/api/interact-with-ai', {'query': 'Hello', 'session_id': 'session-1'}, content_type='application/json'
+        )
+        data = response.json()
+        self.assertEqual(data['response'], 'Hi, I need a wheel for my truck.')
+        self.assertEqual(data['animation'], 'Talking')
+        self.assertEqual(base64.b64decode(data['audio']), b'POOLED')
+        self.openai.chat.completions.create.assert_not_called()
+        self.assertEqual(OpeningTurn.objects.count(), 1)
+
+        conversation = Conversation.objects.get()
+        self.assertEqual(conversation.expected_part_number, 'AT467532')
+        self.assertEqual(
+            list(conversation.messages.values_list('role', flat=True)), ['system', 'system', 'system', 'user', 'assistant']
+        )
+
+    def test_first_message_that_is_not_a_greeting_is_answered_by_the_model(self):
+        self.assertTrue(all(map(is_opening_query, ['', 'Hello', 'hi there!', 'Good morning.'])))
+        self.assertFalse(any(map(is_opening_query, ['Hello, is it AT467532?', 'What part do you need?', 'hi 123'])))
+
+        refill(self.pool_client, target=1)
+        self.openai.chat.completions.create.return_value = chat_completion('I need the rim for my 260E.')
+        response = self.client.post(
+            '/api/interact-with-ai', {'query': 'What part do you need?', 'session_id': 'session-1'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.json()['response'], 'I need the rim for my 260E.')
+        self.assertEqual(self.openai.chat.completions.create.call_args.kwargs['messages'][-1]['content'], 'What part do you need?')
+        self.assertEqual(OpeningTurn.objects.count(), 1)
+
+    def test_claims_are_oldest_first_until_the_pool_is_empty(self):
+        refill(self.pool_client, target=2)
+        first, second = OpeningTurn.objects.values_list('id', flat=True)
+        self.assertEqual(claim_opening_turn().id, first)
+        self.assertEqual(claim_opening_turn().id, second)
+        self.assertIsNone(claim_opening_turn())
+
+    def test_reimport_drops_the_machine_models_openings(self):
+        refill(self.pool_client, target=2)
+        workbook = make_workbook({'ST873088': [part_row('AT467532', description='2 - Wheel', breadcrumb='Wheels > Rim')]})
+        import_workbook(workbook, FILENAME)
+        self.assertFalse(OpeningTurn.objects.exists())
+
+
+@override_settings(SESSION_FLUSH_INTERVAL=0)
+class InteractWithAIAsyncTests(AsyncTurnTestCase):
+    def test_turns_match_the_sync_endpoint(self):
+        self.openai.chat.completions.create.return_value = chat_completion('Hi, I need a wheel.')
+        first = self.interact('Hello').json()
+        self.assertEqual([item['role'] for item in first['history']], ['user', 'assistant'])
+        self.assertEqual(base64.b64decode(first['audio']), b'RIFF')
+
+        self.openai.chat.completions.create.return_value = chat_completion('That is correct, thank you!')
+        response = self.interact('It is AT467532')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['part_number_correct'])
+        self.assertEqual(Message.objects.count(), 7)
+
+    def test_rejects_missing_query_and_non_post(self):
+        self.assertEqual(self.interact('').status_code, 400)
+        self.assertEqual(self.client.get('/api/interact-with-ai-async').status_code, 405)
+
+
+def stream_chunks(*deltas, error=None):
+    async def chunks():
+        for delta in deltas:
+            yield mock.Mock(choices=[mock.Mock(delta=mock.Mock(content=delta))])
+        if error is not None:
+            raise error
+    return chunks()
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split('\n\n'):
+        event, data = block.split('\n')
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+class UpstreamClientTests(TestCase):
+    async def test_lifespan_shutdown_closes_the_pooled_clients(self):
+        http_client = get_http_client()
+        self.assertIs(get_http_client(), http_client)
+        application = mock.AsyncMock()
+        sent = []
+
+        async def send(message):
+            sent.append(message['type'])
+        messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+        await with_lifespan(application)({'type': 'lifespan'}, mock.AsyncMock(side_effect=messages), send)
+
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertTrue(http_client.is_closed)
+        self.assertIsNot(get_http_client(), http_client)
+        application.assert_not_called()
+        await close_clients()
+
+        await with_lifespan(application)({'type': 'http'}, None, None)
+        application.assert_awaited_once_with({'type': 'http'}, None, None)
+
+
+@override_settings(SESSION_FLUSH_INTERVAL=0)
+class StreamingTests(AsyncTurnTestCase):
+    def test_sentence_splitter_waits_for_complete_sentences(self):
+        splitter = SentenceSplitter()
+        self.assertEqual(splitter.feed('Hi, I need part 1.5 inch bolt'), [])
+        self.assertEqual(splitter.feed('s. Can you help'), ['Hi, I need part 1.5 inch bolts.'])
+        self.assertEqual(splitter.feed(' me? Ok. Thanks '), ['Can you help me?'])
+        self.assertEqual(splitter.flush(), ['Ok. Thanks'])
+
+    async def test_stream_sends_text_then_audio_per_sentence(self):
+        self.openai.chat.completions.create.return_value = stream_chunks(
+            'Hi there, I need a wheel. ', 'It is for my dump truck', '.'
+        )
+        response = await self.async_client.post(
+            '/api/interact-with-ai-async', {'query': 'Hello', 'session_id': 'session-1', 'stream': True},
+            content_type='application/json'
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        events = parse_events(body)
+
+        self.assertEqual(events[0][0], 'start')
+        self.assertEqual(events[0][1]['animation'], 'Talking')
+        audio = [data for event, data in events if event == 'audio']
+        self.assertEqual([item['text'] for item in audio], ['Hi there, I need a wheel.', 'It is for my dump truck.'])
+        self.assertEqual([item['index'] for item in audio], [0, 1])
+        self.assertEqual(events[-1][0], 'done')
+        self.assertEqual(events[-1][1]['response'], 'Hi there, I need a wheel. It is for my dump truck.')
+        self.assertEqual(await Message.objects.acount(), 5)
+
+    async def test_streamed_turn_is_replayed_whole(self):
+        self.openai.chat.completions.create.return_value = stream_chunks('Hi there, I need a wheel.')
+        body = {'query': 'Hello', 'session_id': 'session-1', 'stream': True}
+        headers = {'Idempotency-Key': 'retry-1'}
+        first = await self.async_client.post(
+            '/api/interact-with-ai-async', body, content_type='application/json', headers=headers
+        )
+        streamed = b''.join([chunk async for chunk in first.streaming_content])
+        second = await self.async_client.post(
+            '/api/interact-with-ai-async', body, content_type='application/json', headers=headers
+        )
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.content, streamed)
+        self.assertEqual(self.openai.chat.completions.create.call_count, 1)
+
+    async def test_stream_that_failed_midway_is_run_again_on_retry(self):
+        body = {'query': 'Hello', 'session_id': 'session-1', 'stream': True}
+        headers = {'Idempotency-Key': 'retry-1'}
+        self.openai.chat.completions.create.side_effect = [
+            stream_chunks('Hi there, ', error=RuntimeError('connection reset')),
+            stream_chunks('Hi there, I need a wheel.'),
+        ]
+        first = await self.async_client.post(
+            '/api/interact-with-ai-async', body, content_type='application/json', headers=headers
+        )
+        events = parse_events(b''.join([chunk async for chunk in first.streaming_content]).decode())
+        self.assertEqual((first.status_code, events[-1][0]), (200, 'error'))
+
+        second = await self.async_client.post(
+            '/api/interact-with-ai-async', body, content_type='application/json', headers=headers
+        )
+        self.assertFalse(second.has_header('Idempotent-Replayed'))
+        events = parse_events(b''.join([chunk async for chunk in second.streaming_content]).decode())
+        self.assertEqual(events[-1][0], 'done')
+        self.assertEqual(self.openai.chat.completions.create.call_count, 2)
+
+    async def test_stream_that_is_never_read_frees_the_session_when_closed(self):
+        self.openai.chat.completions.create.return_value = stream_chunks('Hi there, I need a wheel.')
+        response = await self.async_client.post(
+            '/api/interact-with-ai-async', {'query': 'Hello', 'session_id': 'session-1', 'stream': True},
+            content_type='application/json', headers={'Idempotency-Key': 'retry-1'}
+        )
+        session_lock = idempotency.SESSION_LOCK_PREFIX + 'session-1'
+        self.assertIsNotNone(await session_cache().aget(session_lock))
+        await sync_to_async(response.close)()
+        self.assertIsNone(await session_cache().aget(session_lock))
+        self.assertIsNone(await session_cache().aget(idempotency.IN_FLIGHT_PREFIX + idempotency.scope_key('session-1', 'retry-1')))
+
+    async def test_graded_turn_streams_the_fixed_reply(self):
+        self.openai.chat.completions.create.return_value = stream_chunks('Hi, I need a wheel.')
+        first = await self.async_client.post(
+            '/api/interact-with-ai-async', {'query': 'Hello', 'session_id': 'session-1', 'stream': True},
+            content_type='application/json'
+        )
+        self.assertEqual(parse_events(b''.join([chunk async for chunk in first.streaming_content]).decode())[-1][0], 'done')
+        self.openai.chat.completions.create.reset_mock()
+
+        response = await self.async_client.post(
+            '/api/interact-with-ai-async', {'query': 'AT467532', 'session_id': 'session-1', 'stream': True},
+            content_type='application/json'
+        )
+        events = parse_events(b''.join([chunk async for chunk in response.streaming_content]).decode())
+        self.assertEqual(events[0][1]['animation'], 'Clapping')
+        self.assertEqual([data['text'] for event, data in events if event == 'audio'], ['That is correct, thank you!'])
+        self.assertEqual((events[-1][1]['response'], events[-1][1]['facial_expression']), ('That is correct, thank you!', 'smile'))
+        self.openai.chat.completions.create.assert_not_called()
+
+
+def sine_wav(seconds=1.0, rate=24000, frequency=440):
+    t = np.arange(int(seconds * rate)) / rate
+    samples = (np.sin(2 * np.pi * frequency * t) * 0.5 * 32767).astype('<i2')
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(rate)
+        wav_file.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+class AudioEncodingTests(TestCase):
+    def test_pcm16_downsamples_to_mono_at_the_requested_rate(self):
+        audio, content_type = encode_audio(sine_wav(rate=24000), parse_audio_options({'audio_format': 'pcm16'}))
+        samples, rate = decode_wav(audio)
+        self.assertEqual(rate, 16000)
+        self.assertEqual(len(samples), 16000)
+        self.assertAlmostEqual(float(np.abs(samples[100:-100]).max()), 0.5, places=1)
+
+    def test_mulaw_matches_g711_reference_values(self):
+        self.assertEqual(list(mulaw_encode(np.array([0.0, 1.0, -1.0]))), [0xFF, 0x80, 0x00])
+        audio, content_type = encode_audio(sine_wav(), AudioOptions(format='mulaw', sample_rate=8000))
+        self.assertEqual(content_type, 'audio/wav; codecs=7')
+        self.assertEqual(len(audio), 44 + 8000)
+
+    def test_audio_that_is_not_a_wav_is_passed_through(self):
+        for audio_format in ('pcm16', 'mulaw'):
+            options = parse_audio_options({'audio_format': audio_format})
+            self.assertEqual(encode_audio(b'ID3 not a wav', options), (b'ID3 not a wav', 'audio/wav'))
+            with mock.patch('data.audio.decode_wav', wraps=decode_wav) as decode:
+                fields, audio = audio_fields(b'ID3 not a wav', options, clip_url=None)
+            self.assertEqual(decode.call_count, 1)
+            self.assertEqual(audio, b'ID3 not a wav')
+            self.assertEqual(fields['audio_format'], 'audio/wav')
+            self.assertEqual(fields['viseme_data'], {'visemes': []})
+
+    def test_rejects_unknown_options(self):
+        for data in ({'audio_format': 'mp3'}, {'audio_delivery': 'email'}, {'sample_rate': 16000},
+                     {'audio_format': 'pcm16', 'sample_rate': 'fast'}):
+            with self.assertRaises(ValueError):
+                parse_audio_options(data)
+
+
+class VisemeTests(TestCase):
+    def test_silence_and_voiced_audio_get_distinct_cues(self):
+        rate = 16000
+        t = np.arange(rate) / rate
+        samples = np.where(t < 0.5, 0.0, 0.5 * np.sin(2 * np.pi * 300 * t)).astype(np.float32)
+        cues = extract_visemes(samples, rate)
+
+        self.assertEqual(cues[0], {'audio_offset': 0, 'viseme_id': 0})
+        voiced = [cue for cue in cues if cue['audio_offset'] >= 520]
+        self.assertTrue(voiced)
+        self.assertTrue(all(cue['viseme_id'] == 8 for cue in voiced))
+        # Cues repeat within the avatar's 100ms display window
+        offsets = [cue['audio_offset'] for cue in cues]
+        self.assertLessEqual(max(np.diff(offsets)), 100)
+
+    def test_response_carries_visemes_for_the_audio(self):
+        audio, _ = audio_fields(sine_wav(seconds=0.5), AudioOptions(), clip_url=None)
+        self.assertTrue(audio['viseme_data']['visemes'])
+        self.assertEqual(audio_fields(b'RIFF', AudioOptions(), clip_url=None)[0]['viseme_data'], {'visemes': []})
+
+
+
+@override_settings(
+    AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing',
+    AWS_S3_REGION_NAME='us-east-1', AWS_STORAGE_BUCKET_NAME='trainer-assets'
+)
+class AvatarAssetTests(TestCase):
+    # Presigning is local to botocore, so a client with dummy credentials stands in for S3
+    def setUp(self):
+        assets._s3_client = None
+        presigned_urls.clear()
+        self.addCleanup(presigned_urls.clear)
+        self.addCleanup(setattr, assets, '_s3_client', None)
+
+    def test_one_request_returns_every_asset_from_a_shared_client(self):
+        with mock.patch('data.assets.boto3.client', wraps=boto3.client) as make_client:
+            first = self.client.get('/api/avatar-assets').json()
+            second = self.client.get('/api/avatar-assets').json()
+            self.client.get('/api/avatar_presigned_url')
+
+        self.assertEqual(make_client.call_count, 1)
+        self.assertEqual(first['urls'], second['urls'])
+        self.assertIn('trainer-assets', first['urls']['avatar'])
+        self.assertIn('Avatar/animations.glb', first['urls']['animations'])
+        self.assertLessEqual(second['expires_in'], 900)
+
+    def test_urls_are_signed_again_shortly_before_they_expire(self):
+        now = [0.0]
+        cache = PresignedUrlCache(clock=lambda: now[0])
+        with mock.patch('data.assets.get_s3_client') as get_client:
+            get_client.return_value.generate_presigned_url.side_effect = lambda *args, **kwargs: f'url-{now[0]}'
+            self.assertEqual(cache.get('Avatar/maleAvatar.glb'), ('url-0.0', 900))
+            now[0] = 800.0
+            self.assertEqual(cache.get('Avatar/maleAvatar.glb'), ('url-0.0', 100))
+            now[0] = 850.0
+            self.assertEqual(cache.get('Avatar/maleAvatar.glb'), ('url-850.0', 900))
+
+
+
+class CatalogAPITests(TestCase):
+    def setUp(self):
+        for index in range(6):
+            machine_model = MachineModel.objects.create(
+                model_name=f'Model {index}', serial_number_start='D000001', serial_number_end='000100'
+            )
+            Part.objects.bulk_create([
+                Part(machine_model=machine_model, part_number=f'AT{index}{number:04d}', description='Bolt',
+                     quantity_required=1, breadcrumb='Frame')
+                for number in range(4)
+            ])
+
+    def test_machine_models_are_paged_without_parts_by_default(self):
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/machine-models/?page_size=4').json()
+        self.assertEqual(len(data['results']), 4)
+        self.assertNotIn('parts', data['results'][0])
+
+        rest = self.client.get(data['next']).json()
+        self.assertEqual([item['model_name'] for item in rest['results']], ['Model 4', 'Model 5'])
+        self.assertIsNone(rest['next'])
+
+    def test_expanded_parts_cost_one_query_per_page(self):
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/machine-models/?expand=parts&page_size=3').json()
+        self.assertEqual([len(item['parts']) for item in data['results']], [4, 4, 4])
+
+        with self.assertNumQueries(2):
+            self.client.get('/api/machine-models/?expand=parts&page_size=6')
+
+    def test_fields_selects_the_serialized_fields(self):
+        data = self.client.get('/api/parts/?fields=id,part_number&page_size=2').json()
+        self.assertEqual(set(data['results'][0]), {'id', 'part_number'})
+
+    def test_importer_bookkeeping_is_not_serialized(self):
+        part = self.client.get('/api/parts/?page_size=1').json()['results'][0]
+        self.assertEqual(set(part), {
+            'id', 'machine_model', 'part_number', 'description', 'quantity_required', 'canvas_image', 'breadcrumb'
+        })
+
+    def test_parts_are_paged_and_scoped_by_machine_model(self):
+        machine_model = MachineModel.objects.get(model_name='Model 2')
+        with self.assertNumQueries(1):
+            data = self.client.get(f'/api/parts/?machine_model={machine_model.pk}').json()
+        self.assertEqual({item['part_number'] for item in data['results']}, {f'AT2{number:04d}' for number in range(4)})
+        self.assertEqual(self.client.get('/api/parts/?machine_model=abc').status_code, 400)
+
+
+BOOK = '260E Articulated Dump Truck (PIN: 1DW260EX_ _D677827-708124) - PC15085'
+
+
+def scraped_breadcrumb(*segments):
+    # The scraper repeats the book and sections before the assembly
+    prefix = ' > '.join((BOOK,) + segments[:-1])
+    return f'{prefix} > {prefix} > {segments[-1]}expand_more'
+
+
+class CatalogTreeTests(TestCase):
+    def setUp(self):
+        rim = scraped_breadcrumb('1 Wheels, Tires and Tracks', '0110 Powered Wheels', '3-Piece Rim - ST873088')
+        hub = scraped_breadcrumb('1 Wheels, Tires and Tracks', '0110 Powered Wheels', 'Wheel Hub - ST873090')
+        cover = scraped_breadcrumb('04A Engine', '1109 Valve Cover - ST23118')
+        workbook = make_workbook({
+            'ST873088': [part_row('AT467532', breadcrumb=rim), part_row('AT4675', breadcrumb=rim)],
+            'ST873090': [part_row('AT441417', breadcrumb=hub)],
+            'ST23118': [part_row('R123456', breadcrumb=cover)],
+        })
+        self.machine_model = import_workbook(workbook, FILENAME).machine_model
+
+    def level(self, **params):
+        return self.client.get('/api/catalog-tree', {'machine_model': self.machine_model.pk, **params})
+
+    def test_parse_breadcrumb_drops_the_repeat_and_the_book(self):
+        self.assertEqual(
+            parse_breadcrumb(scraped_breadcrumb('1 Wheels', '0110 Rims', 'Rim - ST873088')),
+            ['1 Wheels', '0110 Rims', 'Rim - ST873088']
+        )
+        self.assertEqual(parse_breadcrumb('Wheels > Rim'), ['Wheels', 'Rim'])
+        self.assertEqual(parse_breadcrumb(None), [])
+
+    def test_import_builds_the_tree_with_subtree_counts(self):
+        counts = dict(CatalogNode.objects.filter(machine_model=self.machine_model).values_list('name', 'part_count'))
+        self.assertEqual(counts, {
+            '1 Wheels, Tires and Tracks': 3, '0110 Powered Wheels': 3, '3-Piece Rim - ST873088': 2,
+            'Wheel Hub - ST873090': 1, '04A Engine': 1, '1109 Valve Cover - ST23118': 1,
+        })
+        self.assertEqual(Part.objects.get(part_number='AT4675').catalog_node.name, '3-Piece Rim - ST873088')
+
+    def test_drilling_down_costs_a_fixed_number_of_queries(self):
+        with self.assertNumQueries(1):
+            roots = self.level().json()
+        self.assertEqual([node['name'] for node in roots['children']], ['1 Wheels, Tires and Tracks', '04A Engine'])
+        self.assertEqual(roots['parts'], {'next': None, 'previous': None, 'results': []})
+
+        section = roots['children'][0]
+        with self.assertNumQueries(2):
+            data = self.level(node=section['id']).json()
+        group = data['children'][0]
+        self.assertEqual((group['name'], group['child_count'], group['part_count']), ('0110 Powered Wheels', 2, 3))
+
+        data = self.level(node=group['id']).json()
+        rim = data['children'][0]
+        with self.assertNumQueries(4):
+            data = self.level(node=rim['id']).json()
+        self.assertEqual([node['name'] for node in data['ancestors']], ['1 Wheels, Tires and Tracks', '0110 Powered Wheels'])
+        self.assertEqual(data['children'], [])
+        self.assertEqual([part['part_number'] for part in data['parts']['results']], ['AT467532', 'AT4675'])
+
+    def test_parts_of_a_node_are_paged(self):
+        rim = CatalogNode.objects.get(name='3-Piece Rim - ST873088')
+        data = self.level(node=rim.pk, page_size=1).json()
+        self.assertEqual([part['part_number'] for part in data['parts']['results']], ['AT467532'])
+        self.assertEqual(data['ancestors'][-1]['name'], '0110 Powered Wheels')
+
+        data = self.client.get(data['parts']['next']).json()
+        self.assertEqual([part['part_number'] for part in data['parts']['results']], ['AT4675'])
+        self.assertIsNone(data['parts']['next'])
+        self.assertEqual(data['node']['id'], rim.pk)
+
+    def test_trees_past_the_path_encoding_are_rejected(self):
+        axle = scraped_breadcrumb('1 Wheels, Tires and Tracks', '0120 Axles', 'Axle - ST873100')
+        workbook = make_workbook({'ST873100': [part_row('AT500000', breadcrumb=axle)]})
+        with mock.patch('data.catalog_tree.MAX_POSITION', 1), self.assertRaisesMessage(ValueError, "'0120 Axles'"):
+            import_workbook(workbook, FILENAME)
+        with mock.patch('data.catalog_tree.MAX_DEPTH', 2), self.assertRaisesMessage(ValueError, 'levels deep'):
+            import_workbook(workbook, FILENAME)
+        self.assertFalse(Part.objects.filter(part_number='AT500000').exists())
+
+    def test_reimport_rebuilds_the_tree(self):
+        cover = scraped_breadcrumb('04A Engine', '1109 Valve Cover - ST23118')
+        import_workbook(make_workbook({'ST23118': [part_row('R123456', breadcrumb=cover)]}), FILENAME)
+        self.assertEqual(
+            list(CatalogNode.objects.values_list('name', 'part_count')),
+            [('04A Engine', 1), ('1109 Valve Cover - ST23118', 1)]
+        )
+
+    def test_reimport_keeps_the_ids_of_surviving_nodes(self):
+        before = dict(CatalogNode.objects.values_list('name', 'id'))
+        paths = dict(CatalogNode.objects.values_list('name', 'path'))
+        rim = scraped_breadcrumb('1 Wheels, Tires and Tracks', '0110 Powered Wheels', '3-Piece Rim - ST873088')
+        axle = scraped_breadcrumb('1 Wheels, Tires and Tracks', '0120 Axles', 'Axle - ST873100')
+        import_workbook(make_workbook({
+            'ST873088': [part_row('AT467532', breadcrumb=rim), part_row('AT4675', breadcrumb=rim)],
+            'ST873100': [part_row('AT500000', breadcrumb=axle), part_row('R123456')],
+        }), FILENAME)
+
+        nodes = {node.name: node for node in CatalogNode.objects.all()}
+        for name in ['1 Wheels, Tires and Tracks', '0110 Powered Wheels', '3-Piece Rim - ST873088']:
+            self.assertEqual((nodes[name].id, nodes[name].path), (before[name], paths[name]))
+        self.assertNotIn('04A Engine', nodes)
+        self.assertNotIn('Wheel Hub - ST873090', nodes)
+        self.assertEqual(nodes['0120 Axles'].path, paths['0110 Powered Wheels'][:-5] + '0002.')
+        self.assertEqual((nodes['1 Wheels, Tires and Tracks'].part_count, nodes['0110 Powered Wheels'].child_count), (3, 1))
+        self.assertEqual(Part.objects.get(part_number='R123456').catalog_node.name, 'Wheels')
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get('/api/catalog-tree').status_code, 400)
+        self.assertEqual(self.level(node='abc').status_code, 400)
+        other = MachineModel.objects.create(model_name='310L', serial_number_start='F000001', serial_number_end='000100')
+        node = CatalogNode.objects.filter(machine_model=self.machine_model).first()
+        response = self.client.get('/api/catalog-tree', {'machine_model': other.pk, 'node': node.pk})
+        self.assertEqual(response.status_code, 404)
+
+
+class PartSearchTests(TestCase):
+    def setUp(self):
+        self.machine_model = MachineModel.objects.create(
+            model_name='260E Articulated Dump Truck', serial_number_start='D677827', serial_number_end='708124'
+        )
+        other = MachineModel.objects.create(model_name='310L Backhoe', serial_number_start='F000001', serial_number_end='000100')
+        Part.objects.bulk_create([
+            Part(machine_model=self.machine_model, part_number='AT467532', description='1 - Wheel', quantity_required=6, breadcrumb='Wheels > Rim'),
+            Part(machine_model=self.machine_model, part_number='AT4675', description='Wheel Nut', quantity_required=12, breadcrumb='Wheels > Rim'),
+            Part(machine_model=self.machine_model, part_number='R123456', description='Hydraulic Hose', quantity_required=2, breadcrumb='Hydraulics'),
+            Part(machine_model=other, part_number='AT467533', description='Wheel', quantity_required=4, breadcrumb='Wheels'),
+        ])
+        search_indexes.invalidate()
+        self.addCleanup(search_indexes.invalidate)
+
+    def search(self, q, **params):
+        return self.client.get('/api/parts/search/', {'machine_model': self.machine_model.pk, 'q': q, **params})
+
+    def test_exact_part_number_ranks_first_and_results_stay_in_the_machine_model(self):
+        results = self.search('AT4675').json()['results']
+        self.assertEqual([result['part_number'] for result in results], ['AT4675', 'AT467532'])
+
+        results = self.search('at-467532').json()['results']
+        self.assertEqual(results[0]['part_number'], 'AT467532')
+
+    def test_description_words_match(self):
+        results = self.search('hose', limit=1).json()['results']
+        self.assertEqual([result['part_number'] for result in results], ['R123456'])
+
+    def test_rejects_unscoped_or_empty_searches(self):
+        self.assertEqual(self.client.get('/api/parts/search/', {'q': 'wheel'}).status_code, 400)
+        self.assertEqual(self.search('').status_code, 400)
+        self.assertEqual(self.search('wheel', limit=0).status_code, 400)
+
+    def test_index_is_dropped_when_the_machine_model_is_reimported(self):
+        self.search('wheel')
+        Part.objects.create(machine_model=self.machine_model, part_number='AT999999', description='Spare Wheel', quantity_required=1)
+        self.assertNotIn('AT999999', [result['part_number'] for result in self.search('spare').json()['results']])
+
+        catalog_imported.send(sender=Part, result=SimpleNamespace(machine_model=self.machine_model))
+        self.assertEqual(self.search('spare').json()['results'][0]['part_number'], 'AT999999')
+
+    def test_indexes_are_built_ahead_of_the_first_search(self):
+        with mock.patch('data.search.connection.close'):
+            build_search_indexes()
+        self.assertIsNotNone(search_indexes.index(self.machine_model.pk)._index)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('AT4675').json()['results'][0]['part_number'], 'AT4675')
+
+    @skipUnless(connection.vendor == 'postgresql', 'Needs pg_trgm')
+    def test_postgres_search_finds_the_same_best_match_as_the_in_process_index(self):
+        index = build_ngram_index(self.machine_model.pk)
+        for query in ['AT4675', 'at-467532', 'AT 4675 32', 'hose', 'wheel nut', 'hydraulic-hose']:
+            expected = [result['part_number'] for result in index.search(query)]
+            found = [result['part_number'] for result in search_parts_postgres(self.machine_model.pk, query)]
+            self.assertEqual(found[:1], expected[:1], query)
+
+
+class IndexRegistryTests(TestCase):
+    def slow_registry(self, ttl=300):
+        started, release = threading.Event(), threading.Event()
+        builds = []
+
+        def build(machine_model_id):
+            builds.append(machine_model_id)
+            name = f'index {machine_model_id} #{len(builds)}'
+            if machine_model_id == 1:
+                started.set()
+                release.wait(5)
+            return name
+
+        self.addCleanup(release.set)
+        return MachineModelIndexRegistry(build, ttl=ttl), started, release
+
+    def test_a_slow_build_does_not_hold_up_other_machine_models(self):
+        registry, started, release = self.slow_registry()
+        builder = threading.Thread(target=registry.get, args=(1,))
+        builder.start()
+        started.wait(5)
+        self.assertEqual(registry.get(2), 'index 2 #2')
+        release.set()
+        builder.join(5)
+        self.assertEqual(registry.get(1), 'index 1 #1')
+
+    def test_expired_index_is_served_while_it_is_rebuilt_in_the_background(self):
+        registry, started, release = self.slow_registry(ttl=0)
+        release.set()
+        self.assertEqual(registry.get(1), 'index 1 #1')
+        release.clear()
+        started.clear()
+        self.assertEqual(registry.get(1), 'index 1 #1')
+        started.wait(5)
+        self.assertEqual(registry.get(1), 'index 1 #1')
+        release.set()
+        deadline = time.monotonic() + 5
+        while registry.get(1) == 'index 1 #1' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertNotEqual(registry.get(1), 'index 1 #1')
+
+    def test_build_that_raced_an_invalidation_is_not_kept(self):
+        registry, started, release = self.slow_registry()
+        builder = threading.Thread(target=registry.get, args=(1,))
+        builder.start()
+        started.wait(5)
+        registry.invalidate(1)
+        release.set()
+        builder.join(5)
+        self.assertIsNone(registry.index(1)._index)
+
+    @override_settings(CATALOG_INDEX_TTL=0)
+    def test_ttl_defaults_to_the_setting(self):
+        builds = []
+        index = LazyIndex(lambda: builds.append(1) or len(builds))
+        self.assertEqual(index.get(), 1)
+        index.get()
+        deadline = time.monotonic() + 5
+        while len(builds) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(builds), 2)
+
+
+class SerialIndexTests(TestCase):
+    def setUp(self):
+        serial_index.invalidate()
+        self.addCleanup(serial_index.invalidate)
+
+    def test_parses_price_book_ranges(self):
+        self.assertEqual(parse_serial_range('D677827', '708124'), SerialRange('D', 677827, 708124))
+        self.assertEqual(parse_serial_range('123456', '234567'), SerialRange('', 123456, 234567))
+        self.assertIsNone(parse_serial_range('D708124', '677827'))
+        self.assertIsNone(parse_serial_range('D677827', 'F708124'))
+
+    def test_overlapping_ranges_and_full_pins_resolve(self):
+        index = SerialIndex.build_from([('D', 100, 900, 1), ('D', 200, 300, 2), ('D', 400, 500, 3), ('', 100, 900, 4)])
+        self.assertEqual(sorted(SerialIndex.search(index, 'D000250')), [1, 2])
+        self.assertEqual(SerialIndex.search(index, '1DW260EXCD000450'), [3, 1])
+        self.assertEqual(SerialIndex.search(index, '000450'), [4])
+        self.assertEqual(SerialIndex.search(index, 'D000950'), [])
+
+    def test_imported_price_books_are_found_by_serial(self):
+        import_workbook(make_workbook({'Wheels': [part_row('AT467532')]}), FILENAME)
+        machine_model = MachineModel.objects.get()
+        self.assertEqual((machine_model.serial_prefix, machine_model.serial_low, machine_model.serial_high), ('D', 677827, 708124))
+        self.assertEqual(lookup_in_database('D680000'), [machine_model.pk])
+
+        data = self.client.get('/api/machine-models/by-serial/', {'serial': '1DW260EXCD680000'}).json()
+        self.assertEqual([item['id'] for item in data['results']], [machine_model.pk])
+        self.assertEqual(self.client.get('/api/machine-models/by-serial/', {'serial': 'F680000'}).json()['results'], [])
+        self.assertEqual(self.client.get('/api/machine-models/by-serial/').status_code, 400)
+
+    def test_database_answers_while_the_index_is_rebuilt(self):
+        import_workbook(make_workbook({'Wheels': [part_row('AT467532')]}), FILENAME)
+        machine_model = MachineModel.objects.get()
+        serial_index.index._building.acquire()
+        self.addCleanup(serial_index.index._building.release)
+        with mock.patch.object(serial_index, 'build') as build, self.assertNumQueries(1):
+            self.assertEqual(serial_index.lookup('D680000'), [machine_model.pk])
+        build.assert_not_called()
+
+
+class SpeechTests(TestCase):
+    def test_audio_is_not_spooled_by_default(self):
+        with override_settings(TTS_SPOOL_DIR=None):
+            self.assertIsNone(spool_audio(b'RIFF'))
+
+    def test_spool_evicts_oldest_files_past_its_size_bound(self):
+        with tempfile.TemporaryDirectory() as spool_dir, override_settings(TTS_SPOOL_DIR=spool_dir, TTS_SPOOL_MAX_BYTES=25):
+            first = spool_audio(b'a' * 10)
+            os.utime(first, (0, 0))
+            second = spool_audio(b'b' * 10)
+            os.utime(second, (1, 1))
+            third = spool_audio(b'c' * 10)
+
+            self.assertFalse(os.path.exists(first))
+            self.assertTrue(os.path.exists(second))
+            self.assertTrue(os.path.exists(third))
+
+
+class AudioCacheTests(TestCase):
+    def test_key_ignores_whitespace_but_not_voice_or_format(self):
+        key = AudioCache.make_key('That is correct,  thank you! ', 'voice', 'wav')
+        self.assertEqual(key, AudioCache.make_key('That is correct, thank you!', 'voice', 'wav'))
+        self.assertNotEqual(key, AudioCache.make_key('That is correct, thank you!', 'other', 'wav'))
+        self.assertNotEqual(key, AudioCache.make_key('That is correct, thank you!', 'voice', 'mp3'))
+
+    def test_memory_lru_evicts_least_recently_used(self):
+        cache = AudioCache(max_memory_bytes=20)
+        cache.set('a', b'a' * 10)
+        cache.set('b', b'b' * 10)
+        cache.get('a')
+        cache.set('c', b'c' * 10)
+
+        self.assertEqual(cache.get('a'), b'a' * 10)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_disk_entries_survive_memory_eviction_and_are_size_bounded(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = AudioCache(directory=directory, max_memory_bytes=10, max_disk_bytes=25)
+            cache.set('a', b'a' * 10)
+            cache.set('b', b'b' * 10)
+            self.assertEqual(cache.get('a'), b'a' * 10)
+            self.assertEqual(cache.stats()['disk_hits'], 1)
+
+            os.utime(os.path.join(directory, 'b.wav'), (0, 0))
+            cache.set('c', b'c' * 10)
+            self.assertEqual(sorted(os.listdir(directory)), ['a.wav', 'c.wav'])
+
+    def test_repeated_phrases_are_synthesized_once(self):
+        with mock.patch('data.speech.audio_cache', AudioCache(max_memory_bytes=1024)), \
+                mock.patch('data.speech.synthesize_speech_with_elevenlabs', side_effect=fake_synthesis) as synthesis:
+            synthesize_speech('That is correct, thank you!')
+            synthesize_speech('That is correct, thank you!')
+        self.assertEqual(synthesis.call_count, 1)
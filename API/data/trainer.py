@@ -0,0 +1,206 @@
+# trainer.py
+import random
+from dataclasses import dataclass, field
+
+from django.utils import timezone
+
+from .challenges import CHAT_MODEL, challenge_history, sample_challenge
+from .context_window import fit_history, message_tokens
+from .grading import CORRECT, WRONG_PART, grade_answer
+from .models import Message
+from .responder import Reply, facial_expression_for, fast_reply, opening_reply
+from .serializers import MessageSerializer
+from .sessions import SESSION_TTL, SessionState, discard_session, load_session, save_session
+from .warm_pool import claim_opening_turn, is_opening_query
+
+HISTORY_MODES = ('full', 'delta')
+
+
+@dataclass
+class HistoryOptions:
+    """
+    Which messages a turn's response carries back. Clients that already hold
+    the transcript ask for only the messages after their last one, by its
+    `seq`.
+    """
+    mode: str = 'full'
+    last_message_seq: int = None
+
+
+def parse_turn_options(data):
+    """Read the history options of an interact-with-ai request."""
+    history_mode = data.get('history', 'full')
+    if history_mode not in HISTORY_MODES:
+        raise ValueError("history must be 'full' or 'delta'.")
+    last_message_seq = data.get('last_message_seq')
+    if last_message_seq is not None:
+        try:
+            last_message_seq = int(last_message_seq)
+        except (TypeError, ValueError):
+            raise ValueError("last_message_seq must be an integer.")
+    return HistoryOptions(mode=history_mode, last_message_seq=last_message_seq)
+
+
+@dataclass
+class Turn:
+    """State of one interact-with-ai exchange between loading and saving."""
+    conversation: SessionState
+    user_query: str
+    created: bool
+    history: list  # Every stored message, for the response
+    prompt_history: list = field(default_factory=list)  # The part of it sent to the model
+    part_number_correct: bool = None
+    verdict: str = None  # See data.grading; None on the first turn
+    mentioned: list = field(default_factory=list)
+    reply: Reply = None  # Fixed reply for a graded turn or a pooled opening; the model is not called
+    audio: bytes = None  # Speech of a pooled opening, synthesized ahead of time
+    expected_part_number: str = None
+    part_location: str = None
+    ai_response: str = ''
+    new_history: list = field(default_factory=list)
+    history_options: HistoryOptions = field(default_factory=HistoryOptions)
+
+    def turn_messages(self):
+        messages = []
+        # The verdict is decided here, the model only has to voice it
+        if self.verdict == CORRECT:
+            messages.append({"role": Message.SYSTEM, "content": (
+                "The representative's next message gives the correct part number. "
+                "Respond with: 'That is correct, thank you!'"
+            )})
+        elif self.verdict == WRONG_PART:
+            messages.append({"role": Message.SYSTEM, "content": (
+                f"The representative's next message gives {', '.join(self.mentioned)}, which is not the part you need. "
+                "Respond with: 'I just looked it up and that is not the correct part I am looking for!'"
+            )})
+        return messages + [{"role": Message.USER, "content": self.user_query}]
+
+    def prompt_messages(self):
+        history = [{"role": item["role"], "content": item["content"]} for item in self.prompt_history]
+        return history + self.turn_messages()
+
+    def facial_expression(self):
+        if self.reply is not None:
+            return self.reply.facial_expression
+        return facial_expression_for(self.ai_response, self.verdict)
+
+
+def begin_turn(session_id, user_query, history_options=None):
+    """
+    Load or start the session's conversation, grade the user's message
+    against the stored challenge and collect the history for the prompt.
+    A session that is already cached costs one query, for its stored version.
+    """
+    history_options = history_options or HistoryOptions()
+    conversation = load_session(session_id)
+    created = conversation is None
+
+    # Reset session if older than a day
+    if not created and conversation.last_interaction < timezone.now() - SESSION_TTL:
+        discard_session(session_id)
+        created = True
+    if created:
+        conversation = SessionState(session_id=session_id)
+
+    turn = Turn(
+        conversation=conversation, user_query=user_query, created=created, history=[], history_options=history_options
+    )
+
+    # Randomly select a machine model and a part to ask about if it's the first interaction
+    if created or not conversation.expected_part_number:
+        # A pre-generated opening from the warm pool saves the model and speech calls; it
+        # answers a greeting, so a first message that asks something goes to the model
+        opening = claim_opening_turn() if is_opening_query(user_query) else None
+        if opening is not None:
+            machine_model, part_to_find, serial_number = opening.machine_model, opening.part, opening.serial_number
+            history = opening.history
+            turn.reply = opening_reply(opening.text)
+            turn.audio = bytes(opening.audio) if opening.audio else None
+        else:
+            machine_model, part_to_find, serial_number = sample_challenge()
+            history = challenge_history(machine_model, serial_number, part_to_find)
+
+        conversation.machine_model_id = machine_model.pk
+        conversation.expected_part_id = part_to_find.pk
+        conversation.expected_part_number = part_to_find.part_number
+        conversation.part_location = part_to_find.breadcrumb
+        conversation.serial_number = serial_number
+        conversation.incorrect_attempts = 0
+        conversation.add_messages(history)
+        save_session(conversation)
+    else:
+        # The challenge state lives on the conversation itself
+        turn.expected_part_number = conversation.expected_part_number
+        turn.part_location = conversation.part_location
+
+        # Check which catalog part numbers the user's query names; questions don't count as attempts
+        grade = grade_answer(conversation.machine_model_id, turn.expected_part_number, user_query)
+        turn.verdict = grade.verdict
+        turn.mentioned = grade.mentioned
+        turn.part_number_correct = grade.verdict == CORRECT
+        attempts = conversation.incorrect_attempts
+        if grade.verdict == CORRECT:
+            conversation.incorrect_attempts = 0
+        elif grade.verdict == WRONG_PART:
+            conversation.incorrect_attempts += 1
+            attempts += 1
+        turn.reply = fast_reply(grade.verdict, attempts)
+
+        if conversation.incorrect_attempts >= 3:
+            turn.part_number_correct = False
+
+    turn.history = list(conversation.messages)
+    if turn.reply is None:
+        turn.prompt_history = fit_history(
+            conversation, turn.history, reserved=sum(message_tokens(message) for message in turn.turn_messages())
+        )
+    return turn
+
+
+def finish_turn(turn, ai_response):
+    """Append the user's message and AI's response to the history."""
+    turn.ai_response = ai_response
+    turn.new_history = turn.conversation.add_messages([
+        {"role": Message.USER, "content": turn.user_query},
+        {"role": Message.ASSISTANT, "content": ai_response},
+    ])
+    # A solved challenge ends the session's busy stretch, so write it out now
+    save_session(turn.conversation, flush=turn.verdict == CORRECT)
+
+
+def select_animation(turn):
+    if turn.reply is not None:
+        return turn.reply.animation
+    elif turn.created or 'more info' in turn.user_query.lower():
+        return "Talking"
+    elif turn.part_number_correct:
+        return random.choice(["Clapping", "ThoughtfulHeadNod"])
+    return "ThoughtfulHeadShake"
+
+
+def response_history(turn):
+    # System messages hold the challenge and never go back to the client
+    options = turn.history_options
+    if options.last_message_seq is not None:
+        history = [item for item in turn.history + turn.new_history if item["seq"] > options.last_message_seq]
+    elif options.mode == 'delta':
+        history = turn.new_history
+    else:
+        history = turn.history + turn.new_history
+    return MessageSerializer([item for item in history if item["role"] != Message.SYSTEM], many=True).data
+
+
+def build_payload(turn, audio):
+    """`audio` holds the response's audio fields, see data.audio.audio_fields."""
+    return {
+        "response": turn.ai_response,
+        "session_id": turn.conversation.session_id,
+        "history": response_history(turn),
+        "part_number_correct": turn.part_number_correct,
+        "answer_verdict": turn.verdict,
+        "expected_part_number": turn.expected_part_number,
+        "part_location": turn.part_location,
+        **audio,
+        "facial_expression": turn.facial_expression(),
+        "animation": select_animation(turn),
+    }
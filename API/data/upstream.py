@@ -0,0 +1,68 @@
+# upstream.py
+import asyncio
+import weakref
+
+import httpx
+from django.conf import settings
+from openai import AsyncOpenAI
+
+# One pooled client set per event loop, since httpx connections are bound to the
+# loop they were opened on. Under an ASGI server that means one set per worker.
+_clients = weakref.WeakKeyDictionary()
+
+
+def _create_clients():
+    http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(settings.UPSTREAM_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=settings.UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+    )
+    openai_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, http_client=http_client)
+    return http_client, openai_client
+
+
+def _get_clients():
+    loop = asyncio.get_running_loop()
+    clients = _clients.get(loop)
+    if clients is None:
+        clients = _clients[loop] = _create_clients()
+    return clients
+
+
+def get_http_client():
+    """Shared async HTTP client for upstream APIs such as ElevenLabs."""
+    return _get_clients()[0]
+
+
+def get_async_openai():
+    """Shared async OpenAI client, pooled on the same HTTP client."""
+    return _get_clients()[1]
+
+
+async def close_clients():
+    clients = _clients.pop(asyncio.get_running_loop(), None)
+    if clients is not None:
+        await clients[0].aclose()
+
+
+def with_lifespan(application):
+    """
+    Wrap an ASGI application to answer the server's lifespan events, closing
+    the worker's pooled clients on shutdown. Django's ASGI handler does not
+    handle lifespan itself. The shutdown event arrives on the loop the
+    requests were served on, so it closes that loop's clients.
+    """
+    async def app(scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await application(scope, receive, send)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await close_clients()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    return app
@@ -1,22 +1,34 @@
-import base64
-import os
-import random
+import json
 import uuid
-import boto3
-import requests
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db.models import Prefetch
 from django.middleware.csrf import get_token
-from django.http import JsonResponse
-from django.utils import timezone
-from datetime import timedelta
+from django.views.decorators.csrf import csrf_exempt
+from django.urls import reverse
+from django.views.decorators.http import require_GET, require_POST
 from openai import OpenAI
 from django.conf import settings
 from rest_framework import viewsets
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
 from rest_framework import status
-from data.models import MachineModel, Part, Conversation
-from data.serializers import MachineModelSerializer, PartSerializer
+from rest_framework.exceptions import NotFound, ValidationError
+from data.assets import AVATAR_ASSETS, PRESIGNED_URL_MARGIN, asset_urls, presigned_urls
+from data.audio import audio_fields, load_clip, multipart_response, parse_audio_options
+from data.catalog_tree import catalog_level
+from data.idempotency import serialized_turn
+from data.models import CatalogNode, MachineModel, Part
+from data.pagination import CatalogCursorPagination
+from data.serializers import MachineModelSerializer, PartSerializer, query_param_set
+from data.search import DEFAULT_LIMIT, MAX_LIMIT, search_parts
+from data.serials import parse_serial_query, serial_index
+from data.speech import asynthesize_speech, synthesize_speech
+from data.streaming import stream_turn
+from data.trainer import (
+    CHAT_MODEL, begin_turn, build_payload, finish_turn, parse_turn_options,
+)
+from data.upstream import get_async_openai
 import logging
 
 logger = logging.getLogger(__name__)
@@ -24,247 +36,261 @@ logger = logging.getLogger(__name__)
 # Initialize the OpenAI client
 client = OpenAI(api_key=settings.OPENAI_API_KEY)
 
+def select_fields(queryset, request):
+    # Load only the columns ?fields= asks for; the cursor always needs the id
+    fields = query_param_set(request, 'fields')
+    if fields is None:
+        return queryset
+    columns = {field.name for field in queryset.model._meta.concrete_fields} & fields
+    return queryset.only('id', *columns)
+
 class MachineModelViewSet(viewsets.ModelViewSet):
+    """Machine models, paged by cursor. Parts are nested only with ?expand=parts."""
     queryset = MachineModel.objects.all()
     serializer_class = MachineModelSerializer
+    pagination_class = CatalogCursorPagination
+
+    def get_queryset(self):
+        queryset = select_fields(super().get_queryset(), self.request)
+        if 'parts' in (query_param_set(self.request, 'expand') or set()):
+            # One query for the parts of the whole page
+            queryset = queryset.prefetch_related(Prefetch('parts', queryset=Part.objects.order_by('id')))
+        return queryset
+
+    @action(detail=False, methods=['get'], url_path='by-serial')
+    def by_serial(self, request):
+        """Machine models whose PIN range covers ?serial=, given as a serial or a full PIN."""
+        serial = request.query_params.get('serial', '').strip()
+        if not parse_serial_query(serial):
+            raise ValidationError({'serial': 'A serial number or PIN is required.'})
+        ids = serial_index.lookup(serial)
+        machine_models = MachineModel.objects.in_bulk(ids)
+        found = [machine_models[pk] for pk in ids if pk in machine_models]
+        serializer = self.get_serializer(found, many=True)
+        return Response({'serial': serial, 'results': serializer.data})
 
 class PartViewSet(viewsets.ModelViewSet):
+    """Parts, paged by cursor and optionally scoped with ?machine_model=<id>."""
     queryset = Part.objects.all()
     serializer_class = PartSerializer
+    pagination_class = CatalogCursorPagination
+
+    def get_queryset(self):
+        queryset = select_fields(super().get_queryset(), self.request)
+        machine_model = self.request.query_params.get('machine_model')
+        if machine_model:
+            if not machine_model.isdigit():
+                raise ValidationError({'machine_model': 'Must be an integer id.'})
+            queryset = queryset.filter(machine_model_id=machine_model)
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked lookup by partial part number or description: ?machine_model=<id>&q=<text>."""
+        machine_model = request.query_params.get('machine_model', '')
+        query = request.query_params.get('q', '').strip()
+        limit = request.query_params.get('limit', str(DEFAULT_LIMIT))
+        if not machine_model.isdigit():
+            raise ValidationError({'machine_model': 'Must be an integer id.'})
+        if not query:
+            raise ValidationError({'q': 'A search term is required.'})
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_LIMIT:
+            raise ValidationError({'limit': f'Must be between 1 and {MAX_LIMIT}.'})
+        return Response({'results': search_parts(int(machine_model), query, int(limit))})
+
+@api_view(['GET'])
+def catalog_tree(request):
+    """
+    One level of a machine model's catalog: ?machine_model=<id>, then
+    &node=<id> to drill down. The node's own parts are paged by cursor.
+    """
+    machine_model = request.query_params.get('machine_model', '')
+    node = request.query_params.get('node', '')
+    if not machine_model.isdigit():
+        raise ValidationError({'machine_model': 'Must be an integer id.'})
+    if node and not node.isdigit():
+        raise ValidationError({'node': 'Must be an integer id.'})
+    try:
+        level = catalog_level(int(machine_model), int(node) if node else None)
+    except CatalogNode.DoesNotExist:
+        raise NotFound('No such node in this machine model.')
+    paginator = CatalogCursorPagination()
+    parts = paginator.paginate_queryset(level['parts'], request)
+    level['parts'] = {'next': paginator.get_next_link(), 'previous': paginator.get_previous_link(), 'results': parts}
+    return Response(level)
     
 def get_csrf_token(request):
     return JsonResponse({'csrfToken': get_token(request)})
     
 def avatar_presigned_url(request):
-    s3_client = boto3.client('s3',
-                             aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                             aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                             region_name=settings.AWS_S3_REGION_NAME)
-    # Construct the key for the S3 object
-    object_key = f'Avatar/maleAvatar.glb'
-    # print("Object Key for S3:", object_key)  # Logging the object key
-
-    presigned_url = s3_client.generate_presigned_url('get_object', Params={
-        'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
-        'Key': object_key}, ExpiresIn=900)
-    # print("Generated Presigned URL:", presigned_url)  # Logging the presigned URL
-    return JsonResponse({'url': presigned_url})
+    url, _ = presigned_urls.get(AVATAR_ASSETS['avatar'])
+    return JsonResponse({'url': url})
 
 def animation_presigned_url(request):
-    s3_client = boto3.client('s3',
-                             aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-                             aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-                             region_name=settings.AWS_S3_REGION_NAME)
-    # Construct the key for the S3 object
-    object_key = f'Avatar/animations.glb'
-    # print("Object Key for S3:", object_key)  # Logging the object key
-
-    presigned_url = s3_client.generate_presigned_url('get_object', Params={
-        'Bucket': settings.AWS_STORAGE_BUCKET_NAME,
-        'Key': object_key}, ExpiresIn=900)
-    # print("Generated Presigned URL:", presigned_url)  # Logging the presigned URL
-    return JsonResponse({'url': presigned_url})
-
-def generate_random_serial_number(serial_start, serial_end):
-    if not serial_start or not serial_end:
-        raise ValueError("Serial start and end cannot be empty")
-
-    # Check if serial numbers are numeric
-    if serial_start.isdigit() and serial_end.isdigit():
-        return str(random.randint(int(serial_start), int(serial_end))).zfill(6)
-    else:
-        # Handle case where serial start has a prefix
-        prefix = ''
-        if not serial_start[0].isdigit():
-            prefix = serial_start[0]
-            serial_start = serial_start[1:]
-
-            if serial_start.isdigit() and serial_end.isdigit():
-                # Ensure that the numeric part of serial_end is greater than serial_start
-                if int(serial_end) > int(serial_start):
-                    numeric_part = str(random.randint(int(serial_start), int(serial_end))).zfill(5)
-                    return prefix + numeric_part
-                else:
-                    raise ValueError("Invalid range for alphanumeric serial numbers")
-            else:
-                raise ValueError("Invalid serial number format after removing prefix")
-        else:
-            raise ValueError("Invalid serial number format")
-        
-def synthesize_speech_with_elevenlabs(text, api_key, output_file_path, voice_id="pNInz6obpgDQGcFmaJgB"):
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-    headers = {
-        "xi-api-key": api_key,
-        "Content-Type": "application/json"
-    }
-    data = {
-        "text": text,
-        "output_format": "wav"
-    }
+    url, _ = presigned_urls.get(AVATAR_ASSETS['animations'])
+    return JsonResponse({'url': url})
 
-    try:
-        response = requests.post(url, headers=headers, json=data)
+def avatar_assets(request):
+    """Signed URLs for all avatar assets in one call."""
+    assets = asset_urls()
+    response = JsonResponse(assets)
+    response['Cache-Control'] = f"private, max-age={max(assets['expires_in'] - PRESIGNED_URL_MARGIN, 0)}"
+    return response
 
-        if response.status_code == 200:
-            os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-            with open(output_file_path, 'wb') as audio_file:
-                audio_file.write(response.content)
-            return {"status": "success"}
-        else:
-            error_message = response.json().get('message', 'Unknown error')
-            logger.error(f"Error: {error_message}, Status Code: {response.status_code}, Response: {response.text}")
-            raise Exception(f"Error: {error_message}")
+def clip_url_builder(request):
+    return lambda token: request.build_absolute_uri(reverse('audio_clip', args=[token]))
 
-    except requests.RequestException as e:
-        logger.error(f"RequestException: {str(e)}, Response: {e.response.text if e.response else 'No response'}")
-        raise Exception(f"RequestException: {str(e)}")
-    
+@require_GET
+def audio_clip(request, token):
+    """Serve a clip stored for audio_delivery 'url' until its short TTL runs out."""
+    clip = load_clip(token)
+    if clip is None:
+        return JsonResponse({"error": "Audio not found or expired."}, status=status.HTTP_404_NOT_FOUND)
+    audio, content_type = clip
+    response = HttpResponse(audio, content_type=content_type)
+    response['Cache-Control'] = f'private, max-age={settings.AUDIO_URL_TTL}'
+    return response
+
+@serialized_turn
 @api_view(['POST'])
 def interact_with_ai(request):
     user_query = request.data.get('query', '')
     session_id = request.data.get('session_id', str(uuid.uuid4()))
-    incorrect_attempts = request.data.get('incorrect_attempts', 0)
 
     if not user_query:
         return Response({"error": "Query is required."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        history_options = parse_turn_options(request.data)
+        audio_options = parse_audio_options(request.data)
+    except ValueError as ve:
+        return Response({"error": str(ve)}, status=status.HTTP_400_BAD_REQUEST)
     
     logger.info(f"User Query: {user_query}")
     logger.info(f"Session ID: {session_id}")
-    logger.info(f"Incorrect Attempts: {incorrect_attempts}")
     logger.info(f"Headers: {request.headers}")
 
-    print(f"User Query: {user_query}")
-    print(f"Session ID: {session_id}")
-    print(f"Incorrect Attempts: {incorrect_attempts}")
-    print(f"Headers: {request.headers}")
+    try:
+        turn = begin_turn(session_id, user_query, history_options)
 
+        if turn.reply is not None:
+            # Graded turns have a fixed answer, see data.responder
+            ai_response = turn.reply.text
+        else:
+            # Generate a prompt for the AI including the conversation history and the user's message
+            try:
+                chat_completion = client.chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=turn.prompt_messages()
+                )
+            except Exception as e:
+                logger.error(f"Error with OpenAI API: {str(e)}")
+                return Response({"error": "Error with AI service"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    try:
-        # Get or create the conversation
-        conversation, created = Conversation.objects.get_or_create(session_id=session_id)
-        now = timezone.now()
+            ai_response = chat_completion.choices[0].message.content.strip()
         
-        # Reset session if older than a day
-        if not created and conversation.last_interaction < now - timedelta(days=1):
-            conversation.delete()
-            conversation = Conversation.objects.create(session_id=session_id)
-            created = True
+        # Generate audio and visemes; the audio goes straight from memory to the response
+        try:
+            audio_content = turn.audio if turn.audio is not None else synthesize_speech(ai_response)
+            audio, encoded_audio = audio_fields(audio_content, audio_options, clip_url_builder(request))
+        except Exception as e:
+            logger.error(f"Error synthesizing speech: {str(e)}")
+            return Response({"error": "Error with speech synthesis"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
-        # Randomly select a machine model if it's the first interaction
-        if created or not conversation.history:
-            machine_model = random.choice(MachineModel.objects.all())
-            serial_number = generate_random_serial_number(machine_model.serial_number_start, machine_model.serial_number_end)
-            
-            # Randomly select a part to ask about
-            part_to_find = random.choice(Part.objects.filter(machine_model=machine_model))
-            
-            initial_prompt = (
-                f"You are a customer who owns a machine model '{machine_model.model_name}' with the serial number '{serial_number}'. "
-                f"You need a part but don't know the part number. The part you need is described as '{part_to_find.description}'. "
-                f"Location of the part: '{part_to_find.breadcrumb}'. "
-                "Ask the support representative to help you identify the correct part number based on the description of the part you need. "
-                "Do not reveal the part number, but check if the representative provides the correct one."
-                "If the representative provides an incorrect part number respond with: 'I just looked it up and that is not the correct part I am looking for!' "
-                "If the representative provides a correct part number, then respond with: 'That is correct, thank you!' "
-                "Also, provide a facial expression that matches your response. The available facial expressions are: smile, sad, angry, surprised, funnyFace, and default. "
-            )
-            conversation.history.append({"id": str(uuid.uuid4()), "role": "system", "content": initial_prompt})
-            conversation.history.append({"id": str(uuid.uuid4()), "role": "system", "content": f"Expected part number: {part_to_find.part_number}"})
-            conversation.history.append({"id": str(uuid.uuid4()), "role": "system", "content": f"Part location: {part_to_find.breadcrumb}"})
-            conversation.save()
-        else:
-            # Retrieve the expected part number from the conversation history
-            expected_part_number = next(
-                (item["content"].split(": ")[1] for item in conversation.history if "Expected part number" in item["content"]),
-                None
-            )
-            part_location = next(
-                (item["content"].split(": ", 1)[1] for item in conversation.history if "Part location" in item["content"]),
-                None
-            )
+        finish_turn(turn, ai_response)
+        payload = build_payload(turn, audio)
+        if audio_options.delivery == 'multipart':
+            return multipart_response(payload, encoded_audio, audio["audio_format"])
+        return Response(payload, status=status.HTTP_200_OK)
 
-            # Check if the user's query contains the correct part number
-            part_number_correct = expected_part_number in user_query
-            if part_number_correct:
-                incorrect_attempts = 0
-            else:
-                incorrect_attempts = request.data.get('incorrect_attempts', 0) + 1
+    except MachineModel.DoesNotExist:
+        logger.error("Machine model not found.")
+        return Response({"error": "Machine model not found."}, status=status.HTTP_404_NOT_FOUND)
+    except ValueError as ve:
+        logger.error(f"ValueError: {str(ve)}")
+        return Response({"error": str(ve)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Exception: {str(e)}")
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            if incorrect_attempts >= 3:
-                part_number_correct = False
-        
-        # Append user's message to the history
-        conversation.history.append({"id": str(uuid.uuid4()), "role": "user", "content": user_query})
-                
-        # Generate a prompt for the AI including the conversation history
-        try:
-            chat_completion = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=conversation.history
+
+@serialized_turn
+@csrf_exempt
+@require_POST
+async def interact_with_ai_async(request):
+    """
+    Same turn as interact_with_ai, for ASGI workers. The OpenAI and ElevenLabs
+    calls are awaited on a pooled connection set, so a worker keeps serving
+    other sessions while one waits on its upstream APIs. With "stream": true
+    the turn is sent as server-sent events, sentence by sentence.
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Request body must be JSON."}, status=status.HTTP_400_BAD_REQUEST)
+
+    user_query = data.get('query', '')
+    session_id = data.get('session_id', str(uuid.uuid4()))
+
+    if not user_query:
+        return JsonResponse({"error": "Query is required."}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        history_options = parse_turn_options(data)
+        audio_options = parse_audio_options(data)
+        if data.get('stream') and audio_options.delivery == 'multipart':
+            raise ValueError("audio_delivery 'multipart' is not available when streaming.")
+    except ValueError as ve:
+        return JsonResponse({"error": str(ve)}, status=status.HTTP_400_BAD_REQUEST)
+
+    logger.info(f"User Query: {user_query}")
+    logger.info(f"Session ID: {session_id}")
+
+    try:
+        turn = await sync_to_async(begin_turn)(session_id, user_query, history_options)
+
+        if data.get('stream'):
+            response = StreamingHttpResponse(
+                stream_turn(turn, get_async_openai(), audio_options, clip_url_builder(request)),
+                content_type='text/event-stream'
             )
-        except Exception as e:
-            logger.error(f"Error with OpenAI API: {str(e)}")
-            return Response({"error": "Error with AI service"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'  # Keep proxies from buffering the events
+            return response
 
-        
-        ai_response = chat_completion.choices[0].message.content.strip()
-        
-        # Determine facial expression based on AI response
-        facial_expression = "default"
-        if "correct, thank you" in ai_response.lower():
-            facial_expression = "smile"
-        elif "not the correct part" in ai_response.lower():
-            facial_expression = "sad"
-        
-        if created or 'more info' in user_query.lower():
-            selected_animation = "Talking"
-        elif 'part_number_correct' in locals() and part_number_correct:
-            selected_animation = random.choice(["Clapping", "ThoughtfulHeadNod"])
+        if turn.reply is not None:
+            ai_response = turn.reply.text
         else:
-            selected_animation = "ThoughtfulHeadShake"
-        
-        # Append AI's response to the history
-        conversation.history.append({"id": str(uuid.uuid4()), "role": "assistant", "content": ai_response})
-                
-        # Generate audio and visemes
-        audio_file_name = f"message_{uuid.uuid4()}.wav"
-        output_file_path = os.path.join('audios', audio_file_name)
+            try:
+                chat_completion = await get_async_openai().chat.completions.create(
+                    model=CHAT_MODEL,
+                    messages=turn.prompt_messages()
+                )
+            except Exception as e:
+                logger.error(f"Error with OpenAI API: {str(e)}")
+                return JsonResponse({"error": "Error with AI service"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            ai_response = chat_completion.choices[0].message.content.strip()
+
         try:
-            viseme_data = synthesize_speech_with_elevenlabs(ai_response, settings.ELEVEN_LABS_API_KEY, output_file_path)
+            audio_content = turn.audio if turn.audio is not None else await asynthesize_speech(ai_response)
+            audio, encoded_audio = await sync_to_async(audio_fields, thread_sensitive=False)(
+                audio_content, audio_options, clip_url_builder(request)
+            )
         except Exception as e:
             logger.error(f"Error synthesizing speech: {str(e)}")
-            return Response({"error": "Error with speech synthesis"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return JsonResponse({"error": "Error with speech synthesis"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        try:
-            with open(output_file_path, 'rb') as audio_file:
-                audio_content = audio_file.read()
-            audio_base64 = base64.b64encode(audio_content).decode('utf-8')
-        except Exception as e:
-            logger.error(f"Error reading audio file: {str(e)}")
-            return Response({"error": "Error processing audio file"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        # Save the updated conversation history
-        conversation.save()
-        
-        return Response({
-            "response": ai_response, 
-            "session_id": session_id, 
-            "history": conversation.history,
-            "part_number_correct": part_number_correct if 'part_number_correct' in locals() else None,
-            "expected_part_number": expected_part_number if 'expected_part_number' in locals() else None,
-            "part_location": part_location if 'part_location' in locals() else None,
-            "audio": audio_base64,
-            "facial_expression": facial_expression,
-            "animation": selected_animation,
-            "viseme_data": viseme_data  # Include viseme_data if necessary
-        }, status=status.HTTP_200_OK)
+        await sync_to_async(finish_turn)(turn, ai_response)
+        payload = build_payload(turn, audio)
+        if audio_options.delivery == 'multipart':
+            return multipart_response(payload, encoded_audio, audio["audio_format"])
+        return JsonResponse(payload, status=status.HTTP_200_OK)
 
     except MachineModel.DoesNotExist:
         logger.error("Machine model not found.")
-        return Response({"error": "Machine model not found."}, status=status.HTTP_404_NOT_FOUND)
+        return JsonResponse({"error": "Machine model not found."}, status=status.HTTP_404_NOT_FOUND)
     except ValueError as ve:
         logger.error(f"ValueError: {str(ve)}")
-        return Response({"error": str(ve)}, status=status.HTTP_400_BAD_REQUEST)
+        return JsonResponse({"error": str(ve)}, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         logger.error(f"Exception: {str(e)}")
-        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,101 @@
+# visemes.py
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Azure viseme ids, as mapped to morph targets in the avatar
+SILENCE = 0
+OPEN_MID = 1     # æ ə ʌ
+OPEN = 2         # ɑ
+MID_FRONT = 4    # ɛ ʊ
+CLOSE_FRONT = 6  # j i ɪ
+ROUNDED = 7      # w u
+ROUND_OPEN = 8   # o
+SIBILANT = 15    # s z
+LABIODENTAL = 18  # f v
+BILABIAL = 21    # p b m
+
+FRAME_MS = 20
+HOP_MS = 10
+MIN_RUN_FRAMES = 3  # Shorter runs are folded into the one before them
+# The avatar shows a cue for 100ms after its offset, so long runs are repeated
+CUE_REPEAT_MS = 80
+SILENCE_RATIO = 0.06  # Frame RMS below this share of the clip's loudest frame
+CLOSED_RATIO = 0.2
+
+
+def frame_features(samples, rate):
+    """
+    Per-frame RMS energy, spectral centroid and the share of energy above
+    3kHz, computed over all frames of the clip at once.
+    """
+    window = max(int(rate * FRAME_MS / 1000), 2)
+    hop = max(int(rate * HOP_MS / 1000), 1)
+    if len(samples) < window:
+        samples = np.pad(samples, (0, window - len(samples)))
+
+    frames = sliding_window_view(samples, window)[::hop]
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+
+    power = np.square(np.abs(np.fft.rfft(frames * np.hanning(window).astype(np.float32), axis=1)))
+    freqs = np.fft.rfftfreq(window, 1 / rate)
+    total = power.sum(axis=1) + 1e-12
+    centroid = (power @ freqs) / total
+    high_ratio = power[:, freqs >= 3000].sum(axis=1) / total
+    return rms, centroid, high_ratio
+
+
+def classify_frames(rms, centroid, high_ratio):
+    """Map frame features onto a small set of visemes."""
+    loudness = rms / (rms.max() + 1e-12)
+    open_mouth = loudness > 0.5
+    conditions = [
+        loudness < SILENCE_RATIO,
+        (high_ratio > 0.5) & (centroid > 4000),
+        high_ratio > 0.5,
+        (loudness < CLOSED_RATIO) & (centroid < 1000),
+        centroid < 700,
+        centroid < 1500,
+        centroid < 2500,
+    ]
+    choices = [
+        SILENCE,
+        SIBILANT,
+        LABIODENTAL,
+        BILABIAL,
+        np.where(open_mouth, ROUND_OPEN, ROUNDED),
+        np.where(open_mouth, OPEN, OPEN_MID),
+        MID_FRONT,
+    ]
+    return np.select(conditions, choices, default=CLOSE_FRONT).astype(np.int8)
+
+
+def smooth(ids):
+    # Fold runs that are too short to read on the avatar into the previous run
+    starts = np.flatnonzero(np.diff(ids, prepend=-1))
+    lengths = np.diff(starts, append=len(ids))
+    run_ids = ids[starts]
+    short = lengths < MIN_RUN_FRAMES
+    short[0] = False
+    keep = np.maximum.accumulate(np.where(short, 0, np.arange(len(run_ids))))
+    return np.repeat(run_ids[keep], lengths)
+
+
+def extract_visemes(samples, rate):
+    """
+    Timestamped viseme cues for mono float samples, in the avatar's format:
+    [{"audio_offset": ms, "viseme_id": id}, ...]. A cue is emitted whenever
+    the viseme changes and every CUE_REPEAT_MS while it holds.
+    """
+    if len(samples) == 0:
+        return []
+    ids = smooth(classify_frames(*frame_features(samples, rate)))
+
+    frame = np.arange(len(ids))
+    run_start = np.maximum.accumulate(np.where(np.diff(ids, prepend=-1) != 0, frame, 0))
+    repeat = max(CUE_REPEAT_MS // HOP_MS, 1)
+    cues = np.flatnonzero((frame - run_start) % repeat == 0)
+    return [
+        {"audio_offset": int(offset), "viseme_id": int(viseme_id)}
+        for offset, viseme_id in zip(cues * HOP_MS, ids[cues])
+    ]
+
@@ -0,0 +1,69 @@
+# warm_pool.py
+import logging
+import re
+
+from django.conf import settings
+from django.db import transaction
+
+from .challenges import CHAT_MODEL, challenge_history, sample_challenge
+from .models import Message, OpeningTurn
+from .speech import synthesize_speech
+
+logger = logging.getLogger(__name__)
+
+OPENING_QUERY = "Hello"  # What the trainee is assumed to say first
+# Words of the first messages a pooled opening still answers; anything else goes to the model
+GREETING_WORDS = {'hello', 'hi', 'hey', 'hiya', 'howdy', 'greetings', 'good', 'morning', 'afternoon', 'evening', 'day', 'there'}
+
+
+def is_opening_query(text):
+    """Whether a session's first message is empty or only a greeting, which a pooled opening answers."""
+    words = re.findall(r'[a-z]+', (text or '').lower())
+    return all(word in GREETING_WORDS for word in words) and not re.search(r'\d', text or '')
+
+
+def generate_opening_turn(client):
+    """Sample a challenge and pre-generate its opening line and speech."""
+    machine_model, part_to_find, serial_number = sample_challenge()
+    history = challenge_history(machine_model, serial_number, part_to_find)
+    chat_completion = client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=history + [{"role": Message.USER, "content": OPENING_QUERY}]
+    )
+    text = chat_completion.choices[0].message.content.strip()
+    return OpeningTurn.objects.create(
+        machine_model=machine_model,
+        part=part_to_find,
+        serial_number=serial_number,
+        history=history,
+        text=text,
+        audio=synthesize_speech(text),
+    )
+
+
+def refill(client, target=None):
+    """Generate opening turns until the pool holds `target`; returns how many were added."""
+    target = settings.WARM_POOL_SIZE if target is None else target
+    missing = max(target - OpeningTurn.objects.count(), 0)
+    for _ in range(missing):
+        generate_opening_turn(client)
+    return missing
+
+
+def claim_opening_turn():
+    """
+    Take the oldest pooled opening turn, or None when the pool is empty.
+    Openings were generated for OPENING_QUERY; see is_opening_query.
+    skip_locked lets concurrent new sessions each claim a different row.
+    """
+    with transaction.atomic():
+        opening = (
+            OpeningTurn.objects.select_for_update(skip_locked=True)
+            .select_related('machine_model', 'part')
+            .order_by('id')
+            .first()
+        )
+        if opening is not None:
+            OpeningTurn.objects.filter(pk=opening.pk).delete()
+    return opening
+
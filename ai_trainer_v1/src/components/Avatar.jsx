@@ -172,6 +172,7 @@ export function Avatar(props) {
       setAnimation("Idle");
     }
     setFacialExpression(latestMessage.facialExpression || "");
+    setLipsync(latestMessage.viseme_data);
 
     if (currentAudio) {
       currentAudio.pause();
@@ -77,6 +77,7 @@ export const ChatProvider = ({ children }) => {
             query,
             session_id: sessionId,
             incorrect_attempts: incorrectAttempts,
+            history: "delta",
           }),
         }
       );
@@ -110,17 +111,10 @@ export const ChatProvider = ({ children }) => {
   const fetchSignedUrls = async () => {
     setModelLoading(true); // Set model loading to true when fetching URLs
     try {
-      const avatarResponse = await fetch(
-        `https://${backendUrl}/api/avatar_presigned_url`
-      );
-      const avatarData = await avatarResponse.json();
-      setAvatarUrl(avatarData.url);
-
-      const animationResponse = await fetch(
-        `https://${backendUrl}/api/animation_presigned_url`
-      );
-      const animationData = await animationResponse.json();
-      setAnimationUrl(animationData.url);
+      const response = await fetch(`https://${backendUrl}/api/avatar-assets`);
+      const data = await response.json();
+      setAvatarUrl(data.urls.avatar);
+      setAnimationUrl(data.urls.animations);
     } catch (error) {
       console.error("Error fetching signed URLs:", error);
     } finally {